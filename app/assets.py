@@ -0,0 +1,68 @@
+"""Static assets sent by the bot.
+
+Il template Excel viene generato una sola volta per processo; dopo il primo invio
+Telegram restituisce un `file_id` che viene riusato per tutti gli invii successivi,
+così il file non viene più ricaricato.
+"""
+import io
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+TEMPLATE_FILENAME = "template_scheda_allenamento.xlsx"
+
+def _create_template_excel() -> bytes:
+    """Create an Excel template with example data for workout plan import"""
+    import pandas as pd
+
+    # Create sample data for the template
+    data = {
+        'Allenamento': ['Giorno 1', 'Giorno 1', 'Giorno 1', 'Giorno 2', 'Giorno 2'],
+        'Esercizio': ['Panca piana', 'Squat', 'Stacco', 'Military Press', 'Trazioni'],
+        'Serie': [3, 4, 3, 4, 3],
+        'Ripetizioni': [8, 10, 8, 8, 'MAX'],
+        'Recupero': ['90s', '120s', '180s', '90s', '60s']
+    }
+
+    df = pd.DataFrame(data)
+
+    # Create Excel file in memory
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='Scheda Allenamento', index=False)
+        worksheet = writer.sheets['Scheda Allenamento']
+
+        # Ensure the columns are visible
+        for column in worksheet.columns:
+            max_length = max(len(str(cell.value)) for cell in column)
+            worksheet.column_dimensions[column[0].column_letter].width = min(max_length + 2, 50)
+
+    return output.getvalue()
+
+class DocumentAsset:
+    """A document built lazily once and then re-sent by Telegram `file_id`"""
+
+    def __init__(self, filename: str, build):
+        self.filename = filename
+        self._build = build
+        self._data: bytes | None = None
+        self.file_id: str | None = None
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = self._build()
+        return self._data
+
+    async def send(self, message: types.Message, **kwargs) -> types.Message:
+        if self.file_id:
+            try:
+                return await message.answer_document(self.file_id, **kwargs)
+            except TelegramBadRequest:
+                self.file_id = None  # file_id non più valido (es. token cambiato): si ricarica
+
+        sent = await message.answer_document(types.BufferedInputFile(self.data, filename=self.filename), **kwargs)
+        if sent and sent.document:
+            self.file_id = sent.document.file_id
+        return sent
+
+template_asset = DocumentAsset(TEMPLATE_FILENAME, _create_template_excel)
@@ -0,0 +1,120 @@
+"""Compaction of old workout logs into per-session rollups.
+
+Le serie più vecchie di COMPACT_AFTER_DAYS giorni (a giorni interi) vengono riassunte
+in `workout_rollups`, una riga per (utente, scheda, giorno, esercizio, data) con
+numero di serie, volume e top set, cioè esattamente quello che mostrano le pagine dei
+progressi. Le righe originali vengono spostate in `workout_log_archive` (su Postgres
+partizionata per mese, le partizioni sono create qui quando servono), così
+`workout_logs` resta piccola.
+
+La lettura è trasparente: i progressi (`app/progress.py`) uniscono log e rollup, i
+recap (`app/recaps.py`) leggono log e archivio con `log_history`.
+Da lanciare periodicamente con `python scripts/compact_logs.py`.
+"""
+import os
+from datetime import datetime, time, timedelta
+from sqlalchemy import Date, delete, func, insert, select, text, union_all
+from app.models import WorkoutLog, WorkoutLogArchive, WorkoutRollup
+
+COMPACT_AFTER_DAYS = int(os.getenv("COMPACT_AFTER_DAYS", "90"))
+COMPACT_BATCH_SIZE = int(os.getenv("COMPACT_BATCH_SIZE", "5000"))
+
+_LOG_COLUMNS = ("id", "ts", "user_id", "plan_id", "day", "exercise", "set_number", "weight", "weight_kg", "reps",
+                "import_key")
+_ROLLUP_COLUMNS = ("user_id", "plan_id", "day", "exercise", "session", "first_ts", "first_log_id",
+                   "sets", "volume", "weight", "weight_kg", "reps")
+
+def log_history(criteria):
+    """Hot and archived sets as one subquery; `criteria(model)` gives the filters for either table"""
+    return union_all(*(
+        select(*(getattr(model, c) for c in _LOG_COLUMNS)).where(*criteria(model))
+        for model in (WorkoutLog, WorkoutLogArchive)
+    )).subquery("log_history")
+
+def _rollup_select(batch):
+    """One row per (user, plan, day, exercise, date) of the logs matching `batch`"""
+    session = func.date(WorkoutLog.ts, type_=Date)
+    partition = (WorkoutLog.user_id, WorkoutLog.plan_id, WorkoutLog.day, WorkoutLog.exercise, session)
+    ranked = (
+        select(
+            WorkoutLog.user_id, WorkoutLog.plan_id, WorkoutLog.day, WorkoutLog.exercise,
+            session.label("session"),
+            func.min(WorkoutLog.ts).over(partition_by=partition).label("first_ts"),
+            func.first_value(WorkoutLog.id).over(
+                partition_by=partition, order_by=(WorkoutLog.ts, WorkoutLog.id)).label("first_log_id"),
+            func.count().over(partition_by=partition).label("sets"),
+            func.sum(WorkoutLog.weight_kg * WorkoutLog.reps).over(partition_by=partition).label("volume"),
+            WorkoutLog.weight, WorkoutLog.weight_kg, WorkoutLog.reps,
+            # stesso top set di app/progress.py: peso più alto, poi più reps
+            func.row_number().over(
+                partition_by=partition,
+                order_by=(WorkoutLog.weight_kg.desc().nulls_last(), WorkoutLog.reps.desc(), WorkoutLog.id),
+            ).label("rn"),
+        )
+        .where(*batch)
+        .subquery()
+    )
+    return select(*(ranked.c[c] for c in _ROLLUP_COLUMNS)).where(ranked.c.rn == 1)
+
+def _month_start(ts: datetime) -> datetime:
+    return datetime.combine(ts.date().replace(day=1), time.min)
+
+async def _ensure_partitions(db, first: datetime, last: datetime):
+    """Monthly partitions of workout_log_archive covering [first, last] (Postgres only)"""
+    month = _month_start(first)
+    while month <= last:
+        following = _month_start(month + timedelta(days=32))
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS workout_log_archive_{month:%Y%m} PARTITION OF workout_log_archive "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{following:%Y-%m-%d}')"
+        ))
+        month = following
+
+async def compact_logs(db, older_than: timedelta | None = None, batch_size: int = COMPACT_BATCH_SIZE,
+                       now: datetime | None = None) -> dict:
+    """Roll up and archive the logs older than `older_than` (default COMPACT_AFTER_DAYS).
+
+    Lavora a blocchi di `batch_size` log con un commit per blocco, così il job può
+    essere interrotto e rilanciato. Una sessione divisa tra due blocchi (o compattata
+    in due run) produce due rollup, che i progressi sommano. Restituisce il numero di
+    log spostati e di rollup scritti.
+    """
+    older_than = older_than if older_than is not None else timedelta(days=COMPACT_AFTER_DAYS)
+    cutoff = datetime.combine((now or datetime.utcnow()).date() - older_than, time.min)
+    stats = {"logs": 0, "rollups": 0}
+    # Il log con l'id più alto resta sempre: su SQLite gli id di una tabella svuotata
+    # ripartirebbero da 1, duplicando quelli già archiviati
+    newest = await db.scalar(select(func.max(WorkoutLog.id)))
+    if newest is None:
+        return stats
+    eligible = (WorkoutLog.ts < cutoff, WorkoutLog.id < newest)
+    partitioned = db.bind.dialect.name == "postgresql"
+
+    while True:
+        upper = await db.scalar(
+            select(WorkoutLog.id).where(*eligible).order_by(WorkoutLog.id).offset(batch_size - 1).limit(1)
+        )
+        batch = eligible + ((WorkoutLog.id <= upper,) if upper is not None else ())
+        first, last, count = (await db.execute(
+            select(func.min(WorkoutLog.ts), func.max(WorkoutLog.ts), func.count()).where(*batch)
+        )).one()
+        if not count:
+            break
+        if partitioned:
+            await _ensure_partitions(db, first, last)
+        rollups = await db.execute(insert(WorkoutRollup).from_select(_ROLLUP_COLUMNS, _rollup_select(batch)))
+        await db.execute(insert(WorkoutLogArchive).from_select(
+            _LOG_COLUMNS, select(*(getattr(WorkoutLog, c) for c in _LOG_COLUMNS)).where(*batch)
+        ))
+        await db.execute(delete(WorkoutLog).where(*batch))
+        await db.commit()
+        stats["logs"] += count
+        stats["rollups"] += rollups.rowcount
+        if upper is None:
+            break
+    return stats
+
+async def delete_history(db, user_id: int):
+    """Delete every set of the user: hot logs, archive and rollups (no commit)"""
+    for model in (WorkoutLog, WorkoutLogArchive, WorkoutRollup):
+        await db.execute(delete(model).where(model.user_id == user_id))
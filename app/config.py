@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from app.outbound import PooledAiohttpSession, send_queue
 
 load_dotenv()
 
@@ -12,8 +13,18 @@ if not BOT_TOKEN:
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///gym_bot.db")
 
+# "polling" (default) oppure "webhook" (vedi app/webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+if BOT_MODE not in ("polling", "webhook"):
+    raise RuntimeError(f"BOT_MODE non valido: {BOT_MODE!r} (usa 'polling' o 'webhook').")
+
+# Sessione HTTP con pool di connessioni; ogni invio passa dalla coda con rate limit
+session = PooledAiohttpSession()
+session.middleware(send_queue)
+
 bot = Bot(
     token=BOT_TOKEN,
+    session=session,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 dp = Dispatcher()
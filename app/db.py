@@ -1,10 +1,115 @@
-from sqlalchemy import create_engine
+import os
+import re
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.config import DATABASE_URL
+from app.db_profiles import apply_pragmas, engine_kwargs, get_profile, in_memory
 
-engine = create_engine(DATABASE_URL, future=True)
+def _async_url(url: str) -> str:
+    """Map the configured DATABASE_URL onto its async driver (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+# Pool, cache degli statement e PRAGMA dal profilo scelto con DB_PROFILE (app/db_profiles.py)
+DB_PROFILE, _profile = get_profile(DATABASE_URL)
+
+# Engine sincrono: usato solo per la gestione dello schema (migrazioni Alembic)
+engine = create_engine(DATABASE_URL, future=True, **engine_kwargs(_profile, DATABASE_URL))
+apply_pragmas(engine, _profile.pragmas)
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+# Engine asincrono: usato da tutti gli handler per non bloccare l'event loop
+async_engine = create_async_engine(_async_url(DATABASE_URL),
+                                   **engine_kwargs(_profile, DATABASE_URL, use_async=True))
+apply_pragmas(async_engine, _profile.pragmas)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
     return SessionLocal()
+
+def get_async_db():
+    """Return a new AsyncSession, to be used as `async with get_async_db() as db:`"""
+    return AsyncSessionLocal()
+
+_flush_sessions = None
+
+def get_flush_db():
+    """AsyncSession on a dedicated one-connection engine, used by the write-behind flush.
+
+    Il flush non usa il pool degli handler: gli handler che lo aspettano tengono una
+    connessione, e con il pool esaurito il flush non ne troverebbe nessuna (deadlock).
+    """
+    global _flush_sessions
+    if _flush_sessions is None:
+        if in_memory(DATABASE_URL):
+            _flush_sessions = AsyncSessionLocal  # un database in memoria esiste solo su quell'engine
+        else:
+            kwargs = engine_kwargs(_profile, DATABASE_URL, use_async=True)
+            kwargs.update(pool_size=1, max_overflow=0)
+            flush_engine = create_async_engine(_async_url(DATABASE_URL), **kwargs)
+            apply_pragmas(flush_engine, _profile.pragmas)
+            _flush_sessions = async_sessionmaker(bind=flush_engine, expire_on_commit=False)
+    return _flush_sessions()
+
+def dialect_insert(table):
+    """INSERT supporting `on_conflict_do_update/nothing` for the configured backend"""
+    if async_engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(ALEMBIC_INI), "migrations", "versions")
+
+_REVISION_RE = re.compile(r"^revision\b[^=]*=\s*['\"]([^'\"]+)['\"]", re.M)
+_DOWN_REVISION_RE = re.compile(r"^down_revision\b[^=]*=\s*(.+)$", re.M)
+
+def _migration_heads() -> set[str]:
+    """Head revisions of migrations/versions, read from the files without importing alembic"""
+    revisions, parents = set(), set()
+    for name in os.listdir(MIGRATIONS_DIR):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+            source = f.read()
+        revision = _REVISION_RE.search(source)
+        down = _DOWN_REVISION_RE.search(source)
+        if revision:
+            revisions.add(revision.group(1))
+        if down:
+            parents.update(re.findall(r"['\"]([^'\"]+)['\"]", down.group(1)))
+    return revisions - parents
+
+def upgrade_schema() -> bool:
+    """Apply the Alembic migrations up to head; return False if there was nothing to do.
+
+    Databases created by the old `Base.metadata.create_all` have the tables but no
+    `alembic_version`: they are stamped at the initial revision first. On a normal
+    restart (database already at head) only the stored revision is compared with the
+    migration files and alembic itself is not even imported.
+    """
+    with engine.connect() as conn:
+        insp = inspect(conn)
+        legacy = insp.has_table("users") and not insp.has_table("alembic_version")
+        current = set()
+        if insp.has_table("alembic_version"):
+            current = set(conn.execute(text("SELECT version_num FROM alembic_version")).scalars())
+    if current and current == _migration_heads():
+        return False
+
+    from alembic import command
+    from alembic.config import Config
+
+    cfg = Config(ALEMBIC_INI)
+    if legacy:
+        command.stamp(cfg, "0001")
+    command.upgrade(cfg, "head")
+    return True
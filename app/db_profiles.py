@@ -0,0 +1,92 @@
+"""Named engine profiles for `app/db.py`, selected with DB_PROFILE.
+
+- `sqlite-dev`: impostazioni di default di SQLite (journal rollback, sync FULL), come
+  prima dei profili; va bene in locale.
+- `sqlite-prod-wal`: journal WAL con `synchronous=NORMAL` (un fsync per checkpoint
+  invece che per commit), `busy_timeout` per non fallire subito sui lock, cache e
+  mmap più grandi. Consigliato per il bot in produzione su SQLite.
+- `postgres-pooled`: pool di connessioni dimensionato con pre-ping e riciclo delle
+  connessioni (i proxy di Railway chiudono quelle inattive) e cache degli statement
+  preparati di asyncpg.
+
+Senza DB_PROFILE si usa `sqlite-dev` per SQLite e `postgres-pooled` per PostgreSQL.
+"""
+import os
+from typing import NamedTuple
+
+class EngineProfile(NamedTuple):
+    backend: str                     # "sqlite" o "postgresql"
+    engine_kwargs: dict              # argomenti di create_engine / create_async_engine
+    pragmas: dict = {}               # PRAGMA eseguiti su ogni nuova connessione SQLite
+    async_connect_args: dict = {}    # connect_args del solo engine asincrono (driver asyncpg)
+
+PROFILES = {
+    "sqlite-dev": EngineProfile(
+        backend="sqlite",
+        engine_kwargs={},
+    ),
+    "sqlite-prod-wal": EngineProfile(
+        backend="sqlite",
+        engine_kwargs={"pool_size": 5, "max_overflow": 5, "query_cache_size": 1200},
+        pragmas={
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,        # ms
+            "cache_size": -16000,        # KiB (16 MB)
+            "temp_store": "MEMORY",
+            "mmap_size": 134217728,      # 128 MB
+        },
+    ),
+    "postgres-pooled": EngineProfile(
+        backend="postgresql",
+        engine_kwargs={
+            "pool_size": 10,
+            "max_overflow": 20,
+            "pool_timeout": 30,
+            "pool_recycle": 1800,        # s
+            "pool_pre_ping": True,
+            "query_cache_size": 1200,
+        },
+        async_connect_args={"prepared_statement_cache_size": 500},
+    ),
+}
+
+def _backend(url: str) -> str:
+    return "sqlite" if url.startswith("sqlite") else "postgresql"
+
+def get_profile(url: str, name: str | None = None) -> tuple[str, EngineProfile]:
+    """The profile named by DB_PROFILE (or the backend default) for `url`"""
+    backend = _backend(url)
+    name = name or os.getenv("DB_PROFILE") or ("sqlite-dev" if backend == "sqlite" else "postgres-pooled")
+    profile = PROFILES.get(name)
+    if profile is None:
+        raise RuntimeError(f"DB_PROFILE non valido: {name!r} (profili: {', '.join(PROFILES)}).")
+    if profile.backend != backend:
+        raise RuntimeError(f"DB_PROFILE {name!r} è per {profile.backend}, ma DATABASE_URL usa {backend}.")
+    return name, profile
+
+def in_memory(url: str) -> bool:
+    return url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":"))
+
+def engine_kwargs(profile: EngineProfile, url: str, use_async: bool = False) -> dict:
+    """create_engine kwargs for `url`; the pool settings are dropped for in-memory SQLite"""
+    kwargs = dict(profile.engine_kwargs)
+    if in_memory(url):
+        for key in ("pool_size", "max_overflow", "pool_timeout", "pool_recycle"):
+            kwargs.pop(key, None)
+    if use_async and profile.async_connect_args:
+        kwargs["connect_args"] = dict(profile.async_connect_args)
+    return kwargs
+
+def apply_pragmas(engine, pragmas: dict):
+    """Run the profile's PRAGMAs on every new connection of `engine` (sync or async)"""
+    if not pragmas:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(getattr(engine, "sync_engine", engine), "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
@@ -0,0 +1,143 @@
+"""Streaming export of a user's full training history (CSV or XLSX).
+
+Le serie (recenti e archiviate, vedi app/compaction.py) vengono lette a blocchi di
+EXPORT_BATCH_ROWS righe con un cursore lato server (`yield_per`) e scritte subito in
+un file temporaneo "spooled": in memoria fino a EXPORT_SPOOL_BYTES, poi su disco. Il
+file Excel usa la modalità write-only di openpyxl, che non tiene le righe in memoria.
+Il documento viene poi caricato su Telegram a pezzi da `SpooledInputFile`, quindi la
+memoria usata non dipende dalla lunghezza dello storico.
+
+- `EXPORT_MAX_BYTES` (50 MB, il limite di Telegram per i bot): oltre, l'export viene rifiutato;
+- `EXPORT_MAX_RUNNING` (2) export alla volta, gli altri vengono rifiutati.
+"""
+import asyncio
+import csv
+import io
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import NamedTuple
+from aiogram import Bot
+from aiogram.types.input_file import DEFAULT_CHUNK_SIZE, InputFile
+from sqlalchemy import select
+from app.compaction import log_history
+from app.models import TrainingPlan
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2000"))
+EXPORT_SPOOL_BYTES = int(os.getenv("EXPORT_SPOOL_BYTES", str(1024 * 1024)))
+EXPORT_MAX_BYTES = int(os.getenv("EXPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+EXPORT_MAX_RUNNING = int(os.getenv("EXPORT_MAX_RUNNING", "2"))
+
+HEADER = ("Data (UTC)", "Scheda", "Allenamento", "Esercizio", "Serie", "Peso", "Peso (kg)", "Ripetizioni")
+
+class ExportRejected(Exception):
+    """The export can't be produced; the message is shown to the user"""
+
+class SpooledInputFile(InputFile):
+    """Upload an open (spooled) file in chunks; every read starts from the beginning"""
+
+    def __init__(self, file, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot: Bot):
+        # Da capo a ogni lettura: un retry dell'invio (es. dopo un 429) ricarica tutto il file
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+class _CsvWriter:
+    """`;`-separated, decimal comma and BOM: opens as columns in an Italian Excel"""
+
+    def __init__(self, out):
+        self._text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._text, delimiter=";")
+        self._writer.writerow(HEADER)
+
+    def write(self, rows):
+        self._writer.writerows(
+            (ts.strftime("%Y-%m-%d %H:%M:%S"), plan, day, exercise, set_number, weight,
+             "" if kg is None else f"{kg:g}".replace(".", ","), reps)
+            for ts, plan, day, exercise, set_number, weight, kg, reps in rows
+        )
+
+    def close(self):
+        self._text.flush()
+        self._text.detach()  # il file resta aperto per l'invio
+
+class _XlsxWriter:
+    def __init__(self, out):
+        from openpyxl import Workbook  # import pesante: solo al primo export
+        self._out = out
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Storico")
+        self._sheet.append(HEADER)
+
+    def write(self, rows):
+        for ts, *rest in rows:
+            # Al secondo come nel CSV: è la precisione della chiave delle serie (import_key)
+            self._sheet.append((ts.replace(microsecond=0), *rest))
+
+    def close(self):
+        self._workbook.save(self._out)
+
+_WRITERS = {"csv": _CsvWriter, "xlsx": _XlsxWriter}
+
+def history_query(user_id: int):
+    """Every set of the user (hot and archived) with its plan name, in logging order"""
+    history = log_history(lambda log: (log.user_id == user_id,))
+    return (
+        select(history.c.ts, TrainingPlan.plan_name, history.c.day, history.c.exercise,
+               history.c.set_number, history.c.weight, history.c.weight_kg, history.c.reps)
+        .outerjoin(TrainingPlan, TrainingPlan.id == history.c.plan_id)
+        .order_by(history.c.ts, history.c.id)
+    )
+
+async def write_history(db, user_id: int, fmt: str, out, batch_rows: int = EXPORT_BATCH_ROWS) -> int:
+    """Stream the user's history into the binary file `out` as `fmt`; returns the number of sets"""
+    writer = _WRITERS[fmt](out)
+    count = 0
+    result = await db.stream(history_query(user_id).execution_options(yield_per=batch_rows))
+    async for rows in result.partitions():
+        # La scrittura (soprattutto xlsx) è CPU-bound: in un thread, un blocco alla volta
+        await asyncio.to_thread(writer.write, rows)
+        count += len(rows)
+    await asyncio.to_thread(writer.close)
+    return count
+
+class HistoryExport(NamedTuple):
+    document: SpooledInputFile
+    rows: int
+    size: int
+
+class HistoryExporter:
+    def __init__(self, max_running: int = EXPORT_MAX_RUNNING, spool_bytes: int = EXPORT_SPOOL_BYTES,
+                 max_bytes: int = EXPORT_MAX_BYTES):
+        self.max_running = max_running
+        self.spool_bytes = spool_bytes
+        self.max_bytes = max_bytes
+        self._running = 0
+
+    @asynccontextmanager
+    async def export(self, db, user_id: int, fmt: str):
+        """Yield a HistoryExport; the temporary file is removed when the block exits"""
+        if self._running >= self.max_running:
+            raise ExportRejected("Troppe esportazioni in corso, riprova tra qualche minuto.")
+        self._running += 1
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=self.spool_bytes) as out:
+                rows = await write_history(db, user_id, fmt, out)
+                size = out.seek(0, io.SEEK_END)
+                if size > self.max_bytes:
+                    raise ExportRejected(
+                        f"Il file sarebbe di {size / 1024 / 1024:.0f} MB, oltre il limite di Telegram "
+                        f"({self.max_bytes / 1024 / 1024:.0f} MB)."
+                        + (" Prova il formato Excel, più compatto." if fmt == "csv" else "")
+                    )
+                filename = f"storico_allenamenti_{datetime.now():%Y%m%d}.{fmt}"
+                yield HistoryExport(SpooledInputFile(out, filename), rows, size)
+        finally:
+            self._running -= 1
+
+history_exporter = HistoryExporter()
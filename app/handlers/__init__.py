@@ -1,7 +1,9 @@
 from aiogram import Router
 from .start import router as start_router
 from .import_plan import router as import_router
+from .export import router as export_router
 from .workout import router as workout_router
 
 def get_routers() -> list[Router]:
-    return [start_router, import_router, workout_router]
+    # workout per ultimo: capture_set riceve tutti i messaggi non gestiti prima
+    return [start_router, import_router, export_router, workout_router]
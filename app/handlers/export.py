@@ -0,0 +1,42 @@
+import html
+from aiogram import Router, F, types
+from aiogram.filters import Command
+from app.exports import ExportRejected, history_exporter
+from app.keyboards import export_menu
+from app.writebehind import write_behind
+
+router = Router()
+
+_PROMPT = ("📤 <b>Esporta il tuo storico</b>\n\n"
+           "Tutte le serie registrate, una per riga (data, scheda, allenamento, esercizio, peso, ripetizioni).\n"
+           "Scegli il formato:")
+
+@router.message(Command("export"))
+async def export_cmd(message: types.Message):
+    await message.answer(_PROMPT, reply_markup=export_menu())
+
+@router.callback_query(F.data == "export:prompt")
+async def export_prompt(cb: types.CallbackQuery):
+    await cb.message.answer(_PROMPT, reply_markup=export_menu())
+    await cb.answer()
+
+@router.callback_query(F.data.in_({"export:csv", "export:xlsx"}))
+async def export_callback(cb: types.CallbackQuery, db):
+    fmt = cb.data.split(":", 1)[1]
+    await cb.answer()
+    progress = await cb.message.answer("⏳ <b>Esportazione in corso...</b>")
+    # Le serie ancora nel buffer write-behind fanno parte dello storico
+    await write_behind.flush_user(cb.from_user.id)
+    try:
+        async with history_exporter.export(db, cb.from_user.id, fmt) as export:
+            if not export.rows:
+                return await progress.edit_text("📤 Nessuna serie registrata da esportare.")
+            await cb.message.answer_document(
+                export.document,
+                caption=f"📤 <b>Storico allenamenti</b> — {export.rows} serie"
+            )
+    except ExportRejected as e:
+        return await progress.edit_text(f"❌ <b>Esportazione annullata</b>\n\n{html.escape(str(e))}")
+    except Exception as e:
+        return await progress.edit_text(f"❌ Errore nell'esportazione: <code>{html.escape(str(e))}</code>")
+    await progress.delete()
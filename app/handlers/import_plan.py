@@ -1,73 +1,21 @@
-import io, json
-import pandas as pd
+import html, os
 from datetime import datetime, timedelta
 from aiogram import Router, F, types
 from aiogram.filters import Command
-from aiogram.utils.keyboard import InlineKeyboardBuilder
-from app.db import get_db
-from app.models import User, WorkoutLog, TrainingPlan
-from app.utils.plan_parser import parse_plan_from_df
+from app.models import User, WorkoutLog
+from app.imports import plan_importer, ImportRejected
+from app.history_import import HISTORY_MAX_BYTES, history_importer
+from app.state import state_store
+from app.assets import template_asset
+from app.keyboards import import_menu, import_history_menu, template_menu, plan_imported_menu
+from app.rendering import page_cache
+from app.plans import store_plan, store_compiled_plan
 
 router = Router()
 
-def _get_user(db, tg_user: types.User) -> User:
-    user = db.get(User, tg_user.id)
-    if not user:
-        user = User(id=tg_user.id, username=tg_user.username or "")
-        db.add(user)
-        db.commit()
-    return user
-
-def _create_template_excel() -> io.BytesIO:
-    """Create an Excel template with example data for workout plan import"""
-    # Create sample data for the template
-    data = {
-        'Allenamento': ['Giorno 1', 'Giorno 1', 'Giorno 1', 'Giorno 2', 'Giorno 2'],
-        'Esercizio': ['Panca piana', 'Squat', 'Stacco', 'Military Press', 'Trazioni'],
-        'Serie': [3, 4, 3, 4, 3],
-        'Ripetizioni': [8, 10, 8, 8, 'MAX'],
-        'Recupero': ['90s', '120s', '180s', '90s', '60s']
-    }
-    
-    df = pd.DataFrame(data)
-    
-    # Create Excel file in memory
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Scheda Allenamento', index=False)
-        
-        # Get the workbook and worksheet
-        workbook = writer.book
-        worksheet = writer.sheets['Scheda Allenamento']
-        
-        # Add some formatting or instructions if needed
-        # For now, just ensure the columns are visible
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
-    
-    output.seek(0)
-    return output
-
 @router.message(Command("import_plan"))
-async def import_plan_cmd(message: types.Message):
-    # Create the template
-    template_file = _create_template_excel()
-    
-    # Create keyboard with download option
-    kb = InlineKeyboardBuilder()
-    kb.button(text="📥 Scarica Template", callback_data="download_template")
-    kb.button(text="📤 Carica Scheda", callback_data="import:prompt")
-    kb.adjust(1)
-    
+async def import_plan_cmd(message: types.Message, db):
+    await state_store.set_awaiting_history(db, message.from_user.id, False)
     await message.answer(
         "📋 <b>Importa la tua scheda di allenamento</b>\n\n"
         "Puoi scaricare un template Excel precompilato per facilitare la creazione della tua scheda.\n\n"
@@ -78,38 +26,27 @@ async def import_plan_cmd(message: types.Message):
         "• <b>Ripetizioni</b>: Numero di ripetizioni o 'MAX'\n"
         "• <b>Recupero</b>: Tempo di recupero (es. '60s', '90s', '2m')\n\n"
         "💡 <i>Scarica il template e modificalo con i tuoi esercizi!</i>",
-        reply_markup=kb.as_markup()
+        reply_markup=import_menu()
     )
 
 @router.callback_query(F.data == "import:prompt")
-async def import_prompt(cb: types.CallbackQuery):
-    # Create the template for download
-    template_file = _create_template_excel()
-    
-    # Create keyboard with download option
-    kb = InlineKeyboardBuilder()
-    kb.button(text="📥 Scarica Template", callback_data="download_template")
-    kb.adjust(1)
-    
+async def import_prompt(cb: types.CallbackQuery, db):
+    await state_store.set_awaiting_history(db, cb.from_user.id, False)
     await cb.message.answer(
         "📤 <b>Carica la tua scheda</b>\n\n"
-        "Inviami un file <b>.xlsx</b> con le colonne: <b>Allenamento, Esercizio, Serie, Ripetizioni, Recupero</b>.\n\n"
+        "Inviami un file <b>.xlsx</b> o <b>.csv</b> con le colonne: <b>Allenamento, Esercizio, Serie, Ripetizioni, Recupero</b>.\n\n"
+        "📑 <i>In alternativa usa un foglio per ogni giorno (il nome del foglio è il giorno) "
+        "con le colonne Esercizio, Serie, Ripetizioni, Recupero.</i>\n\n"
         "💡 <i>Se non hai un file, scarica prima il template!</i>",
-        reply_markup=kb.as_markup()
+        reply_markup=template_menu()
     )
     await cb.answer()
 
 @router.callback_query(F.data == "download_template")
 async def download_template_callback(cb: types.CallbackQuery):
-    # Create the template
-    template_file = _create_template_excel()
-    
-    # Send the file
-    await cb.message.answer_document(
-        types.BufferedInputFile(
-            template_file.getvalue(),
-            filename="template_scheda_allenamento.xlsx"
-        ),
+    # Generato una volta sola; dopo il primo invio viene riusato il file_id di Telegram
+    await template_asset.send(
+        cb.message,
         caption="📥 <b>Template Scheda Allenamento</b>\n\n"
                 "Scarica questo file, modificalo con i tuoi esercizi e caricamelo con /import_plan.\n\n"
                 "📝 <b>Istruzioni:</b>\n"
@@ -121,55 +58,97 @@ async def download_template_callback(cb: types.CallbackQuery):
     )
     await cb.answer()
 
+@router.message(Command("import_history"))
+async def import_history_cmd(message: types.Message, db):
+    # Il prossimo file inviato viene letto come storico (stato condiviso tra i worker)
+    await state_store.set_awaiting_history(db, message.from_user.id, True)
+    await message.answer(
+        "🗂️ <b>Importa lo storico degli allenamenti</b>\n\n"
+        "Ora inviami un file <b>.xlsx</b> o <b>.csv</b> con una serie per riga e le colonne:\n"
+        "• <b>Data</b>: es. '2025-01-31 18:30' o '31/01/2025'\n"
+        "• <b>Esercizio</b>, <b>Peso</b> (kg), <b>Ripetizioni</b>\n"
+        "• facoltative: <b>Allenamento</b>, <b>Serie</b>, <b>Scheda</b>\n\n"
+        f"📦 Massimo {HISTORY_MAX_BYTES // (1024 * 1024)} MB.\n"
+        "💡 <i>Va bene anche il file di /export. Reinviare lo stesso file non duplica le serie.</i>",
+        reply_markup=import_history_menu()
+    )
 
-@router.message(F.document)
-async def handle_excel(message: types.Message):
-    if not message.document.file_name.lower().endswith(".xlsx"):
-        return await message.answer("⚠️ Il file deve essere un <b>.xlsx</b> (Excel).")
+@router.callback_query(F.data == "import_history:cancel")
+async def import_history_cancel(cb: types.CallbackQuery, db):
+    await state_store.set_awaiting_history(db, cb.from_user.id, False)
+    await cb.message.edit_text("❌ Import dello storico annullato.")
+    await cb.answer()
+
+def _is_spreadsheet(document: types.Document) -> bool:
+    return (document.file_name or "").lower().endswith((".xlsx", ".csv"))
 
-    db = get_db()
-    user = _get_user(db, message.from_user)
+async def _import_history_file(message: types.Message, db, user: User):
+    progress = await message.answer("⏳ <b>Importazione in corso...</b>\n\nSto leggendo lo storico.")
     try:
-        file = await message.bot.get_file(message.document.file_id)
-        buf = io.BytesIO()
-        await message.bot.download_file(file.file_path, destination=buf)
-        buf.seek(0)
+        # Dimensione controllata prima del download; lettura e validazione nel pool di processi
+        async with plan_importer.download(message.bot, message.document, HISTORY_MAX_BYTES) as (source, kind):
+            result = await history_importer.run(db, user, source, kind)
+    except ImportRejected as e:
+        return await progress.edit_text(f"❌ <b>Importazione annullata</b>\n\n{html.escape(str(e))}")
+    except Exception as e:
+        return await progress.edit_text(f"❌ Errore nell'importazione: <code>{html.escape(str(e))}</code>")
 
-        df = pd.read_excel(buf)
-        plan = parse_plan_from_df(df)
+    page_cache.invalidate(user.id)
+    text = (
+        "🗂️ <b>Storico importato!</b>\n\n"
+        f"• Serie importate: <b>{result.inserted}</b>\n"
+        f"• Già presenti: <b>{result.duplicates}</b>\n"
+        f"• Righe non valide: <b>{result.invalid}</b>\n"
+        f"• Tempo: <b>{result.seconds:.1f}s</b> ({result.rows_per_second:.0f} righe/s)"
+    )
+    if result.errors:
+        text += "\n\n⚠️ <b>Righe scartate:</b>\n" + html.escape("\n".join(result.errors))
+        if result.invalid > len(result.errors):
+            text += f"\n... e altre {result.invalid - len(result.errors)}"
+    await progress.edit_text(text)
 
+@router.message(F.document)
+async def handle_excel(message: types.Message, db, user: User):
+    # Dopo /import_history il file è uno storico: uno solo, anche se viene rifiutato
+    history = await state_store.is_awaiting_history(db, user.id)
+    if history:
+        await state_store.set_awaiting_history(db, user.id, False)
+    if not _is_spreadsheet(message.document):
+        return await message.answer("⚠️ Il file deve essere un <b>.xlsx</b> (Excel) o un <b>.csv</b>.")
+    if history:
+        return await _import_history_file(message, db, user)
+
+    # Il parsing gira nel pool di processi: gli altri update continuano a essere serviti
+    progress = await message.answer("⏳ <b>Importazione in corso...</b>\n\nSto leggendo la tua scheda.")
+    try:
+        # IMPORT_MAX_BYTES controllato prima del download
+        plan = await plan_importer.import_document(message.bot, message.document)
+    except ImportRejected as e:
+        return await progress.edit_text(f"❌ <b>Importazione annullata</b>\n\n{html.escape(str(e))}")
+    except Exception as e:
+        return await progress.edit_text(f"❌ Errore nell'importazione: <code>{e}</code>")
+
+    try:
         # Generate plan name from filename or use default
-        plan_name = message.document.file_name.replace('.xlsx', '').replace('_', ' ').title()
+        plan_name = os.path.splitext(message.document.file_name)[0].replace('_', ' ').title()
         if not plan_name or plan_name.isspace():
             plan_name = f"Scheda {datetime.now().strftime('%d/%m/%Y')}"
 
-        # Create new training plan record
-        new_plan = TrainingPlan(
-            user_id=user.id,
-            plan_name=plan_name,
-            plan_data=json.dumps(plan, ensure_ascii=False),
-            created_at=datetime.now(),
-            is_active=1
-        )
-        db.add(new_plan)
+        # Contenuto normalizzato e condiviso: si scrivono solo i giorni non ancora salvati
+        new_plan = await store_plan(db, user.id, plan_name, plan)
 
-        # Also update user's current training plan for backward compatibility
-        user.training_plan = json.dumps(plan, ensure_ascii=False)
+        user.active_plan_id = new_plan.id
         user.current_day = None
         user.exercise_idx = 0
         user.set_idx = 0
-        db.commit()
-
-        # Crea tastiera con pulsanti azione rapida
-        kb = InlineKeyboardBuilder()
-        kb.button(text="🏋️ Inizia Allenamento", callback_data="workout:start")
-        kb.button(text="📋 Vedi Piano", callback_data="view_plan")
-        kb.button(text="📈 Vedi Progressi", callback_data="view_progress")
-        kb.adjust(2, 1)
+        user.last_updated = datetime.utcnow()
+        await db.commit()
+        store_compiled_plan(new_plan.id, plan)
+        page_cache.invalidate(user.id)
 
         total_exercises = sum(len(exercises) for exercises in plan.values())
-        
-        await message.answer(
+    
+        await progress.edit_text(
             "🎉 <b>Scheda importata con successo!</b>\n\n"
             f"📊 <b>Dettagli importazione:</b>\n"
             f"• Nome scheda: <b>{plan_name}</b>\n"
@@ -177,9 +156,7 @@ async def handle_excel(message: types.Message):
             f"• Esercizi totali: <b>{total_exercises}</b>\n"
             f"• Giorni: <b>{', '.join(plan.keys())}</b>\n\n"
             f"💡 <i>Ora puoi iniziare subito il tuo allenamento!</i>",
-            reply_markup=kb.as_markup()
+            reply_markup=plan_imported_menu()
         )
     except Exception as e:
-        await message.answer(f"❌ Errore nell'importazione: <code>{e}</code>")
-    finally:
-        db.close()
+        await progress.edit_text(f"❌ Errore nell'importazione: <code>{e}</code>")
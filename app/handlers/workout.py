@@ -1,51 +1,51 @@
-import json
-import asyncio
-import re
+from datetime import datetime
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from app.db import get_db
+from sqlalchemy import select, delete
 from app.models import User, WorkoutLog, TrainingPlan
-from app.keyboards import reset_confirmation_menu
+from app.keyboards import reset_confirmation_menu, cancel_workout_confirmation_menu
+from app.state import state_store
+from app.timers import rest_timers
+from app.writebehind import insert_sets, write_behind
+from app import recaps
+from app.compaction import delete_history
+from app.progress import PAGE_SETS, fetch_progress_page, group_progress, format_session, encode_cursor, decode_cursor
+from app.rendering import MAX_MESSAGE_LEN, FOOTER_RESERVE, paginate, page_footer, page_keyboard, page_cache
+from app.utils.sets import import_key, parse_sets, weight_to_kg
+from app.plans import get_compiled_plan
+from app.utils.compiled_plan import CompiledExercise
 
 router = Router()
-awaiting_set: dict[int, bool] = {}
-active_timers: dict[int, asyncio.Task] = {}
-
-def _get_user(db, tg_user: types.User) -> User:
-    user = db.query(User).filter(User.id == tg_user.id).first()
-    if not user:
-        user = User(id=tg_user.id, username=tg_user.username or "")
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    return user
+
+# `db` (una sessione per update) e `user` (già caricato, creato se manca) arrivano
+# da DbSessionMiddleware (app/middlewares.py)
 
 @router.message(Command("workout"))
-async def workout_cmd(message: types.Message):
-    await _start_workout_flow(message, message.from_user)
+async def workout_cmd(message: types.Message, db, user: User):
+    await _start_workout_flow(message, db, user)
 
 @router.callback_query(F.data == "workout:start")
-async def workout_start_callback(cb: types.CallbackQuery):
-    await _start_workout_flow(cb.message, cb.from_user)
+async def workout_start_callback(cb: types.CallbackQuery, db, user: User):
+    await _start_workout_flow(cb.message, db, user)
     await cb.answer()
 
 @router.message(Command("view_plan"))
-async def view_plan_cmd(message: types.Message):
-    await _display_plan(message, message.from_user)
+async def view_plan_cmd(message: types.Message, db, user: User):
+    await _display_plan(message, db, user)
 
 @router.callback_query(F.data == "view_plan")
-async def view_plan_callback(cb: types.CallbackQuery):
-    await _display_plan(cb.message, cb.from_user)
+async def view_plan_callback(cb: types.CallbackQuery, db, user: User):
+    await _display_plan(cb.message, db, user)
     await cb.answer()
 
 @router.message(Command("progress"))
-async def progress_cmd(message: types.Message):
-    await _select_plan_for_progress(message, message.from_user)
+async def progress_cmd(message: types.Message, db, user: User):
+    await _select_plan_for_progress(message, db, user)
 
 @router.callback_query(F.data == "view_progress")
-async def progress_callback(cb: types.CallbackQuery):
-    await _select_plan_for_progress(cb.message, cb.from_user)
+async def progress_callback(cb: types.CallbackQuery, db, user: User):
+    await _select_plan_for_progress(cb.message, db, user)
     await cb.answer()
 
 @router.callback_query(F.data == "reset:confirm")
@@ -64,38 +64,32 @@ async def reset_cancel_callback(cb: types.CallbackQuery):
     await cb.answer()
 
 @router.callback_query(F.data == "reset:execute")
-async def reset_execute_callback(cb: types.CallbackQuery):
-    db = get_db()
-    user = _get_user(db, cb.from_user)
-    
-    # Elimina tutti i log dell'utente
-    db.query(WorkoutLog).filter(WorkoutLog.user_id == user.id).delete()
-    
+async def reset_execute_callback(cb: types.CallbackQuery, db, user: User):
+    # Elimina tutti i log dell'utente (anche archiviati e compattati)
+    await delete_history(db, user.id)
+    await recaps.delete_recaps(db, user.id)
+
     # Resetta i dati dell'utente
-    user.training_plan = None
+    user.active_plan_id = None
     user.current_day = None
     user.exercise_idx = 0
     user.set_idx = 0
-    db.commit()
-    db.close()
+    user.last_updated = datetime.utcnow()
+    await db.commit()
+    page_cache.invalidate(user.id)
     
     await cb.message.answer("🔄 **Reset completato!**\n\nScheda e progressi eliminati con successo.")
     await cb.answer()
 
 @router.callback_query(F.data == "back:set")
-async def back_set_callback(cb: types.CallbackQuery):
-    db = get_db()
-    user = _get_user(db, cb.from_user)
-    
-    if not user.training_plan or not user.current_day:
-        db.close()
+async def back_set_callback(cb: types.CallbackQuery, db, user: User):
+    if not user.active_plan_id or not user.current_day:
         await cb.answer("⚠️ Nessun workout attivo.")
         return
 
-    plan = json.loads(user.training_plan)
+    plan = await get_compiled_plan(db, user.active_plan_id)
     exercises = plan.get(user.current_day, [])
     if user.exercise_idx >= len(exercises):
-        db.close()
         await cb.answer("🏁 Allenamento concluso.")
         return
 
@@ -103,161 +97,155 @@ async def back_set_callback(cb: types.CallbackQuery):
     if user.set_idx == 0 and user.exercise_idx > 0:
         user.exercise_idx -= 1
         ex_prev = exercises[user.exercise_idx]
-        total_sets_prev = int(ex_prev["sets"])
+        total_sets_prev = ex_prev.sets
         user.set_idx = total_sets_prev - 1  # ultima serie dell'esercizio precedente
-        db.commit()
-        db.close()
-        await cb.message.answer(f"↩️ **Tornato all'esercizio precedente**: {ex_prev['name']} — serie {user.set_idx + 1}/{total_sets_prev}")
+        await db.commit()
+        await cb.message.answer(f"↩️ **Tornato all'esercizio precedente**: {ex_prev.name} — serie {user.set_idx + 1}/{total_sets_prev}")
         await _prompt_next_set(cb.message, user, db)
         await cb.answer()
         return
 
     ex = exercises[user.exercise_idx]
-    total_sets = int(ex["sets"])
-    
+    total_sets = ex.sets
+
     # Trova l'ultimo log per questo esercizio nel giorno corrente
-    last_log = db.query(WorkoutLog).filter(
-        WorkoutLog.user_id == user.id,
-        WorkoutLog.day == user.current_day,
-        WorkoutLog.exercise == ex['name']
-    ).order_by(WorkoutLog.ts.desc()).first()
+    last_log = (await db.execute(
+        select(WorkoutLog).where(
+            WorkoutLog.user_id == user.id,
+            WorkoutLog.day == user.current_day,
+            WorkoutLog.exercise == ex.name
+        ).order_by(WorkoutLog.ts.desc()).limit(1)
+    )).scalars().first()
 
     if last_log and last_log.set_number == user.set_idx:
         # Se c'è un log per l'ultima serie registrata, eliminarlo
-        db.delete(last_log)
+        await db.delete(last_log)
+        await db.flush()
+        await recaps.rebuild_recap(db, user.id, ex.name)
         user.set_idx = max(0, user.set_idx - 1)
-        db.commit()
-        await cb.message.answer(f"↩️ **Set annullato**: {ex['name']} — set {last_log.set_number}")
+        await db.commit()
+        page_cache.invalidate(user.id)
+        await cb.message.answer(f"↩️ **Set annullato**: {ex.name} — set {last_log.set_number}")
     else:
         # Se non c'è un log (serie saltata), semplicemente decrementa l'indice
         user.set_idx = max(0, user.set_idx - 1)
-        db.commit()
-        await cb.message.answer(f"↩️ **Tornato indietro**: {ex['name']} — serie {user.set_idx + 1}/{total_sets}")
+        await db.commit()
+        await cb.message.answer(f"↩️ **Tornato indietro**: {ex.name} — serie {user.set_idx + 1}/{total_sets}")
 
-    db.close()
     await _prompt_next_set(cb.message, user, db)
     await cb.answer()
 
 @router.callback_query(F.data == "skip:set")
-async def skip_set_callback(cb: types.CallbackQuery):
-    db = get_db()
-    user = _get_user(db, cb.from_user)
-    
-    if not user.training_plan or not user.current_day:
-        db.close()
+async def skip_set_callback(cb: types.CallbackQuery, db, user: User):
+    if not user.active_plan_id or not user.current_day:
         await cb.answer("⚠️ Nessun workout attivo.")
         return
 
     # Stop any active timer for this user
     user_id = user.id
-    if user_id in active_timers:
-        active_timers[user_id].cancel()
-        del active_timers[user_id]
+    await rest_timers.cancel(db, user_id)
 
-    plan = json.loads(user.training_plan)
+    plan = await get_compiled_plan(db, user.active_plan_id)
     exercises = plan.get(user.current_day, [])
     if user.exercise_idx >= len(exercises):
-        db.close()
         await cb.answer("🏁 Allenamento concluso.")
         return
 
     ex = exercises[user.exercise_idx]
-    total_sets = int(ex["sets"])
+    total_sets = ex.sets
 
     # Passa alla serie successiva senza registrare nulla
     user.set_idx += 1
-    db.commit()
 
     # Se abbiamo superato l'ultima serie, passiamo all'esercizio successivo
     if user.set_idx >= total_sets:
         user.exercise_idx += 1
         user.set_idx = 0
-        db.commit()
-        db.close()
+        await db.commit()
         await cb.answer()
         await _prompt_next_set(cb.message, user, db)
     else:
-        db.close()
-        await cb.message.answer(f"⏭️ **Set saltato**: {ex['name']} — serie {user.set_idx}/{total_sets}")
+        await db.commit()
+        await cb.message.answer(f"⏭️ **Set saltato**: {ex.name} — serie {user.set_idx}/{total_sets}")
         await _prompt_next_set(cb.message, user, db)
         await cb.answer()
 
 @router.callback_query(F.data == "view_plan_current")
-async def view_plan_current_callback(cb: types.CallbackQuery):
-    db = get_db()
-    user = _get_user(db, cb.from_user)
-    
-    if not user.training_plan or not user.current_day:
-        db.close()
+async def view_plan_current_callback(cb: types.CallbackQuery, db, user: User):
+    if not user.active_plan_id or not user.current_day:
         await cb.answer("⚠️ Nessun workout attivo.")
         return
 
-    plan = json.loads(user.training_plan)
+    plan = await get_compiled_plan(db, user.active_plan_id)
     current_day = user.current_day
     
     if current_day not in plan:
-        db.close()
         await cb.answer("⚠️ Giorno di allenamento non trovato.")
         return
 
-    exercises = plan[current_day]
-    response = f"📋 **Piano di Allenamento - {current_day}**\n\n"
-    
-    for i, ex in enumerate(exercises, 1):
-        current_indicator = "🟢 " if i-1 == user.exercise_idx else "   "
-        response += f"{current_indicator}{i}. {ex['name']} - {ex['sets']}x{ex['reps']} - Recupero: {ex['rest']}\n"
-    
-    response += f"\n📍 <i>Attualmente all'esercizio {user.exercise_idx + 1}</i>"
-    
-    await cb.message.answer(response)
-    db.close()
+    text, markup = _render_current_day(user, plan, page=None)
+    await cb.message.answer(text, reply_markup=markup)
+    await cb.answer()
+
+@router.callback_query(F.data.startswith("plan_cur:"))
+async def view_plan_current_page(cb: types.CallbackQuery, db, user: User):
+    plan = await get_compiled_plan(db, user.active_plan_id) if user.current_day else None
+    if not plan or user.current_day not in plan:
+        await cb.answer("⚠️ Nessun workout attivo.")
+        return
+    text, markup = _render_current_day(user, plan, page=int(cb.data.split(":", 1)[1]))
+    await cb.message.edit_text(text, reply_markup=markup)
     await cb.answer()
 
+def _render_current_day(user: User, plan, page: int | None):
+    """Page `page` of the current day's exercises (None: the page with the current exercise)"""
+    exercises = plan[user.current_day]
+    lines = []
+    for i, ex in enumerate(exercises):
+        current_indicator = "🟢 " if i == user.exercise_idx else "   "
+        lines.append(f"{current_indicator}{i + 1}. {ex.name} - {ex.sets}x{ex.reps} - Recupero: {ex.rest}\n")
+    footer = f"\n📍 <i>Attualmente all'esercizio {user.exercise_idx + 1}</i>"
+
+    pages = paginate(f"📋 **Piano di Allenamento - {user.current_day}**\n\n", lines,
+                     limit=MAX_MESSAGE_LEN - FOOTER_RESERVE - len(footer))
+    if page is None:
+        page = next((n for n, text in enumerate(pages) if "🟢" in text), 0)
+    page = min(max(page, 0), len(pages) - 1)
+    return pages[page] + footer + page_footer(page, len(pages)), page_keyboard("plan_cur", page, len(pages))
+
 @router.callback_query(F.data == "cancel_workout")
-async def cancel_workout_callback(cb: types.CallbackQuery):
-    db = get_db()
-    user = _get_user(db, cb.from_user)
-    
-    if not user.training_plan or not user.current_day:
-        db.close()
+async def cancel_workout_callback(cb: types.CallbackQuery, user: User):
+    if not user.active_plan_id or not user.current_day:
         await cb.answer("⚠️ Nessun workout attivo.")
         return
 
-    # Crea tastiera di conferma
-    kb = InlineKeyboardBuilder()
-    kb.button(text="✅ Conferma Annullamento", callback_data="cancel_workout_confirm")
-    kb.button(text="❌ Continua Allenamento", callback_data="cancel_workout_cancel")
-    kb.adjust(1)
-    
     await cb.message.answer(
         "⚠️ **Conferma Annullamento**\n\n"
         "Sei sicuro di voler annullare l'allenamento in corso?\n"
         "Tutti i progressi non salvati andranno persi.",
-        reply_markup=kb.as_markup()
+        reply_markup=cancel_workout_confirmation_menu()
     )
-    db.close()
     await cb.answer()
 
 @router.callback_query(F.data == "cancel_workout_confirm")
-async def cancel_workout_confirm_callback(cb: types.CallbackQuery):
-    db = get_db()
-    user = _get_user(db, cb.from_user)
-    
+async def cancel_workout_confirm_callback(cb: types.CallbackQuery, db, user: User):
     current_day = user.current_day
-    
+
     # Delete all workout logs for the current day and user
     if current_day:
-        db.query(WorkoutLog).filter(
+        deleted = (await db.execute(delete(WorkoutLog).where(
             WorkoutLog.user_id == user.id,
             WorkoutLog.day == current_day
-        ).delete()
-    
+        ).returning(WorkoutLog.exercise))).scalars().all()
+        await recaps.rebuild_recaps(db, user.id, deleted)
+
     user.current_day = None
     user.exercise_idx = 0
     user.set_idx = 0
-    awaiting_set[user.id] = False
-    db.commit()
-    db.close()
+    await db.commit()
+    page_cache.invalidate(user.id)
+    await state_store.set_awaiting(db, user.id, False)
+    await rest_timers.cancel(db, user.id, interrupted=True)
     
     await cb.message.answer(f"❌ Allenamento <b>{current_day}</b> annullato. Tutti i progressi di questa sessione sono stati eliminati.")
     await cb.answer()
@@ -274,43 +262,54 @@ async def workout_cancel_callback(cb: types.CallbackQuery):
 
 
 
-async def _display_plan(message: types.Message, tg_user: types.User):
-    db = get_db()
-    user = _get_user(db, tg_user)
-
-    if not user.training_plan:
-        db.close()
+async def _display_plan(message: types.Message, db, user: User):
+    if not user.active_plan_id:
         return await message.answer("⚠️ Nessuna scheda caricata. Usa /import_plan.")
 
-    plan = json.loads(user.training_plan)
+    plan = await get_compiled_plan(db, user.active_plan_id)
     if not plan:
-        db.close()
         return await message.answer("⚠️ La scheda è vuota. Reimporta il file.")
 
-    response = "📊 **Il tuo piano di allenamento:**\n\n"
-    
-    for day, exercises in plan.items():
-        response += f"🏷️ **{day}**\n"
-        for i, ex in enumerate(exercises, 1):
-            response += f"  {i}. {ex['name']} - {ex['sets']}x{ex['reps']} - Recupero: {ex['rest']}\n"
-        response += "\n"
-    
-    await message.answer(response)
-    db.close()
+    text, markup = _render_plan(user, plan, 0)
+    await message.answer(text, reply_markup=markup)
 
-async def _select_plan_for_progress(message: types.Message, tg_user: types.User):
-    """Let user select which training plan to view progress for"""
-    db = get_db()
-    user = _get_user(db, tg_user)
+@router.callback_query(F.data.startswith("plan_page:"))
+async def view_plan_page(cb: types.CallbackQuery, db, user: User):
+    plan = await get_compiled_plan(db, user.active_plan_id)
+    if not plan:
+        await cb.answer("⚠️ Nessuna scheda caricata.")
+        return
+    text, markup = _render_plan(user, plan, int(cb.data.split(":", 1)[1]))
+    await cb.message.edit_text(text, reply_markup=markup)
+    await cb.answer()
 
+def _render_plan(user: User, plan, page: int):
+    key = ("plan", user.active_plan_id)
+    pages = page_cache.get(user.id, key)
+    if pages is None:
+        blocks = []
+        for day, exercises in plan.items():
+            lines = [f"🏷️ **{day}**\n"]
+            lines.extend(f"  {i}. {ex.name} - {ex.sets}x{ex.reps} - Recupero: {ex.rest}\n"
+                         for i, ex in enumerate(exercises, 1))
+            lines.append("\n")
+            blocks.append("".join(lines))
+        pages = paginate("📊 **Il tuo piano di allenamento:**\n\n", blocks)
+        page_cache.set(user.id, key, pages)
+    page = min(max(page, 0), len(pages) - 1)
+    return pages[page] + page_footer(page, len(pages)), page_keyboard("plan_page", page, len(pages))
+
+async def _select_plan_for_progress(message: types.Message, db, user: User):
+    """Let user select which training plan to view progress for"""
     # Get all training plans for this user
-    training_plans = db.query(TrainingPlan).filter(
-        TrainingPlan.user_id == user.id,
-        TrainingPlan.is_active == 1
-    ).order_by(TrainingPlan.created_at.desc()).all()
+    training_plans = (await db.execute(
+        select(TrainingPlan).where(
+            TrainingPlan.user_id == user.id,
+            TrainingPlan.is_active == 1
+        ).order_by(TrainingPlan.created_at.desc())
+    )).scalars().all()
 
     if not training_plans:
-        db.close()
         return await message.answer("📈 **I tuoi progressi**\n\nNessuna scheda caricata. Usa /import_plan.")
 
     # Create keyboard with available plans
@@ -325,25 +324,30 @@ async def _select_plan_for_progress(message: types.Message, tg_user: types.User)
         "Scegli quale scheda di allenamento vuoi visualizzare:",
         reply_markup=kb.as_markup()
     )
-    db.close()
 
 @router.callback_query(F.data.startswith("progress_plan:"))
-async def select_progress_plan(cb: types.CallbackQuery):
+async def select_progress_plan(cb: types.CallbackQuery, db):
     plan_id = int(cb.data.split(":", 1)[1])
-    db = get_db()
-    
-    # Get the selected training plan
-    training_plan = db.query(TrainingPlan).filter(
-        TrainingPlan.id == plan_id
-    ).first()
+    # Get the selected training plan (only among the user's own plans)
+    training_plan = await db.get(TrainingPlan, plan_id)
 
-    if not training_plan:
-        db.close()
+    if not training_plan or training_plan.user_id != cb.from_user.id:
         await cb.answer("⚠️ Piano non trovato.")
         return
 
-    await _display_progress_for_plan(cb.message, cb.from_user, training_plan)
-    db.close()
+    await _display_progress_for_plan(cb.message, db, cb.from_user.id, training_plan)
+    await cb.answer()
+
+@router.callback_query(F.data.startswith("pp:"))
+async def progress_page_callback(cb: types.CallbackQuery, db):
+    # pp:<plan_id>:<o|n>:<cursore> — pagina precedente (o) / successiva (n) nel tempo
+    _, plan_id, direction, cursor = cb.data.split(":", 3)
+    training_plan = await db.get(TrainingPlan, int(plan_id))
+    if not training_plan or training_plan.user_id != cb.from_user.id:
+        await cb.answer("⚠️ Piano non trovato.")
+        return
+    text, markup = await _progress_page(db, cb.from_user.id, training_plan, direction, cursor)
+    await cb.message.edit_text(text, reply_markup=markup)
     await cb.answer()
 
 @router.callback_query(F.data == "progress_cancel")
@@ -351,135 +355,94 @@ async def progress_cancel_callback(cb: types.CallbackQuery):
     await cb.message.answer("❌ Visualizzazione progressi annullata.")
     await cb.answer()
 
-async def _display_progress_for_plan(message: types.Message, tg_user: types.User, training_plan: TrainingPlan):
-    """Display progress for a specific training plan"""
-    db = get_db()
-    user = _get_user(db, tg_user)
+def _progress_blocks(plan, progress_rows) -> list[str]:
+    """One block per exercise (the day title goes with the day's first exercise)"""
+    workout_progress = group_progress(progress_rows)
+    blocks = []
 
-    plan = json.loads(training_plan.plan_data)
-    
-    # Recupera tutti i log dell'utente
-    logs = db.query(WorkoutLog).filter(
-        WorkoutLog.user_id == user.id
-    ).order_by(WorkoutLog.ts.asc()).all()
-    
-    if not logs:
-        db.close()
-        return await message.answer(f"📈 **Progressi - {training_plan.plan_name}**\n\nNessun dato di allenamento registrato per questa scheda.")
-
-    # Raggruppa i log per giorno di allenamento e poi per esercizio
-    workout_progress = {}
-    for log in logs:
-        if log.day not in workout_progress:
-            workout_progress[log.day] = {}
-        if log.exercise not in workout_progress[log.day]:
-            workout_progress[log.day][log.exercise] = {}
-        
-        date_str = log.ts.strftime("%d/%m")
-        if date_str not in workout_progress[log.day][log.exercise]:
-            workout_progress[log.day][log.exercise][date_str] = []
-        workout_progress[log.day][log.exercise][date_str].append(log)
-
-    response = f"📈 **Progressi - {training_plan.plan_name}**\n\n"
-    
     # Per ogni giorno nel piano (nell'ordine della scheda)
     for day_name in plan.keys():
-        if day_name in workout_progress and workout_progress[day_name]:
-            response += f"🏷️ **{day_name}**\n"
-            
-            # Per ogni esercizio nel giorno (nell'ordine della scheda)
-            for exercise in plan[day_name]:
-                exercise_name = exercise['name']
-                if exercise_name in workout_progress[day_name]:
-                    response += f"  🏋️ {exercise_name}:\n"
-                    
-                    # Per ogni data in cui è stato fatto l'esercizio (ordinate cronologicamente)
-                    for date_str in sorted(workout_progress[day_name][exercise_name].keys()):
-                        logs_list = workout_progress[day_name][exercise_name][date_str]
-                        response += f"    📅 {date_str}: "
-                        # Mostra tutti i set del giorno in formato compatto
-                        sets = [f"{log.weight}kg × {log.reps}" for log in logs_list]
-                        response += " ".join(sets) + "\n"
-                    
-                    response += "\n"
-            
-            response += "\n"
-    
-    await message.answer(response)
-    db.close()
+        day_progress = workout_progress.get(day_name)
+        if not day_progress:
+            continue
+        day_blocks = []
+
+        # Per ogni esercizio nel giorno (nell'ordine della scheda)
+        for exercise in plan[day_name]:
+            sessions = day_progress.get(exercise.name)
+            if not sessions:
+                continue
+            lines = [f"🏷️ **{day_name}**\n"] if not day_blocks else []
+            lines.append(f"  🏋️ {exercise.name}:\n")
+            # Una riga per sessione (già in ordine cronologico): serie, top set e volume
+            lines.extend(f"    {format_session(row)}\n" for row in sessions)
+            lines.append("\n")
+            day_blocks.append("".join(lines))
+
+        if day_blocks:
+            day_blocks[-1] += "\n"
+            blocks.extend(day_blocks)
+    return blocks
+
+async def _progress_page(db, user_id: int, training_plan: TrainingPlan, direction: str | None = None,
+                         cursor: str | None = None, title: str | None = None):
+    """Text and navigation keyboard of one progress page (cached until new sets are logged)"""
+    key = ("progress", training_plan.id, direction, cursor)
+    cached = page_cache.get(user_id, key)
+    if cached:
+        return cached
+
+    await write_behind.flush_user(user_id)
+    title = title or f"📈 **Progressi - {training_plan.plan_name}**"
+    before = decode_cursor(cursor) if direction == "o" else None
+    after = decode_cursor(cursor) if direction == "n" else None
+    plan = await get_compiled_plan(db, training_plan.id)
+
+    # Pagina di al più PAGE_SETS serie; se il testo supera il limite di Telegram si
+    # riduce la pagina (una pagina contiene comunque sempre giorni interi)
+    limit = PAGE_SETS
+    while True:
+        page = await fetch_progress_page(db, user_id, training_plan.id, before, after, limit)
+        pages = paginate(f"{title}\n\n", _progress_blocks(plan, page.rows))
+        if len(pages) == 1 or limit == 1:
+            break
+        limit //= 2
+
+    if not page.rows:
+        text = f"{title}\n\nNessun dato di allenamento registrato per questa scheda."
+    else:
+        text = pages[0] + ("\n<i>…</i>" if len(pages) > 1 else "")
 
-async def _display_progress(message: types.Message, tg_user: types.User):
-    """Legacy function for backward compatibility"""
-    db = get_db()
-    user = _get_user(db, tg_user)
+    kb = InlineKeyboardBuilder()
+    if page.older:
+        kb.button(text="◀️ Più vecchi", callback_data=f"pp:{training_plan.id}:o:{encode_cursor(page.older)}")
+    if page.newer:
+        kb.button(text="Più recenti ▶️", callback_data=f"pp:{training_plan.id}:n:{encode_cursor(page.newer)}")
+    result = (text, kb.as_markup() if page.older or page.newer else None)
+    page_cache.set(user_id, key, result)
+    return result
+
+async def _display_progress_for_plan(message: types.Message, db, user_id: int, training_plan: TrainingPlan,
+                                     title: str | None = None):
+    """Display progress for a specific training plan (most recent page first)"""
+    text, markup = await _progress_page(db, user_id, training_plan, title=title)
+    await message.answer(text, reply_markup=markup)
+
+async def _display_progress(message: types.Message, db, user: User):
+    """Legacy function for backward compatibility (progress of the active plan)"""
+    training_plan = await db.get(TrainingPlan, user.active_plan_id) if user.active_plan_id else None
 
-    if not user.training_plan:
-        db.close()
+    if not training_plan:
         return await message.answer("📈 **I tuoi progressi**\n\nNessuna scheda caricata. Usa /import_plan.")
 
-    plan = json.loads(user.training_plan)
-    
-    # Recupera tutti i log dell'utente
-    logs = db.query(WorkoutLog).filter(
-        WorkoutLog.user_id == user.id
-    ).order_by(WorkoutLog.ts.asc()).all()
-    
-    if not logs:
-        db.close()
-        return await message.answer("📈 **I tuoi progressi**\n\nNessun dato di allenamento registrato.")
-
-    # Raggruppa i log per giorno di allenamento e poi per esercizio
-    workout_progress = {}
-    for log in logs:
-        if log.day not in workout_progress:
-            workout_progress[log.day] = {}
-        if log.exercise not in workout_progress[log.day]:
-            workout_progress[log.day][log.exercise] = {}
-        
-        date_str = log.ts.strftime("%d/%m")
-        if date_str not in workout_progress[log.day][log.exercise]:
-            workout_progress[log.day][log.exercise][date_str] = []
-        workout_progress[log.day][log.exercise][date_str].append(log)
-
-    response = "📈 **I tuoi progressi**\n\n"
-    
-    # Per ogni giorno nel piano (nell'ordine della scheda)
-    for day_name in plan.keys():
-        if day_name in workout_progress and workout_progress[day_name]:
-            response += f"🏷️ **{day_name}**\n"
-            
-            # Per ogni esercizio nel giorno (nell'ordine della scheda)
-            for exercise in plan[day_name]:
-                exercise_name = exercise['name']
-                if exercise_name in workout_progress[day_name]:
-                    response += f"  🏋️ {exercise_name}:\n"
-                    
-                    # Per ogni data in cui è stato fatto l'esercizio (ordinate cronologicamente)
-                    for date_str in sorted(workout_progress[day_name][exercise_name].keys()):
-                        logs_list = workout_progress[day_name][exercise_name][date_str]
-                        response += f"    📅 {date_str}: "
-                        # Mostra tutti i set del giorno in formato compatto
-                        sets = [f"{log.weight}kg × {log.reps}" for log in logs_list]
-                        response += " ".join(sets) + "\n"
-                    
-                    response += "\n"
-            
-            response += "\n"
-    
-    await message.answer(response)
-    db.close()
-
-async def _start_workout_flow(message: types.Message, tg_user: types.User):
-    db = get_db()
-    user = _get_user(db, tg_user)
+    await _display_progress_for_plan(message, db, user.id, training_plan, title="📈 **I tuoi progressi**")
 
-    if not user.training_plan:
-        db.close()
+async def _start_workout_flow(message: types.Message, db, user: User):
+    if not user.active_plan_id:
         return await message.answer("⚠️ <b>Nessuna scheda caricata</b>\n\nUsa il comando /import_plan per caricare la tua scheda di allenamento.")
 
-    plan = json.loads(user.training_plan)
+    plan = await get_compiled_plan(db, user.active_plan_id)
     if not plan:
-        db.close()
         return await message.answer("⚠️ <b>La scheda è vuota</b>\n\nReimporta il file con /import_plan.")
 
     kb = InlineKeyboardBuilder()
@@ -495,76 +458,53 @@ async def _start_workout_flow(message: types.Message, tg_user: types.User):
     )
     
     await message.answer(response, reply_markup=kb.as_markup())
-    db.close()
 
 @router.callback_query(F.data.startswith("day:"))
-async def choose_day(cb: types.CallbackQuery):
+async def choose_day(cb: types.CallbackQuery, db, user: User):
     day = cb.data.split(":", 1)[1]
-    db = get_db()
-    user = _get_user(db, cb.from_user)
-
     user.current_day = day
     user.exercise_idx = 0
     user.set_idx = 0
-    db.commit()
+    await db.commit()
 
     await cb.answer()
     await cb.message.answer(f"🏷️ Allenamento scelto: <b>{day}</b> ✅")
     await _prompt_next_set(cb.message, user, db)
-    db.close()
 
-async def _prompt_next_set(message: types.Message, user: User, db):
-    plan = json.loads(user.training_plan)
+async def _prompt_next_set(message: types.Message, user: User, db, intro: str = ""):
+    """Ask for the next set (or close the workout); `intro` is prepended to the message"""
+    plan = await get_compiled_plan(db, user.active_plan_id)
     exercises = plan.get(user.current_day, [])
     if user.exercise_idx >= len(exercises):
         day = user.current_day
         user.current_day = None
         user.exercise_idx = 0
         user.set_idx = 0
-        db.commit()
-        return await message.answer(f"🎉 Allenamento <b>{day}</b> completato! 💪🔥")
+        await write_behind.commit_user(db, user)
+        await state_store.set_awaiting(db, user.id, False)
+        return await message.answer(f"{intro}🎉 Allenamento <b>{day}</b> completato! 💪🔥")
 
     ex = exercises[user.exercise_idx]
-    total_sets = int(ex["sets"])
+    total_sets = ex.sets
 
     if user.set_idx >= total_sets:
         user.exercise_idx += 1
         user.set_idx = 0
-        db.commit()
-        return await _prompt_next_set(message, user, db)
+        await write_behind.commit_user(db, user)
+        return await _prompt_next_set(message, user, db, intro)
 
 
     # Se è l'inizio di un nuovo esercizio (prima serie), mostra il recap dei progressi
     progress_recap = ""
     if user.set_idx == 0:
-        # Recupera tutti i log per questo esercizio
-        exercise_logs = db.query(WorkoutLog).filter(
-            WorkoutLog.user_id == user.id,
-            WorkoutLog.exercise == ex['name']
-        ).order_by(WorkoutLog.ts.desc()).all()
-        
-        if exercise_logs:
-            # Raggruppa i log per giorno (data)
-            day_progress = {}
-            for log in exercise_logs:
-                date_str = log.ts.strftime("%d/%m")
-                if date_str not in day_progress:
-                    day_progress[date_str] = []
-                day_progress[date_str].append(log)
-            
-            # Prendi gli ultimi 5 giorni (dal più recente)
-            recent_days = sorted(day_progress.keys(), reverse=True)[:5]
-            
-            if recent_days:
-                progress_recap = "\n\n📈 **Progressi recenti:**\n"
-                for date_str in recent_days:
-                    logs_list = day_progress[date_str]
-                    progress_recap += f"  {date_str}: "
-                    # Mostra tutti i set del giorno in formato compatto
-                    sets = [f"{log.weight}kg × {log.reps}" for log in logs_list]
-                    progress_recap += " ".join(sets) + "\n"
-
-    awaiting_set[user.id] = True
+        # Ultime sessioni dell'esercizio, lette dalla tabella di riepilogo (una sola riga)
+        if write_behind.has_pending(user.id, ex.name):
+            await write_behind.flush_user(user.id)
+        progress_recap = recaps.format_recap(await recaps.get_recap(db, user.id, ex.name))
+        if db.new or db.dirty:
+            await write_behind.commit_user(db, user)
+
+    await state_store.set_awaiting(db, user.id, True)
     
     # Crea la tastiera con pulsanti Indietro, Salta, Piano e Annulla
     kb = InlineKeyboardBuilder()
@@ -579,7 +519,7 @@ async def _prompt_next_set(message: types.Message, user: User, db):
     # Aggiungi pulsante "Guarda Video" solo alla prima serie di ogni esercizio
     if user.set_idx == 0:
         # Generate YouTube search URL based on exercise name
-        search_query = f"{ex['name']} esercizio come fare tutorial"
+        search_query = f"{ex.name} esercizio come fare tutorial"
         youtube_search_url = f"https://www.youtube.com/results?search_query={search_query.replace(' ', '+')}"
         kb.button(text="🎥 Guarda Video", url=youtube_search_url)
     
@@ -589,11 +529,11 @@ async def _prompt_next_set(message: types.Message, user: User, db):
     kb.adjust(2, 1)  # 2 colonne per i primi pulsanti, poi 1 colonna per gli altri
     
     # Messaggio più descrittivo e user-friendly
-    message_text = (
-        f"💪 <b>{ex['name']}</b>\n\n"
+    message_text = intro + (
+        f"💪 <b>{ex.name}</b>\n\n"
         f"📊 <b>Progresso:</b> Serie {user.set_idx + 1} di {total_sets}\n"
-        f"🎯 <b>Obiettivo:</b> {ex['reps']} ripetizioni\n"
-        f"⏱️ <b>Recupero:</b> {ex['rest']}\n"
+        f"🎯 <b>Obiettivo:</b> {ex.reps} ripetizioni\n"
+        f"⏱️ <b>Recupero:</b> {ex.rest}\n"
     )
     
     if progress_recap:
@@ -602,188 +542,102 @@ async def _prompt_next_set(message: types.Message, user: User, db):
     message_text += (
         f"\n📝 <b>Inserisci i dati della serie:</b>\n"
         f"• Formato: <code>peso reps</code>\n"
-        f"• Esempio: <code>50 10</code>\n\n"
+        f"• Esempio: <code>50 10</code>\n"
+        f"• Più serie insieme: <code>50x10 50x10 52,5x8</code>\n\n"
         f"💡 <i>Puoi usare la virgola per i decimali (es. 52,5)</i>"
     )
     
     await message.answer(message_text, reply_markup=kb.as_markup())
 
-@router.message()
-async def capture_set(message: types.Message):
-    if not awaiting_set.get(message.from_user.id):
-        return
-
+# awaiting_set: DbSessionMiddleware carica l'utente solo se sta registrando una serie
+# (un solo SELECT con lo stato, nessun upsert); per gli altri messaggi l'update resta
+# non gestito.
+# pending_sets: il middleware applica il cursore ancora nel buffer write-behind invece di
+# scrivere il buffer prima di caricare l'utente
+@router.message(flags={"awaiting_set": True, "pending_sets": True})
+async def capture_set(message: types.Message, db, user: User):
     try:
-        p, r = message.text.strip().split()
-        weight = p.replace(",", ".")
-        reps = int(r)
-    except Exception:
-        return await message.answer("⚠️ Formato invalido. Usa <code>peso reps</code> (es. <code>50 10</code>).")
-
-    db = get_db()
-    user = _get_user(db, message.from_user)
-    if not user.training_plan or not user.current_day:
-        awaiting_set[message.from_user.id] = False
-        db.close()
+        entries = parse_sets(message.text or "")
+    except ValueError:
+        return await message.answer(
+            "⚠️ Formato invalido. Usa <code>peso reps</code> (es. <code>50 10</code>) "
+            "oppure più serie insieme (es. <code>50x10 50x10 52,5x8</code>)."
+        )
+
+    if not user.active_plan_id or not user.current_day:
+        await state_store.set_awaiting(db, user.id, False)
         return await message.answer("⚠️ Nessun workout attivo. Usa /workout.")
 
-    plan = json.loads(user.training_plan)
+    plan = await get_compiled_plan(db, user.active_plan_id)
     exercises = plan.get(user.current_day, [])
     if user.exercise_idx >= len(exercises):
-        awaiting_set[message.from_user.id] = False
-        db.close()
+        await state_store.set_awaiting(db, user.id, False)
         return await message.answer("🏁 Allenamento concluso.")
 
     ex = exercises[user.exercise_idx]
-    set_number = user.set_idx + 1
-    total_sets = int(ex["sets"])
-
-    log = WorkoutLog(
-        user_id=user.id,
-        day=user.current_day,
-        exercise=ex["name"],
-        set_number=set_number,
-        weight=weight,
-        reps=reps,
-    )
-    db.add(log)
+    total_sets = ex.sets
+    remaining = total_sets - user.set_idx
+    if len(entries) > remaining:
+        return await message.answer(
+            f"⚠️ Hai inserito <b>{len(entries)}</b> serie ma per <b>{ex.name}</b> "
+            f"ne restano <b>{remaining}</b>. Nessuna serie registrata."
+        )
 
-    user.set_idx += 1
-    db.commit()
-    awaiting_set[message.from_user.id] = False
+    # Tutte le serie del messaggio in un solo INSERT e una sola transazione
+    now = datetime.utcnow()
+    first_set = user.set_idx + 1
+    rows = [
+        dict(
+            user_id=user.id,
+            plan_id=user.active_plan_id,
+            day=user.current_day,
+            exercise=ex.name,
+            set_number=first_set + i,
+            weight=weight,
+            weight_kg=weight_to_kg(weight),
+            reps=reps,
+            ts=now,
+            import_key=import_key(now, ex.name, first_set + i),
+        )
+        for i, (weight, reps) in enumerate(entries)
+    ]
+    user.set_idx += len(entries)
+    if write_behind.enabled:
+        # Scritto dal prossimo commit di gruppo insieme alle serie degli altri utenti
+        write_behind.add(user, rows, ex.name, now, entries)
+    else:
+        await insert_sets(db, rows)
+        await recaps.add_sets(db, user.id, ex.name, now, entries)
+        await db.commit()
+    page_cache.invalidate(user.id)
+    # awaiting_set resta attivo: _prompt_next_set lo conferma per la serie
+    # successiva o lo spegne a fine allenamento
+
+    if len(entries) == 1:
+        weight, reps = entries[0]
+        summary = f"✅ Registrato: <b>{ex.name}</b> — set {first_set}/{total_sets}: <b>{weight}kg × {reps}</b>\n"
+    else:
+        summary = f"✅ Registrate <b>{len(entries)}</b> serie di <b>{ex.name}</b>:\n" + "".join(
+            f"• set {first_set + i}/{total_sets}: <b>{weight}kg × {reps}</b>\n"
+            for i, (weight, reps) in enumerate(entries)
+        )
 
-    await message.answer(f"✅ Registrato: <b>{ex['name']}</b> — set {set_number}/{total_sets}: <b>{weight}kg × {reps}</b>")
-    
     # Start smart rest timer only if we're not at the last set of the exercise
     if user.set_idx < total_sets:
-        await _start_rest_timer(message, user, ex)
+        await _start_rest_timer(message, db, user, ex)
     else:
-        await message.answer("🏁 **Esercizio completato!** Passando al prossimo...")
-    
-    await _prompt_next_set(message, user, db)
-    db.close()
+        summary += "🏁 <b>Esercizio completato!</b> Passando al prossimo...\n"
 
-async def _start_rest_timer(message: types.Message, user: User, ex: dict):
+    # Un'unica risposta: riepilogo delle serie + richiesta della serie successiva
+    await _prompt_next_set(message, user, db, intro=summary + "\n")
+
+async def _start_rest_timer(message: types.Message, db, user: User, ex: CompiledExercise):
     """Start a smart rest timer after a set is completed"""
-    # Get rest time directly from the exercise data in the training plan
-    rest_time_str = ex.get('rest', '60s')  # Default to 60 seconds if not specified
-    
-    # Parse rest time string to seconds
-    total_seconds = _parse_rest_time(rest_time_str)
+    # Rest time is pre-parsed to seconds when the plan is compiled
+    total_seconds = ex.rest_seconds
     
     if total_seconds <= 0:
         return  # No rest time specified or invalid
     
-    user_id = user.id
-    
-    # Cancel any existing timer for this user
-    if user_id in active_timers:
-        active_timers[user_id].cancel()
-        del active_timers[user_id]
-    
-    # Create and store the timer task
-    timer_task = asyncio.create_task(_run_rest_timer(message, user_id, total_seconds, ex['name'], rest_time_str))
-    active_timers[user_id] = timer_task
-
-def _parse_rest_time(rest_str: str) -> int:
-    """Parse rest time string (e.g., '60s', '1m', '1m 30s', '120''') to total seconds"""
-    if not rest_str:
-        return 60  # Default to 60 seconds
-    
-    rest_str = rest_str.lower().strip()
-    total_seconds = 0
-    
-    # Match minutes and seconds
-    minute_match = re.search(r'(\d+)\s*m', rest_str)
-    second_match = re.search(r'(\d+)\s*(?:s|'')', rest_str)  # Handle both 's' and '' notation
-    
-    if minute_match:
-        total_seconds += int(minute_match.group(1)) * 60
-    
-    if second_match:
-        total_seconds += int(second_match.group(1))
-    
-    # If no matches found, try to parse as plain number (assume seconds)
-    if total_seconds == 0 and rest_str.replace('"', '').replace("'", '').isdigit():
-        total_seconds = int(rest_str.replace('"', '').replace("'", ''))
-    
-    return total_seconds if total_seconds > 0 else 60  # Default to 60 seconds if invalid
-
-async def _run_rest_timer(message: types.Message, user_id: int, total_seconds: int, exercise_name: str, rest_time_str: str):
-    """Run the actual rest timer countdown"""
-    try:
-        # Send initial timer start message
-        timer_msg = await message.answer(
-            f"⏱️ <b>Timer di Recupero Avviato</b>\n\n"
-            f"💪 <b>{exercise_name}</b>\n"
-            f"⏰ <b>Recupero impostato:</b> {rest_time_str}\n"
-            f"🕒 <b>Tempo rimanente:</b> {total_seconds}s\n\n"
-            f"💡 <i>Il timer si aggiornerà automaticamente</i>"
-        )
-        
-        remaining = total_seconds
-        
-        # Update every second until time is up
-        while remaining > 0:
-            await asyncio.sleep(1)
-            remaining -= 1
-            
-            # Check if user has moved on (no longer awaiting set)
-            if not awaiting_set.get(user_id, False):
-                break
-            
-            # Update the message with remaining time
-            if remaining > 0:
-                # Format time for better display
-                if remaining >= 60:
-                    minutes = remaining // 60
-                    seconds = remaining % 60
-                    time_str = f"{minutes}m {seconds}s"
-                else:
-                    time_str = f"{remaining}s"
-                
-                # Add beep sound indicator for last 3 seconds
-                beep_indicator = ""
-                if remaining <= 3:
-                    beep_indicator = f"\n🔊 <b>BEEP!</b>"
-                
-                try:
-                    await timer_msg.edit_text(
-                        f"⏱️ <b>Timer di Recupero</b>\n\n"
-                        f"💪 <b>{exercise_name}</b>\n"
-                        f"⏰ <b>Recupero impostato:</b> {rest_time_str}\n"
-                        f"🕒 <b>Tempo rimanente:</b> {time_str}{beep_indicator}\n\n"
-                        f"💡 <i>Il timer si aggiornerà automaticamente</i>"
-                    )
-                except Exception:
-                    # Message might be too old to edit, break out
-                    break
-        
-        # Timer completed or stopped
-        if remaining <= 0:
-            await timer_msg.edit_text(
-                f"🔔 <b>Timer di Recupero Completato!</b>\n\n"
-                f"💪 <b>{exercise_name}</b>\n"
-                f"⏰ <b>Recupero impostato:</b> {rest_time_str}\n"
-                f"✅ <b>Pronto per la prossima serie!</b>\n\n"
-                f"🔄 Il tempo di recupero è terminato."
-            )
-        else:
-            # Timer was stopped (user moved on)
-            await timer_msg.edit_text(
-                f"⏹️ <b>Timer di Recupero Interrotto</b>\n\n"
-                f"💪 <b>{exercise_name}</b>\n"
-                f"⏰ <b>Recupero impostato:</b> {rest_time_str}\n"
-                f"🔜 <b>Passando alla serie successiva...</b>"
-            )
-    
-    except asyncio.CancelledError:
-        # Timer was cancelled externally
-        pass
-    except Exception as e:
-        # Log any other errors but don't crash
-        print(f"Timer error: {e}")
-    finally:
-        # Clean up
-        if user_id in active_timers:
-            del active_timers[user_id]
+    # The central scheduler replaces any existing timer for this user
+    await rest_timers.start(db, message, user.id, total_seconds, ex.name, ex.rest or '60s')
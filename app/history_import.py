@@ -0,0 +1,139 @@
+"""Bulk import of past sets from a history file (another app's export, a spreadsheet, /export).
+
+Il file (vedi app/utils/history_parser.py) viene letto e validato nel pool di processi
+degli import (app/imports.py) entro HISTORY_TIMEOUT secondi; le righe valide vengono
+poi scritte a blocchi di HISTORY_BATCH_ROWS, ognuno con un solo INSERT multi-riga
+(executemany) e un commit. Ogni serie importata ha una chiave naturale
+(`import_key`: data al secondo, esercizio, numero di serie) con un indice unico per
+utente, la stessa delle serie registrate nel bot: reimportare lo stesso file, un file
+che si sovrappone o il proprio /export non duplica nulla (`ON CONFLICT DO NOTHING`,
+più un controllo sull'archivio delle serie compattate).
+
+La scheda di ogni serie è quella con il nome della colonna Scheda, altrimenti la
+scheda attiva; senza colonna Allenamento il giorno è quello della scheda che contiene
+l'esercizio.
+
+- `HISTORY_MAX_BYTES` (20 MB, il limite di download dei bot Telegram), controllato
+  prima del download;
+- `HISTORY_TIMEOUT` (120s): uno storico è molto più grande di una scheda;
+- `HISTORY_MAX_RUNNING` import alla volta (default IMPORT_WORKERS - 1, almeno 1: un
+  worker del pool resta libero per le schede), gli altri vengono rifiutati.
+"""
+import asyncio
+import os
+import time
+from typing import NamedTuple
+from sqlalchemy import select
+from app import recaps
+from app.imports import IMPORT_WORKERS, ImportRejected, plan_importer
+from app.models import TrainingPlan, WorkoutLog, WorkoutLogArchive
+from app.plans import get_compiled_plan
+from app.utils.sets import import_key
+from app.writebehind import insert_logs
+
+HISTORY_BATCH_ROWS = int(os.getenv("HISTORY_BATCH_ROWS", "5000"))
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(20 * 1024 * 1024)))
+HISTORY_TIMEOUT = float(os.getenv("HISTORY_TIMEOUT", "120"))
+HISTORY_MAX_RUNNING = int(os.getenv("HISTORY_MAX_RUNNING", str(max(1, IMPORT_WORKERS - 1))))
+
+class HistoryImportResult(NamedTuple):
+    rows: int        # righe non vuote lette dal file
+    inserted: int
+    duplicates: int  # già presenti (stesso file reimportato, sovrapposizioni)
+    invalid: int
+    errors: list
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+class _PlanResolver:
+    """Plan id and day of an imported set, from the Scheda / Allenamento columns or the active plan"""
+
+    def __init__(self, db, user, plans: dict):
+        self._db = db
+        self._active = user.active_plan_id
+        self._plans = plans            # nome (casefold) -> id
+        self._days: dict[int, dict] = {}  # plan id -> esercizio -> primo giorno che lo contiene
+
+    async def resolve(self, plan_name: str, day: str, exercise: str):
+        plan_id = self._plans.get(plan_name.casefold(), self._active) if plan_name else self._active
+        if day or plan_id is None:
+            return plan_id, day or None
+        if plan_id not in self._days:
+            plan = await get_compiled_plan(self._db, plan_id)
+            days: dict[str, str] = {}
+            for day_name, exercises in (plan.items() if plan else ()):
+                for ex in exercises:
+                    days.setdefault(ex.name, day_name)
+            self._days[plan_id] = days
+        return plan_id, self._days[plan_id].get(exercise)
+
+async def import_history(db, user, reader, batch_rows: int = HISTORY_BATCH_ROWS) -> HistoryImportResult:
+    """Insert the valid rows of `reader` for `user`, skipping the sets already imported"""
+    t0 = time.perf_counter()
+    plans = {name.casefold(): plan_id for plan_id, name in (await db.execute(
+        select(TrainingPlan.id, TrainingPlan.plan_name).where(TrainingPlan.user_id == user.id)
+        .order_by(TrainingPlan.id)
+    )).all()}
+    resolver = _PlanResolver(db, user, plans)
+    insert_stmt = insert_logs().returning(WorkoutLog.exercise)
+    inserted, touched = 0, set()
+    valid = 0
+
+    batches = reader.batches(batch_rows)
+    try:
+        # Lettura e validazione (CPU-bound, soprattutto xlsx) in un thread, un blocco alla volta
+        while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+            valid += len(batch)
+            values = {}
+            for row in batch:
+                key = import_key(row.ts, row.exercise, row.set_number)
+                plan_id, day = await resolver.resolve(row.plan, row.day, row.exercise)
+                values[key] = dict(user_id=user.id, plan_id=plan_id, day=day, exercise=row.exercise,
+                                   set_number=row.set_number, weight=row.weight, weight_kg=row.weight_kg,
+                                   reps=row.reps, ts=row.ts, import_key=key)
+            # Serie già importate e poi compattate: non sono più in workout_logs
+            archived = set((await db.execute(
+                select(WorkoutLogArchive.import_key)
+                .where(WorkoutLogArchive.user_id == user.id, WorkoutLogArchive.import_key.in_(values))
+            )).scalars())
+            rows = [v for k, v in values.items() if k not in archived]
+            if rows:
+                new = (await db.execute(insert_stmt, rows)).scalars().all()
+                inserted += len(new)
+                touched.update(new)
+            await db.commit()
+    finally:
+        reader.close()
+
+    if touched:
+        await recaps.rebuild_recaps(db, user.id, touched)
+        await db.commit()
+    return HistoryImportResult(reader.rows, inserted, valid - inserted, reader.invalid, reader.errors,
+                               time.perf_counter() - t0)
+
+class HistoryImporter:
+    def __init__(self, max_running: int = HISTORY_MAX_RUNNING, timeout: float = HISTORY_TIMEOUT):
+        self.max_running = max_running
+        self.timeout = timeout
+        self._running = 0
+
+    async def run(self, db, user, source, kind: str) -> HistoryImportResult:
+        """Validate `source` (bytes or path) in the import pool, then import it for `user`"""
+        if self._running >= self.max_running:
+            raise ImportRejected("Troppe importazioni in corso, riprova tra qualche minuto.")
+        self._running += 1
+        t0 = time.perf_counter()
+        try:
+            async with plan_importer.parse_history(source, kind, self.timeout) as parsed:
+                if parsed is None:
+                    raise ImportRejected(
+                        "Il file non sembra uno storico: servono le colonne Data, Esercizio, Peso e Ripetizioni.")
+                result = await import_history(db, user, parsed)
+        finally:
+            self._running -= 1
+        return result._replace(seconds=time.perf_counter() - t0)
+
+history_importer = HistoryImporter()
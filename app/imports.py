@@ -0,0 +1,160 @@
+"""Plan imports offloaded to a bounded process pool.
+
+Il parsing del file (.xlsx o .csv, vedi app/utils/plan_parser.py) è CPU-bound e su file grandi o malformati può
+durare secondi: gira in un `ProcessPoolExecutor` separato così l'event loop continua a
+servire gli altri update. Lo stesso pool legge e valida gli storici di /import_history
+(`parse_history`, app/utils/history_parser.py), con il timeout HISTORY_TIMEOUT.
+
+- `IMPORT_MAX_BYTES`: file più grandi vengono rifiutati prima del download;
+- `IMPORT_SPOOL_BYTES`: oltre questa soglia il file viene scaricato su un file
+  temporaneo (il worker lo legge dal disco) invece che in memoria;
+- `IMPORT_WORKERS` processi, al massimo `IMPORT_MAX_QUEUED` import in coda;
+- `IMPORT_TIMEOUT`: un job che supera il limite viene interrotto terminando solo il
+  processo che lo esegue (ogni worker ha un job alla volta, vedi
+  app/utils/import_worker.py); gli import degli altri utenti continuano e al job
+  successivo parte un worker nuovo.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from aiogram import Bot, types
+from app.utils.history_parser import ParsedHistory, parse_history_file
+from app.utils.import_worker import worker_loop
+from app.utils.plan_parser import PlanParseError, parse_plan_file
+
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(1024 * 1024)))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+IMPORT_MAX_QUEUED = int(os.getenv("IMPORT_MAX_QUEUED", "20"))
+IMPORT_TIMEOUT = float(os.getenv("IMPORT_TIMEOUT", "20"))
+
+class ImportRejected(Exception):
+    """The upload can't be imported; the message is shown to the user"""
+
+def check_size(size: int, max_bytes: int = IMPORT_MAX_BYTES):
+    if size > max_bytes:
+        raise ImportRejected(
+            f"Il file è troppo grande ({size / 1024 / 1024:.1f} MB, "
+            f"massimo {max_bytes / 1024 / 1024:.1f} MB)."
+        )
+
+class _Worker:
+    """A spawned process running one import job at a time"""
+
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=worker_loop, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def call(self, fn, args):
+        """Blocking: send the job and wait for `(ok, result or exception)`; runs in a thread"""
+        try:
+            self.conn.send((fn, args))
+            return self.conn.recv()
+        except (EOFError, OSError):
+            # Il processo è morto o è stato terminato (kill): la pipe si chiude qui, dal
+            # thread che la stava usando
+            self.conn.close()
+            raise
+
+    def kill(self):
+        self.process.terminate()
+
+class PlanImporter:
+    def __init__(self, workers: int = IMPORT_WORKERS, timeout: float = IMPORT_TIMEOUT,
+                 max_queued: int = IMPORT_MAX_QUEUED):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_queued = max_queued
+        # spawn: i worker non ereditano thread e connessioni del processo del bot
+        self._context = multiprocessing.get_context("spawn")
+        self._slots = asyncio.Semaphore(workers)
+        self._idle: list[_Worker] = []
+        self._busy: set[_Worker] = set()
+        self._pending = 0
+
+    async def _run(self, timeout: float, fn, *args):
+        """Run `fn(*args)` in a worker process, enforcing the queue limit and `timeout`"""
+        if self._pending >= self.max_queued:
+            raise ImportRejected("Troppe importazioni in corso, riprova tra qualche secondo.")
+        self._pending += 1
+        try:
+            async with self._slots:
+                worker = self._idle.pop() if self._idle else _Worker(self._context)
+                self._busy.add(worker)
+                try:
+                    ok, value = await asyncio.wait_for(asyncio.to_thread(worker.call, fn, args), timeout)
+                except asyncio.TimeoutError:
+                    # Un worker bloccato non si può interrompere dall'esterno: si termina
+                    # il suo processo, gli altri job continuano
+                    worker.kill()
+                    raise ImportRejected(f"Il file ha richiesto più di {timeout:.0f}s per essere letto.")
+                except (EOFError, OSError):
+                    worker.kill()
+                    raise ImportRejected("Lettura del file interrotta, riprova.")
+                except BaseException:
+                    worker.kill()  # annullato mentre il job gira: il worker non è riusabile
+                    raise
+                finally:
+                    self._busy.discard(worker)
+                self._idle.append(worker)
+        finally:
+            self._pending -= 1
+        if not ok:
+            raise value
+        return value
+
+    async def parse(self, source, kind: str = "xlsx") -> dict:
+        """Parse `source` (bytes or path of an .xlsx/.csv) in the pool, enforcing the timeout"""
+        try:
+            return await self._run(self.timeout, parse_plan_file, source, kind)
+        except PlanParseError as e:
+            raise ImportRejected(f"Il file contiene errori:\n{e}")
+
+    @asynccontextmanager
+    async def parse_history(self, source, kind: str, timeout: float):
+        """Validate a history file in the pool; yields a ParsedHistory, None if it is not a history file"""
+        fd, path = tempfile.mkstemp(suffix=".rows", prefix="history_import_")
+        os.close(fd)
+        try:
+            summary = await self._run(timeout, parse_history_file, source, kind, path)
+            yield ParsedHistory(path, **summary) if summary is not None else None
+        finally:
+            os.unlink(path)
+
+    @asynccontextmanager
+    async def download(self, bot: Bot, document: types.Document, max_bytes: int = IMPORT_MAX_BYTES):
+        """Check the size and download an upload; yields (bytes or temporary file path, kind)"""
+        check_size(document.file_size or 0, max_bytes)
+        kind = "csv" if document.file_name.lower().endswith(".csv") else "xlsx"
+        file = await bot.get_file(document.file_id)
+        if (document.file_size or 0) <= IMPORT_SPOOL_BYTES:
+            buf = io.BytesIO()
+            await bot.download_file(file.file_path, destination=buf)
+            yield buf.getvalue(), kind
+            return
+
+        fd, path = tempfile.mkstemp(suffix="." + kind, prefix="plan_import_")
+        os.close(fd)
+        try:
+            await bot.download_file(file.file_path, destination=path)
+            yield path, kind
+        finally:
+            os.unlink(path)
+
+    async def import_document(self, bot: Bot, document: types.Document) -> dict:
+        """Check size, download (spooling large files to disk) and parse an uploaded plan"""
+        async with self.download(bot, document) as (source, kind):
+            return await self.parse(source, kind)
+
+    def shutdown(self):
+        for worker in self._idle + list(self._busy):
+            worker.kill()
+        self._idle.clear()
+        self._busy.clear()
+
+plan_importer = PlanImporter()
@@ -1,19 +1,79 @@
 from aiogram import types
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-def home_menu():
+# Le tastiere statiche vengono costruite una sola volta all'import e riusate:
+# non vanno modificate da chi le riceve.
+
+def _build(buttons, *sizes) -> types.InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
-    kb.button(text="📂 Importa scheda (Excel)", callback_data="import:prompt")
-    kb.button(text="🏋️ Avvia Workout", callback_data="workout:start")
-    kb.button(text="📊 Visualizza Piano", callback_data="view_plan")
-    kb.button(text="📈 Progressi", callback_data="view_progress")
-    kb.button(text="🔄 Reset", callback_data="reset:confirm")
-    kb.adjust(1)
+    for text, data in buttons:
+        kb.button(text=text, callback_data=data)
+    kb.adjust(*sizes)
     return kb.as_markup()
 
+_HOME_MENU = _build([
+    ("📂 Importa scheda (Excel)", "import:prompt"),
+    ("🏋️ Avvia Workout", "workout:start"),
+    ("📊 Visualizza Piano", "view_plan"),
+    ("📈 Progressi", "view_progress"),
+    ("📤 Esporta storico", "export:prompt"),
+    ("🔄 Reset", "reset:confirm"),
+], 1)
+
+_RESET_CONFIRMATION_MENU = _build([
+    ("✅ Conferma Reset", "reset:execute"),
+    ("❌ Annulla", "reset:cancel"),
+], 2)
+
+_IMPORT_MENU = _build([
+    ("📥 Scarica Template", "download_template"),
+    ("📤 Carica Scheda", "import:prompt"),
+], 1)
+
+_TEMPLATE_MENU = _build([
+    ("📥 Scarica Template", "download_template"),
+], 1)
+
+_PLAN_IMPORTED_MENU = _build([
+    ("🏋️ Inizia Allenamento", "workout:start"),
+    ("📋 Vedi Piano", "view_plan"),
+    ("📈 Vedi Progressi", "view_progress"),
+], 2, 1)
+
+_CANCEL_WORKOUT_CONFIRMATION_MENU = _build([
+    ("✅ Conferma Annullamento", "cancel_workout_confirm"),
+    ("❌ Continua Allenamento", "cancel_workout_cancel"),
+], 1)
+
+_EXPORT_MENU = _build([
+    ("📄 CSV", "export:csv"),
+    ("📊 Excel", "export:xlsx"),
+], 2)
+
+_IMPORT_HISTORY_MENU = _build([
+    ("❌ Annulla", "import_history:cancel"),
+], 1)
+
+def home_menu():
+    return _HOME_MENU
+
 def reset_confirmation_menu():
-    kb = InlineKeyboardBuilder()
-    kb.button(text="✅ Conferma Reset", callback_data="reset:execute")
-    kb.button(text="❌ Annulla", callback_data="reset:cancel")
-    kb.adjust(2)
-    return kb.as_markup()
+    return _RESET_CONFIRMATION_MENU
+
+def import_menu():
+    return _IMPORT_MENU
+
+def template_menu():
+    return _TEMPLATE_MENU
+
+def plan_imported_menu():
+    return _PLAN_IMPORTED_MENU
+
+def cancel_workout_confirmation_menu():
+    return _CANCEL_WORKOUT_CONFIRMATION_MENU
+
+def export_menu():
+    return _EXPORT_MENU
+
+def import_history_menu():
+    return _IMPORT_HISTORY_MENU
@@ -0,0 +1,236 @@
+"""Metrics in Prometheus text format, served on a local port (METRICS_PORT).
+
+Senza dipendenze esterne: contatori e istogrammi con etichette, più gauge calcolati
+al momento dello scrape. `setup_metrics(dp)` (chiamato da main.py solo se
+METRICS_PORT è impostata) registra:
+
+- un middleware sul Dispatcher: latenza e errori per handler, query SQL e tempo
+  passato nel database per ogni update;
+- gli hook di SQLAlchemy (`before/after_cursor_execute`) su tutti gli engine;
+- i gauge: timer di recupero attivi, utenti in attesa di una serie, messaggi in coda
+  d'invio, serie nel buffer write-behind.
+
+    curl http://127.0.0.1:9100/metrics
+"""
+import contextvars
+import inspect
+import os
+import time
+from aiogram import BaseMiddleware, Dispatcher
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))    # 0 = metriche disattivate
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+_INF = 'le="+Inf"'
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {_number(value)}"
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._values: dict[tuple, list] = {}   # labels -> [conteggi per bucket..., somma, totale]
+
+    def observe(self, value: float, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def samples(self):
+        for labels, entry in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, entry):
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labels, labels, le)} {count}"
+            yield f"{self.name}_bucket{_labels(self.labels, labels, _INF)} {entry[-1]}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {_number(entry[-2])}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {entry[-1]}"
+
+class Gauge:
+    """Value read at scrape time from `read()` (sync or async): a number or {label value: number}"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read, label: str | None = None, kind: str = "gauge"):
+        self.name, self.help, self.read, self.label, self.kind = name, help, read, label, kind
+        self._last = None
+
+    async def collect(self):
+        value = self.read()
+        if inspect.isawaitable(value):
+            value = await value
+        self._last = value
+
+    def samples(self):
+        if isinstance(self._last, dict):
+            for key, value in sorted(self._last.items()):
+                yield f'{self.name}{{{self.label}="{_escape(key)}"}} {_number(value)}'
+        elif self._last is not None:
+            yield f"{self.name} {_number(self._last)}"
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            if isinstance(metric, Gauge):
+                try:
+                    await metric.collect()
+                except Exception as e:
+                    print(f"❌ Errore nella metrica {metric.name}: {e}")
+                    continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+handler_duration = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Handler latency", ("handler",)))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Exceptions raised by handlers", ("handler",)))
+update_queries = registry.register(Histogram(
+    "bot_update_db_queries", "SQL queries per update", ("handler",), COUNT_BUCKETS))
+update_db_seconds = registry.register(Histogram(
+    "bot_update_db_seconds", "Time spent in SQL queries per update", ("handler",), LATENCY_BUCKETS))
+db_queries = registry.register(Counter(
+    "bot_db_queries_total", "SQL queries, inside and outside updates"))
+db_query_duration = registry.register(Histogram(
+    "bot_db_query_duration_seconds", "Duration of single SQL queries", buckets=QUERY_BUCKETS))
+timer_errors = registry.register(Counter(
+    "bot_rest_timer_errors_total", "Rest-timer message edits that failed"))
+
+# --- update / handler middleware -------------------------------------------------
+
+_update = contextvars.ContextVar("metrics_update", default=None)
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer `update` middleware: collects the SQL queries made while handling one update"""
+
+    async def __call__(self, handler, event, data):
+        stats = {"handler": "unhandled", "queries": 0, "db_seconds": 0.0}
+        token = _update.set(stats)
+        try:
+            return await handler(event, data)
+        finally:
+            _update.reset(token)
+            update_queries.observe(stats["queries"], stats["handler"])
+            update_db_seconds.observe(stats["db_seconds"], stats["handler"])
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware (message / callback_query): latency and errors of the matched handler"""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        stats = _update.get()
+        if stats is not None:
+            stats["handler"] = name
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - t0, name)
+
+# --- SQLAlchemy ------------------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_t0", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_t0"].pop()
+    db_queries.inc()
+    db_query_duration.observe(elapsed)
+    stats = _update.get()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["db_seconds"] += elapsed
+
+def instrument_sqlalchemy():
+    """Time every query of every engine (the write-behind flush engine included)"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+# --- setup -----------------------------------------------------------------------
+
+def _register_gauges():
+    from app.middlewares import user_cache
+    from app.outbound import send_queue
+    from app.state import state_store
+    from app.timers import rest_timers
+    from app.writebehind import write_behind
+
+    registry.register(Gauge("bot_rest_timers_active", "Running rest timers", lambda: len(rest_timers)))
+    registry.register(Gauge("bot_users_awaiting_set", "Users expected to send a set", state_store.count_awaiting))
+    registry.register(Gauge("bot_outbound_queue_depth", "Outbound Telegram calls waiting in the send queue",
+                            lambda: send_queue.stats()["queue_depth"], label="priority"))
+    registry.register(Gauge("bot_outbound_total", "Outbound Telegram calls by outcome",
+                            lambda: dict(send_queue.counters), label="outcome", kind="counter"))
+    registry.register(Gauge("bot_write_behind_pending_rows", "Logged sets waiting for the next group commit",
+                            lambda: write_behind.pending))
+    registry.register(Gauge("bot_user_cache_lookups_total", "User identity-cache lookups by outcome",
+                            lambda: dict(user_cache.stats), label="outcome", kind="counter"))
+
+def setup_metrics(dp: Dispatcher):
+    """Register the middlewares, the SQLAlchemy hooks and the gauges"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    instrument_sqlalchemy()
+    _register_gauges()
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> web.AppRunner:
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=await registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"📈 Metriche su http://{host}:{port}/metrics")
+    return runner
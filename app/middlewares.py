@@ -0,0 +1,127 @@
+"""Dispatcher middleware: one database session per update, with the user row preloaded.
+
+`DbSessionMiddleware` (inner, su `message` e `callback_query`) apre una sola
+`AsyncSession` per update e la passa all'handler come `db`; se l'handler ha anche il
+parametro `user`, l'utente viene caricato una volta sola e creato se manca con un
+unico `INSERT ... ON CONFLICT DO UPDATE ... RETURNING`. Gli handler che non chiedono
+né `db` né `user` non aprono nessuna sessione. Anche lo stato della sessione (app/state.py)
+passa da questa sessione: nessun update ne apre una seconda.
+
+Handler con il flag `awaiting_set` (`capture_set`, che riceve ogni messaggio non
+gestito prima): l'utente viene caricato insieme al suo stato con un solo SELECT e
+solo se sta registrando una serie, altrimenti l'handler viene saltato (`SkipHandler`)
+senza upsert né scritture.
+
+Cache d'identità (USER_CACHE_TTL secondi, default 30; 0 = disattivata): ricorda solo
+che l'utente esiste già con quello username, non la riga. Entro il TTL l'utente viene
+letto con un semplice SELECT invece dell'upsert (niente scrittura né commit per ogni
+update); il cursore dell'allenamento arriva quindi sempre dal database, anche se un
+altro worker l'ha appena cambiato. Se lo username è cambiato o la riga non c'è più
+si torna all'upsert.
+
+Write-behind: prima di caricare l'utente vengono scritte le sue serie in attesa
+(`flush_user`), tranne che per gli handler con il flag `pending_sets`
+(`capture_set`), a cui si applica invece il cursore in attesa (`overlay`).
+"""
+import os
+import time
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.dispatcher.flags import get_flag
+from app.db import dialect_insert, get_async_db
+from app.models import User
+from app.state import state_store
+from app.utils.lru import LRUCache
+from app.writebehind import write_behind
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+
+class UserCache:
+    """Short-TTL identity cache: telegram id -> username of a user row known to exist"""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, maxsize: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self._entries = LRUCache(maxsize)   # id -> (scadenza, username)
+        self.stats = {"hit": 0, "miss": 0}
+
+    def get(self, user_id: int) -> str | None:
+        """Username stored with the user's row, None if unknown or expired"""
+        if self.ttl <= 0:
+            return None
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.stats["miss"] += 1
+            return None
+        self.stats["hit"] += 1
+        return entry[1]
+
+    def put(self, user_id: int, username: str):
+        if self.ttl > 0:
+            self._entries.set(user_id, (time.monotonic() + self.ttl, username))
+
+    def clear(self):
+        self._entries.clear()
+
+user_cache = UserCache()
+
+async def _upsert_user(db, tg_user) -> User:
+    stmt = dialect_insert(User).values(id=tg_user.id, username=tg_user.username or "")
+    stmt = stmt.on_conflict_do_update(index_elements=[User.id], set_={"username": stmt.excluded.username})
+    user = await db.scalar(stmt.returning(User), execution_options={"populate_existing": True})
+    # Commit subito: la transazione non resta aperta (né la connessione occupata) durante l'handler
+    await db.commit()
+    return user
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Inner middleware (message / callback_query): injects `db` and `user` into the handler"""
+
+    def __init__(self, cache: UserCache = user_cache):
+        self.cache = cache
+
+    async def __call__(self, handler, event, data):
+        params = data["handler"].params
+        if "db" not in params and "user" not in params:
+            return await handler(event, data)
+
+        tg_user = data.get("event_from_user")
+        awaiting = get_flag(data, "awaiting_set", default=False)
+        if awaiting and tg_user is None:
+            raise SkipHandler()
+        async with get_async_db() as db:
+            data["db"] = db
+            data["user"] = None
+            if "user" not in params or tg_user is None:
+                return await handler(event, data)
+
+            pending = get_flag(data, "pending_sets", default=False)
+            if not pending:
+                await write_behind.flush_user(tg_user.id)
+            if awaiting:
+                # Stato letto insieme all'utente; chi non sta registrando una serie non viene caricato
+                user = await state_store.awaiting_user(db, tg_user.id)
+                if user is None:
+                    raise SkipHandler()
+            else:
+                user = await self._load_user(db, tg_user)
+            if pending:
+                write_behind.overlay(user)
+            data["user"] = user
+            return await handler(event, data)
+
+    async def _load_user(self, db, tg_user) -> User:
+        username = tg_user.username or ""
+        if self.cache.get(tg_user.id) == username:
+            # Già registrato: basta leggere la riga (cursore compreso), senza scritture
+            user = await db.get(User, tg_user.id)
+            if user is not None:
+                return user
+        user = await _upsert_user(db, tg_user)
+        self.cache.put(user.id, username)
+        return user
+
+def setup_db_session(dp: Dispatcher):
+    """Register DbSessionMiddleware on the message and callback_query observers"""
+    middleware = DbSessionMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, Boolean, String, Text, Date, DateTime, ForeignKey, Numeric, Index, false
 from sqlalchemy.orm import relationship
 from app.db import Base
 
@@ -7,35 +7,142 @@ class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, autoincrement=False)  # telegram id
     username = Column(String)
-    training_plan = Column(Text)  # JSON
     current_day = Column(String, nullable=True)
     exercise_idx = Column(Integer, default=0)
     set_idx = Column(Integer, default=0)
     last_updated = Column(DateTime, default=datetime.utcnow)
+    active_plan_id = Column(Integer, ForeignKey("training_plans.id", use_alter=True, name="fk_users_active_plan_id"),
+                            nullable=True, index=True)  # scheda attiva (None: nessuna scheda)
 
     logs = relationship("WorkoutLog", back_populates="user", cascade="all, delete-orphan")
-    training_plans = relationship("TrainingPlan", back_populates="user", cascade="all, delete-orphan")
+    training_plans = relationship("TrainingPlan", back_populates="user", cascade="all, delete-orphan",
+                                  foreign_keys="TrainingPlan.user_id")
 
 class WorkoutLog(Base):
     __tablename__ = "workout_logs"
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
+    plan_id = Column(Integer, ForeignKey("training_plans.id", name="fk_workout_logs_plan_id"), nullable=True)
     day = Column(String)
     exercise = Column(String)
     set_number = Column(Integer)
-    weight = Column(String)
+    weight = Column(String)  # testo inserito dall'utente, usato per la visualizzazione
+    weight_kg = Column(Numeric(7, 2, asdecimal=False))  # valore numerico per le aggregazioni SQL
     reps = Column(Integer)
     ts = Column(DateTime, default=datetime.utcnow)
+    # chiave naturale di ogni serie, registrata dal bot o importata (app/utils/sets.py:import_key);
+    # NULL solo per le serie del bot salvate dopo una collisione (app/writebehind.py:insert_sets)
+    import_key = Column(String, nullable=True)
 
     user = relationship("User", back_populates="logs")
 
+    __table_args__ = (
+        # recap per esercizio (_prompt_next_set) e lookup dell'ultima serie (back:set)
+        Index("ix_workout_logs_user_exercise_ts", "user_id", "exercise", "ts"),
+        Index("ix_workout_logs_user_day_exercise_ts", "user_id", "day", "exercise", "ts"),
+        # progressi della scheda selezionata
+        Index("ix_workout_logs_user_plan_ts", "user_id", "plan_id", "ts"),
+        # reimport dello stesso storico: ON CONFLICT DO NOTHING; le serie del bot non vengono mai scartate
+        # (insert_sets le risalva con import_key NULL, che l'indice non confronta)
+        Index("ux_workout_logs_user_import_key", "user_id", "import_key", unique=True),
+    )
+
+class WorkoutLogArchive(Base):
+    """Raw sets moved out of workout_logs by the compaction job (see app/compaction.py)"""
+    __tablename__ = "workout_log_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)  # stesso id del log originale
+    ts = Column(DateTime, primary_key=True)  # nella chiave: su Postgres la tabella è partizionata per mese
+    user_id = Column(Integer, nullable=False)
+    plan_id = Column(Integer, nullable=True)
+    day = Column(String)
+    exercise = Column(String)
+    set_number = Column(Integer)
+    weight = Column(String)
+    weight_kg = Column(Numeric(7, 2, asdecimal=False))
+    reps = Column(Integer)
+    import_key = Column(String, nullable=True)
+
+    __table_args__ = (
+        # ricostruzione dei recap
+        Index("ix_workout_log_archive_user_exercise_ts", "user_id", "exercise", "ts"),
+        Index("ix_workout_log_archive_user_import_key", "user_id", "import_key"),
+        {"postgresql_partition_by": "RANGE (ts)"},
+    )
+
+class WorkoutRollup(Base):
+    """Per-session, per-exercise summary of compacted sets, read by the progress pages"""
+    __tablename__ = "workout_rollups"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    plan_id = Column(Integer, ForeignKey("training_plans.id", name="fk_workout_rollups_plan_id"), nullable=True)
+    day = Column(String)
+    exercise = Column(String)
+    session = Column(Date, nullable=False)
+    first_ts = Column(DateTime, nullable=False)  # ts e id della prima serie: chiave di paginazione
+    first_log_id = Column(Integer, nullable=False)
+    sets = Column(Integer, nullable=False)
+    volume = Column(Numeric(12, 2, asdecimal=False))  # kg × reps
+    weight = Column(String)  # top set (peso più alto, poi più reps)
+    weight_kg = Column(Numeric(7, 2, asdecimal=False))
+    reps = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_workout_rollups_user_plan_ts", "user_id", "plan_id", "first_ts"),
+    )
+
 class TrainingPlan(Base):
     __tablename__ = "training_plans"
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     plan_name = Column(String, nullable=False)
-    plan_data = Column(Text)  # JSON
+    content_hash = Column(String, nullable=False)  # -> plan_days.plan_hash (vedi app/plans.py)
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Integer, default=1)  # 1 = active, 0 = inactive
 
-    user = relationship("User", back_populates="training_plans")
+    user = relationship("User", back_populates="training_plans", foreign_keys=[user_id])
+
+    __table_args__ = (
+        # reimport della stessa scheda: si riusa il piano esistente
+        Index("ix_training_plans_user_content", "user_id", "content_hash"),
+    )
+
+class PlanDay(Base):
+    """One day of a plan's content, shared by every TrainingPlan with the same `plan_hash`"""
+    __tablename__ = "plan_days"
+    plan_hash = Column(String, primary_key=True)
+    position = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String, nullable=False)
+    day_hash = Column(String, nullable=False)  # -> plan_exercises.day_hash
+
+class PlanExercise(Base):
+    """One exercise of a day, shared by every day with the same `day_hash`"""
+    __tablename__ = "plan_exercises"
+    day_hash = Column(String, primary_key=True)
+    position = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String, nullable=False)
+    sets = Column(Integer, nullable=False)
+    reps = Column(String, nullable=False)
+    rest = Column(String, nullable=False)
+
+class ExerciseRecap(Base):
+    __tablename__ = "exercise_recaps"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True, autoincrement=False)
+    exercise = Column(String, primary_key=True)
+    sessions = Column(Text, nullable=False, default="[]")  # JSON, vedi app/recaps.py
+
+class RestTimer(Base):
+    __tablename__ = "rest_timers"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True, autoincrement=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(Integer, nullable=False)
+    exercise = Column(String, nullable=False)
+    rest_label = Column(String, nullable=False)
+    deadline = Column(DateTime, nullable=False)  # UTC
+
+class SessionState(Base):
+    __tablename__ = "session_state"
+    user_id = Column(Integer, primary_key=True, autoincrement=False)  # telegram id
+    awaiting_set = Column(Boolean, nullable=False, default=False)
+    # dopo /import_history il prossimo file inviato è uno storico, non una scheda
+    awaiting_history = Column(Boolean, nullable=False, default=False, server_default=false())
+    updated_at = Column(DateTime, default=datetime.utcnow)
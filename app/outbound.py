@@ -0,0 +1,274 @@
+"""Outbound send queue for Telegram API calls.
+
+Tutte le chiamate del bot che hanno un `chat_id` (answer, edit_text, documenti...)
+passano da `SendQueue`, registrata come request middleware sulla sessione del bot:
+
+- token bucket globale e per chat, per restare sotto i limiti di Telegram;
+- classi di priorità: i messaggi degli handler (prompt, conferme) partono prima dei
+  refresh dei timer, che sotto carico vengono fusi (stesso messaggio) o scartati;
+  solo le chiamate LOW, il cui risultato viene ignorato, possono essere fuse o
+  scartate, e in quel caso restituiscono `None` invece del `Message`;
+- gestione automatica di `retry_after` (429): la chat viene messa in pausa e la
+  richiesta rimessa in coda;
+- `stats()` espone profondità delle code e contatori per il monitoraggio.
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))     # messaggi/s su tutto il bot
+CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))          # messaggi/s per chat (a regime)
+CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "5"))        # raffica concessa per chat
+MAX_IN_FLIGHT = int(os.getenv("OUTBOUND_MAX_IN_FLIGHT", "32"))   # richieste HTTP contemporanee
+LOW_QUEUE_LIMIT = int(os.getenv("OUTBOUND_LOW_QUEUE_LIMIT", "1000"))
+MAX_RETRIES = 3
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("outbound_priority", default=(HIGH, None))
+
+@contextmanager
+def send_priority(priority: int, merge_key=None):
+    """Send the API calls made inside the block with `priority`.
+
+    LOW calls are fire-and-forget: they may be dropped, or superseded while still queued
+    by a later call with the same `merge_key` (e.g. edits of the same message), and
+    then return None without being sent. HIGH and NORMAL calls are always sent.
+    """
+    token = _priority.set((priority, merge_key))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if available now)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    @property
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+class _Job:
+    __slots__ = ("priority", "chat_id", "method", "make_request", "bot", "future", "merge_key", "retries", "cancelled")
+
+    def __init__(self, priority, chat_id, method, make_request, bot, merge_key):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.method = method
+        self.make_request = make_request
+        self.bot = bot
+        self.future = asyncio.get_running_loop().create_future()
+        self.merge_key = merge_key
+        self.retries = 0
+        self.cancelled = False
+
+class SendQueue(BaseRequestMiddleware):
+    SCAN_LIMIT = 256  # job esaminati per coda alla ricerca di una chat non limitata
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 max_in_flight=MAX_IN_FLIGHT, low_queue_limit=LOW_QUEUE_LIMIT):
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.low_queue_limit = low_queue_limit
+        self._chats: dict[int, TokenBucket] = {}
+        self._queues = {HIGH: deque(), NORMAL: deque(), LOW: deque()}
+        self._merge: dict = {}
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._sending: set[asyncio.Task] = set()
+        self.counters = {"sent": 0, "failed": 0, "dropped": 0, "merged": 0, "retry_after": 0}
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # answerCallbackQuery, getFile, ...: non soggetti ai limiti per chat
+            return await make_request(bot, method)
+        priority, merge_key = _priority.get()
+        job = _Job(priority, chat_id, method, make_request, bot, merge_key)
+        self._enqueue(job)
+        return await job.future
+
+    def stats(self) -> dict:
+        depth = {PRIORITY_NAMES[p]: sum(1 for j in q if not j.cancelled) for p, q in self._queues.items()}
+        return {"queue_depth": depth, "pending": sum(depth.values()), "chats": len(self._chats), **self.counters}
+
+    # --- internals -----------------------------------------------------------
+
+    def _enqueue(self, job: _Job):
+        if job.merge_key is not None:
+            previous = self._merge.pop(job.merge_key, None)
+            if previous is not None and not previous.future.done():
+                # La modifica più recente sostituisce il refresh ancora in coda
+                self._discard(previous)
+                self.counters["merged"] += 1
+            if job.priority == LOW:
+                self._merge[job.merge_key] = job  # solo le chiamate LOW possono essere sostituite
+
+        queue = self._queues[job.priority]
+        queue.append(job)
+        if job.priority == LOW and len(queue) > self.low_queue_limit:
+            dropped = queue.popleft()
+            if not dropped.cancelled:
+                self._discard(dropped)
+                self.counters["dropped"] += 1
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def _discard(self, job: _Job):
+        """Resolve a LOW job with None without sending it"""
+        job.cancelled = True
+        if self._merge.get(job.merge_key) is job:
+            del self._merge[job.merge_key]
+        if not job.future.done():
+            job.future.set_result(None)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _pick(self, now: float):
+        """Highest-priority job whose chat can send now, or the time to wait for one"""
+        wait = None
+        for priority in (HIGH, NORMAL, LOW):
+            queue = self._queues[priority]
+            while queue and queue[0].cancelled:
+                queue.popleft()
+            blocked = set()
+            for i, job in enumerate(itertools.islice(queue, self.SCAN_LIMIT)):
+                if job.cancelled or job.chat_id in blocked:
+                    continue
+                delay = self._chat_bucket(job.chat_id).wait_time(now)
+                if delay == 0:
+                    del queue[i]
+                    return job, 0.0
+                blocked.add(job.chat_id)  # mantiene l'ordine FIFO all'interno della chat
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            job, wait = self._pick(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                self._enqueue_back(job)
+                await asyncio.sleep(global_wait)
+                continue
+
+            self.global_bucket.take(now)
+            self._chat_bucket(job.chat_id).take(now)
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(job))
+            self._sending.add(task)  # riferimento forte finché l'invio non è concluso
+            task.add_done_callback(self._sending.discard)
+
+    def _enqueue_back(self, job: _Job):
+        self._queues[job.priority].appendleft(job)
+
+    async def _send(self, job: _Job):
+        try:
+            if job.cancelled:
+                return
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            self.counters["retry_after"] += 1
+            self._chat_bucket(job.chat_id).blocked_until = time.monotonic() + e.retry_after
+            if job.retries < MAX_RETRIES and job.priority != LOW:
+                job.retries += 1
+                self._enqueue_back(job)
+                self._wakeup.set()
+            elif job.priority == LOW:
+                # Un refresh del timer in ritardo non serve più: lo si scarta
+                self.counters["dropped"] += 1
+                self._discard(job)
+            else:
+                self.counters["failed"] += 1
+                self._fail(job, e)
+        except Exception as e:
+            self.counters["failed"] += 1
+            self._fail(job, e)
+        else:
+            self.counters["sent"] += 1
+            if self._merge.get(job.merge_key) is job:
+                del self._merge[job.merge_key]
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _fail(self, job: _Job, error: Exception):
+        if self._merge.get(job.merge_key) is job:
+            del self._merge[job.merge_key]
+        if not job.future.done():
+            job.future.set_exception(error)
+
+class PooledAiohttpSession(AiohttpSession):
+    """AiohttpSession with a tuned, keep-alive connection pool towards the Bot API.
+
+    aiogram (pinned in requirements.txt) has no public option for the connector: the
+    arguments go in `_connector_init`, checked first so a release that drops it falls
+    back to the default pool instead of breaking the bot.
+    """
+
+    def __init__(self, limit: int = MAX_IN_FLIGHT, keepalive_timeout: float = 60, **kwargs):
+        super().__init__(**kwargs)
+        connector_init = getattr(self, "_connector_init", None)
+        if not isinstance(connector_init, dict):
+            print("PooledAiohttpSession: AiohttpSession._connector_init not found, default connection pool")
+            return
+        connector_init.update(
+            limit=limit,
+            limit_per_host=limit,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+
+send_queue = SendQueue()
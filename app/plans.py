@@ -0,0 +1,121 @@
+"""Normalized, content-addressed storage of the training plans.
+
+Il contenuto di una scheda non è più un blob JSON (prima duplicato in
+`TrainingPlan.plan_data` e `User.training_plan`) ma sta in due tabelle condivise:
+- `plan_exercises`: gli esercizi di un giorno, per `day_hash` (hash degli esercizi) e posizione;
+- `plan_days`: i giorni di una scheda (nome e `day_hash`), per `plan_hash` (hash dei giorni) e posizione.
+
+`TrainingPlan.content_hash` punta al contenuto e `User.active_plan_id` alla scheda
+attiva. Schede identiche (lo stesso file reimportato, lo stesso template usato da più
+utenti) condividono le stesse righe; reimportando una scheda con un solo giorno
+cambiato si scrivono solo gli esercizi di quel giorno. Il contenuto non viene mai
+modificato, quindi la scheda compilata resta in cache per id del piano.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+from sqlalchemy import select
+from app.db import dialect_insert
+from app.models import PlanDay, PlanExercise, TrainingPlan
+from app.utils.compiled_plan import CompiledPlan, compile_plan
+from app.utils.lru import LRUCache
+
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "1024"))
+
+def _digest(value) -> str:
+    data = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+def _exercise_values(ex: dict) -> list:
+    return [str(ex["name"]), int(ex["sets"]), str(ex["reps"]), str(ex["rest"])]
+
+def day_hash(exercises: list) -> str:
+    return _digest([_exercise_values(ex) for ex in exercises])
+
+def plan_hashes(plan: dict) -> tuple[str, list[tuple[str, str]]]:
+    """(plan hash, [(day name, day hash), ...] in plan order)"""
+    days = [(name, day_hash(exercises)) for name, exercises in plan.items()]
+    return _digest(days), days
+
+async def store_plan(db, user_id: int, plan_name: str, plan: dict) -> TrainingPlan:
+    """TrainingPlan for `plan`, writing only the content rows not already stored.
+
+    Se l'utente ha già una scheda con lo stesso nome e lo stesso contenuto viene
+    riusata (e riattivata) invece di crearne un'altra. Non fa commit.
+    """
+    content_hash, days = plan_hashes(plan)
+    existing = (await db.execute(
+        select(TrainingPlan).where(
+            TrainingPlan.user_id == user_id,
+            TrainingPlan.content_hash == content_hash,
+            TrainingPlan.plan_name == plan_name,
+        ).order_by(TrainingPlan.id.desc()).limit(1)
+    )).scalars().first()
+    if existing:
+        existing.is_active = 1
+        return existing
+
+    # Giorni (e scheda) già presenti, condivisi con altre schede o altri utenti
+    stored = set((await db.execute(
+        select(PlanExercise.day_hash).where(PlanExercise.day_hash.in_({h for _, h in days}), PlanExercise.position == 0)
+        .union(select(PlanDay.plan_hash).where(PlanDay.plan_hash == content_hash, PlanDay.position == 0))
+    )).scalars())
+
+    if content_hash not in stored:
+        exercise_rows, written = [], set()
+        for (_, h), exercises in zip(days, plan.values()):
+            if h in stored or h in written:
+                continue
+            written.add(h)
+            exercise_rows.extend(
+                dict(day_hash=h, position=i, name=name, sets=sets, reps=reps, rest=rest)
+                for i, (name, sets, reps, rest) in enumerate(map(_exercise_values, exercises))
+            )
+        # ON CONFLICT DO NOTHING: un import concorrente può aver scritto le stesse righe
+        if exercise_rows:
+            await db.execute(dialect_insert(PlanExercise).on_conflict_do_nothing(), exercise_rows)
+        if days:
+            await db.execute(dialect_insert(PlanDay).on_conflict_do_nothing(), [
+                dict(plan_hash=content_hash, position=i, name=name, day_hash=h) for i, (name, h) in enumerate(days)
+            ])
+
+    training_plan = TrainingPlan(user_id=user_id, plan_name=plan_name, content_hash=content_hash,
+                                 created_at=datetime.now(), is_active=1)
+    db.add(training_plan)
+    await db.flush()
+    return training_plan
+
+async def load_plan(db, plan_id: int) -> dict:
+    """Plan dict ({day: [{name, sets, reps, rest}, ...]}) of a TrainingPlan, one query"""
+    rows = await db.execute(
+        select(PlanDay.name.label("day"), PlanExercise.name, PlanExercise.sets, PlanExercise.reps, PlanExercise.rest)
+        .select_from(TrainingPlan)
+        .join(PlanDay, PlanDay.plan_hash == TrainingPlan.content_hash)
+        .join(PlanExercise, PlanExercise.day_hash == PlanDay.day_hash)
+        .where(TrainingPlan.id == plan_id)
+        .order_by(PlanDay.position, PlanExercise.position)
+    )
+    plan: dict[str, list] = {}
+    for row in rows:
+        plan.setdefault(row.day, []).append({"name": row.name, "sets": row.sets, "reps": row.reps, "rest": row.rest})
+    return plan
+
+# plan id -> CompiledPlan; il contenuto di un TrainingPlan non cambia mai
+_plan_cache = LRUCache(PLAN_CACHE_SIZE)
+
+async def get_compiled_plan(db, plan_id: int | None) -> CompiledPlan | None:
+    """Compiled plan of a TrainingPlan (None without a plan), loaded only on a cache miss"""
+    if not plan_id:
+        return None
+    compiled = _plan_cache.get(plan_id)
+    if compiled is None:
+        compiled = compile_plan(await load_plan(db, plan_id))
+        _plan_cache.set(plan_id, compiled)
+    return compiled
+
+def store_compiled_plan(plan_id: int, plan: dict) -> CompiledPlan:
+    """Prime the cache once a newly stored plan has been committed"""
+    compiled = compile_plan(plan)
+    _plan_cache.set(plan_id, compiled)
+    return compiled
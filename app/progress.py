@@ -0,0 +1,135 @@
+from datetime import datetime, time, timedelta
+from typing import NamedTuple
+from sqlalchemy import Date, Integer, func, literal, select, tuple_, union_all
+from app.models import WorkoutLog, WorkoutRollup
+
+PAGE_SETS = 60  # righe lette per pagina (la pagina si estende fino a includere giorni interi)
+_EPOCH = datetime(1970, 1, 1)
+
+def progress_history(user_id: int, plan_id: int | None):
+    """The user's sets for one plan: hot logs plus the rollups of compacted sessions.
+
+    Un rollup (app/compaction.py) vale come una riga con `sets` serie, il suo volume e
+    il suo top set; `ts` / `id` sono quelli della prima serie della sessione.
+    """
+    hot = select(
+        WorkoutLog.ts, WorkoutLog.id, WorkoutLog.day, WorkoutLog.exercise,
+        WorkoutLog.weight, WorkoutLog.weight_kg, WorkoutLog.reps,
+        literal(1, Integer).label("sets"), (WorkoutLog.weight_kg * WorkoutLog.reps).label("volume"),
+    ).where(WorkoutLog.user_id == user_id, WorkoutLog.plan_id == plan_id)
+    rolled = select(
+        WorkoutRollup.first_ts, WorkoutRollup.first_log_id, WorkoutRollup.day, WorkoutRollup.exercise,
+        WorkoutRollup.weight, WorkoutRollup.weight_kg, WorkoutRollup.reps,
+        WorkoutRollup.sets, WorkoutRollup.volume,
+    ).where(WorkoutRollup.user_id == user_id, WorkoutRollup.plan_id == plan_id)
+    return union_all(hot, rolled).subquery("history")
+
+async def _fetch_sessions(db, history, *filters) -> list:
+    session = func.date(history.c.ts, type_=Date)
+    partition = (history.c.day, history.c.exercise, session)
+    ranked = (
+        select(
+            history.c.day,
+            history.c.exercise,
+            session.label("session"),
+            func.sum(history.c.sets).over(partition_by=partition).label("sets"),
+            func.sum(history.c.volume).over(partition_by=partition).label("volume"),
+            history.c.weight,
+            history.c.reps,
+            func.row_number().over(
+                partition_by=partition,
+                order_by=(history.c.weight_kg.desc().nulls_last(), history.c.reps.desc(), history.c.id),
+            ).label("rn"),
+        )
+        .where(*filters)
+        .subquery()
+    )
+    result = await db.execute(
+        select(ranked.c.day, ranked.c.exercise, ranked.c.session, ranked.c.sets,
+               ranked.c.volume, ranked.c.weight, ranked.c.reps)
+        .where(ranked.c.rn == 1)
+        .order_by(ranked.c.session)
+    )
+    return result.all()
+
+async def fetch_progress(db, user_id: int, plan_id: int | None) -> list:
+    """Per-session summary of the user's sets for one plan, computed in SQL.
+
+    One row per (day, exercise, session date) with `sets`, `volume` (kg × reps) and
+    the best set (`weight`, `reps`: heaviest weight, then most reps), in date order.
+    Compacted sessions come from their rollups, with the same values.
+    """
+    return await _fetch_sessions(db, progress_history(user_id, plan_id))
+
+class ProgressPage(NamedTuple):
+    rows: list
+    older: tuple | None   # cursore (ts, id) per la pagina precedente nel tempo
+    newer: tuple | None   # cursore (ts, id) per la pagina successiva
+
+def encode_cursor(cursor: tuple) -> str:
+    ts, log_id = cursor
+    return f"{(ts - _EPOCH) // timedelta(microseconds=1)}:{log_id}"
+
+def decode_cursor(value: str) -> tuple:
+    micros, log_id = value.split(":")
+    return _EPOCH + timedelta(microseconds=int(micros)), int(log_id)
+
+def _day_start(ts: datetime) -> datetime:
+    return datetime.combine(ts.date(), time.min)
+
+async def _edge(db, history, filters, order, limit: int):
+    """`ts` of the limit-th row in `order`, None if there are fewer rows"""
+    return (await db.execute(
+        select(history.c.ts).where(*filters).order_by(*order).offset(limit - 1).limit(1)
+    )).scalar()
+
+async def _first_key(db, history, filters, order):
+    row = (await db.execute(select(history.c.ts, history.c.id).where(*filters).order_by(*order).limit(1))).first()
+    return tuple(row) if row else None
+
+async def fetch_progress_page(db, user_id: int, plan_id: int | None, before: tuple | None = None,
+                              after: tuple | None = None, limit: int = PAGE_SETS) -> ProgressPage:
+    """One page of `fetch_progress`, with keyset pagination over (ts, id).
+
+    Without cursors the page holds the most recent `limit` rows (sets, or rollups of
+    compacted sessions); `before` / `after` move to older / newer ones. A page always
+    covers whole days, so a session is never split across two pages.
+    """
+    history = progress_history(user_id, plan_id)
+    ts = history.c.ts
+    key = tuple_(ts, history.c.id)
+    desc = (ts.desc(), history.c.id.desc())
+    asc = (ts, history.c.id)
+
+    if after is None:
+        filters = (key < tuple_(*before),) if before else ()
+        edge = await _edge(db, history, filters, desc, limit)
+        if edge is not None:
+            filters += (ts >= _day_start(edge),)
+    else:
+        filters = (key > tuple_(*after),)
+        edge = await _edge(db, history, filters, asc, limit)
+        if edge is not None:
+            filters += (ts < _day_start(edge) + timedelta(days=1),)
+
+    first = await _first_key(db, history, filters, asc)
+    if first is None:
+        return ProgressPage([], None, None)
+    last = await _first_key(db, history, filters, desc)
+    older = await _first_key(db, history, (key < tuple_(*first),), desc)
+    newer = await _first_key(db, history, (key > tuple_(*last),), asc)
+    rows = await _fetch_sessions(db, history, *filters)
+    return ProgressPage(rows, first if older else None, last if newer else None)
+
+def group_progress(rows) -> dict:
+    """day -> exercise -> [session rows] (date order preserved)"""
+    grouped: dict[str, dict[str, list]] = {}
+    for row in rows:
+        grouped.setdefault(row.day, {}).setdefault(row.exercise, []).append(row)
+    return grouped
+
+def format_session(row) -> str:
+    line = f"📅 {row.session.strftime('%d/%m')}: {row.sets} serie · top {row.weight}kg × {row.reps}"
+    if row.volume:
+        line += f" · vol {row.volume:g}kg"
+    return line
@@ -0,0 +1,121 @@
+"""Recap of the last sessions per exercise, shown at the first set of each exercise.
+
+`exercise_recaps` keeps, for each (user, exercise), the last RECAP_SESSIONS sessions as
+JSON: `[["2025-01-31", [["50", 10], ["52.5", 8]]], ...]` (most recent session first,
+sets in the order they were logged). `capture_set` appends to it; operations that
+delete logs rebuild the affected rows from `workout_logs` and its archive.
+"""
+import json
+from datetime import datetime
+from sqlalchemy import Date, delete, func, select
+from app.compaction import log_history
+from app.models import ExerciseRecap
+
+RECAP_SESSIONS = 5
+
+async def get_recap(db, user_id: int, exercise: str) -> list:
+    recap = await db.get(ExerciseRecap, (user_id, exercise))
+    if recap is None:
+        # Riga mai costruita (storico precedente alla tabella): la si ricostruisce ora
+        recap = await rebuild_recap(db, user_id, exercise)
+    return json.loads(recap.sessions)
+
+async def add_set(db, user_id: int, exercise: str, ts: datetime, weight: str, reps: int):
+    """Append a newly logged set to the recap (same session if logged on the same date)"""
+    await add_sets(db, user_id, exercise, ts, [(weight, reps)])
+
+async def add_sets(db, user_id: int, exercise: str, ts: datetime, sets: list):
+    """Append sets [(weight, reps), ...] logged together at `ts` (already written to the logs)"""
+    recap = await db.get(ExerciseRecap, (user_id, exercise))
+    if recap is None:
+        # La ricostruzione legge anche i log appena aggiunti alla sessione (autoflush)
+        await rebuild_recap(db, user_id, exercise)
+        return
+    sessions = json.loads(recap.sessions)
+    date_str = ts.date().isoformat()
+    if not sessions or sessions[0][0] != date_str:
+        sessions.insert(0, [date_str, []])
+        del sessions[RECAP_SESSIONS:]
+    sessions[0][1].extend([weight, reps] for weight, reps in sets)
+    recap.sessions = json.dumps(sessions)
+
+async def rebuild_recap(db, user_id: int, exercise: str) -> ExerciseRecap:
+    """Recompute one recap row from the logs (last RECAP_SESSIONS dates only)"""
+    history = log_history(lambda log: (log.user_id == user_id, log.exercise == exercise))
+    session = func.date(history.c.ts, type_=Date)
+    dates = (await db.execute(
+        select(session).distinct().order_by(session.desc()).limit(RECAP_SESSIONS)
+    )).scalars().all()
+
+    sessions = []
+    if dates:
+        since = datetime.combine(dates[-1], datetime.min.time())
+        history = log_history(lambda log: (log.user_id == user_id, log.exercise == exercise, log.ts >= since))
+        logs = (await db.execute(
+            select(history.c.ts, history.c.weight, history.c.reps).order_by(history.c.ts, history.c.id)
+        )).all()
+        by_date: dict[str, list] = {}
+        for log in logs:
+            by_date.setdefault(log.ts.date().isoformat(), []).append([log.weight, log.reps])
+        sessions = [[d, by_date[d]] for d in sorted(by_date, reverse=True)]
+
+    recap = await db.get(ExerciseRecap, (user_id, exercise))
+    if recap is None:
+        recap = ExerciseRecap(user_id=user_id, exercise=exercise)
+        db.add(recap)
+    recap.sessions = json.dumps(sessions)
+    return recap
+
+async def rebuild_recaps(db, user_id: int, exercises):
+    """Recompute several recap rows with two queries (not three per exercise)"""
+    exercises = set(exercises)
+    if not exercises:
+        return
+    history = log_history(lambda log: (log.user_id == user_id, log.exercise.in_(exercises)))
+    session = func.date(history.c.ts, type_=Date)
+    ranked = (
+        select(
+            history.c.exercise, history.c.ts, history.c.id, history.c.weight, history.c.reps,
+            func.dense_rank().over(partition_by=history.c.exercise, order_by=session.desc()).label("rank"),
+        )
+        .subquery()
+    )
+    logs = (await db.execute(
+        select(ranked.c.exercise, ranked.c.ts, ranked.c.weight, ranked.c.reps)
+        .where(ranked.c.rank <= RECAP_SESSIONS)
+        .order_by(ranked.c.exercise, ranked.c.ts, ranked.c.id)
+    )).all()
+    by_exercise: dict[str, dict[str, list]] = {}
+    for log in logs:
+        by_exercise.setdefault(log.exercise, {}).setdefault(log.ts.date().isoformat(), []).append([log.weight, log.reps])
+
+    existing = {r.exercise: r for r in (await db.execute(
+        select(ExerciseRecap).where(ExerciseRecap.user_id == user_id, ExerciseRecap.exercise.in_(exercises))
+    )).scalars()}
+    for exercise in exercises:
+        by_date = by_exercise.get(exercise, {})
+        recap = existing.get(exercise)
+        if recap is None:
+            recap = ExerciseRecap(user_id=user_id, exercise=exercise)
+            db.add(recap)
+        recap.sessions = json.dumps([[d, by_date[d]] for d in sorted(by_date, reverse=True)])
+
+async def delete_recaps(db, user_id: int):
+    await db.execute(delete(ExerciseRecap).where(ExerciseRecap.user_id == user_id))
+
+async def rebuild_all_recaps(db) -> int:
+    """Rebuild every recap from `workout_logs` (and the archive); returns the number of rows written"""
+    history = log_history(lambda log: ())
+    pairs = (await db.execute(select(history.c.user_id, history.c.exercise).distinct())).all()
+    for user_id, exercise in pairs:
+        await rebuild_recap(db, user_id, exercise)
+    return len(pairs)
+
+def format_recap(sessions: list) -> str:
+    if not sessions:
+        return ""
+    recap = "\n\n📈 **Progressi recenti:**\n"
+    for date_str, sets in sessions:
+        day = datetime.strptime(date_str, "%Y-%m-%d").strftime("%d/%m")
+        recap += f"  {day}: " + " ".join(f"{weight}kg × {reps}" for weight, reps in sets) + "\n"
+    return recap
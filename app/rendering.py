@@ -0,0 +1,91 @@
+"""Size-bounded rendering for the long views (plan, progress).
+
+Le viste vengono costruite come lista di blocchi (un giorno, un esercizio...) e
+impaginate con `paginate()`: ogni pagina resta sotto il limite di 4096 caratteri di
+Telegram e un blocco non viene spezzato se non è da solo più lungo di una pagina.
+Le pagine già renderizzate restano in `page_cache` per utente e vengono invalidate
+quando l'utente registra o elimina serie (o cambia scheda).
+"""
+import time
+from aiogram import types
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from app.utils.lru import LRUCache
+
+MAX_MESSAGE_LEN = 4096
+FOOTER_RESERVE = 64          # spazio lasciato per "Pagina x/y" e simili
+PAGE_CACHE_USERS = 1024
+PAGE_CACHE_TTL = 300         # secondi; limita le pagine stantie con più worker
+MAX_PAGES_PER_USER = 32
+
+def _fit(blocks, limit: int):
+    """Yield blocks no longer than `limit`, splitting oversized ones on line boundaries"""
+    for block in blocks:
+        if len(block) <= limit:
+            yield block
+            continue
+        chunk, size = [], 0
+        for line in block.splitlines(keepends=True):
+            if len(line) > limit:
+                line = line[:limit - 2] + "…\n"
+            if size + len(line) > limit and chunk:
+                yield "".join(chunk)
+                chunk, size = [], 0
+            chunk.append(line)
+            size += len(line)
+        if chunk:
+            yield "".join(chunk)
+
+def paginate(header: str, blocks, limit: int = MAX_MESSAGE_LEN - FOOTER_RESERVE) -> list[str]:
+    """Pack `blocks` into pages of at most `limit` characters, each starting with `header`"""
+    budget = limit - len(header)
+    pages, parts, size = [], [], 0
+    for block in _fit(blocks, budget):
+        if size + len(block) > budget and parts:
+            pages.append(header + "".join(parts))
+            parts, size = [], 0
+        parts.append(block)
+        size += len(block)
+    pages.append(header + "".join(parts))
+    return pages
+
+def page_footer(page: int, total: int) -> str:
+    return f"\n<i>Pagina {page + 1}/{total}</i>" if total > 1 else ""
+
+def page_keyboard(prefix: str, page: int, total: int) -> types.InlineKeyboardMarkup | None:
+    """◀️/▶️ buttons with callback data `<prefix>:<page>`"""
+    if total <= 1:
+        return None
+    kb = InlineKeyboardBuilder()
+    if page > 0:
+        kb.button(text="◀️ Precedente", callback_data=f"{prefix}:{page - 1}")
+    if page < total - 1:
+        kb.button(text="Successiva ▶️", callback_data=f"{prefix}:{page + 1}")
+    return kb.as_markup()
+
+class PageCache:
+    """Rendered pages per user: user_id -> {view key: (expires, value)}"""
+
+    def __init__(self, max_users: int = PAGE_CACHE_USERS, ttl: float = PAGE_CACHE_TTL):
+        self.ttl = ttl
+        self._users = LRUCache(max_users)
+
+    def get(self, user_id: int, key):
+        pages = self._users.get(user_id)
+        entry = pages.get(key) if pages else None
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, user_id: int, key, value):
+        pages = self._users.get(user_id)
+        if pages is None:
+            pages = {}
+            self._users.set(user_id, pages)
+        elif len(pages) >= MAX_PAGES_PER_USER:
+            pages.clear()
+        pages[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, user_id: int):
+        self._users.pop(user_id)
+
+page_cache = PageCache()
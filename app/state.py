@@ -0,0 +1,150 @@
+"""Session state that is not part of the workout data: who is expected to send a set
+and the running rest timers.
+
+Backend scelto con STATE_BACKEND:
+- `db` (default): tabelle `session_state` e `rest_timers` nel database dell'app, quindi
+  lo stato sopravvive ai deploy ed è condiviso da più worker sullo stesso Postgres;
+- `memory`: dizionari nel processo (un solo worker, stato perso al riavvio).
+
+I metodi chiamati dagli handler ricevono la sessione dell'update (`db`, vedi
+app/middlewares.py) e non ne aprono un'altra; `count_awaiting` e `load_timers`, che
+girano fuori dagli update, ne aprono una propria.
+"""
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from sqlalchemy import delete, func, select
+from app.db import dialect_insert, get_async_db
+from app.models import RestTimer, SessionState, User
+
+class StateStore(ABC):
+    @abstractmethod
+    async def awaiting_user(self, db, user_id: int) -> User | None:
+        """The user, loaded in `db`, if they are expected to send a set; None otherwise"""
+
+    @abstractmethod
+    async def set_awaiting(self, db, user_id: int, value: bool):
+        ...
+
+    @abstractmethod
+    async def is_awaiting_history(self, db, user_id: int) -> bool:
+        """The user ran /import_history: the next uploaded file is a workout history"""
+
+    @abstractmethod
+    async def set_awaiting_history(self, db, user_id: int, value: bool):
+        ...
+
+    @abstractmethod
+    async def count_awaiting(self) -> int:
+        """Users currently expected to send a set (for metrics)"""
+
+    @abstractmethod
+    async def save_timer(self, db, timer: dict):
+        """Store a running timer: user_id, chat_id, message_id, exercise, rest_label, deadline"""
+
+    @abstractmethod
+    async def delete_timer(self, db, user_id: int, message_id: int | None = None) -> dict | None:
+        """Remove the user's timer (only if it is still `message_id`); returns it if it existed"""
+
+    @abstractmethod
+    async def load_timers(self) -> list[dict]:
+        ...
+
+class MemoryStateStore(StateStore):
+    def __init__(self):
+        self.awaiting: dict[int, bool] = {}
+        self.awaiting_history: dict[int, bool] = {}
+        self.timers: dict[int, dict] = {}
+
+    async def awaiting_user(self, db, user_id: int) -> User | None:
+        if not self.awaiting.get(user_id, False):
+            return None
+        return await db.get(User, user_id)
+
+    async def set_awaiting(self, db, user_id: int, value: bool):
+        self.awaiting[user_id] = value
+
+    async def is_awaiting_history(self, db, user_id: int) -> bool:
+        return self.awaiting_history.get(user_id, False)
+
+    async def set_awaiting_history(self, db, user_id: int, value: bool):
+        self.awaiting_history[user_id] = value
+
+    async def count_awaiting(self) -> int:
+        return sum(self.awaiting.values())
+
+    async def save_timer(self, db, timer: dict):
+        self.timers[timer["user_id"]] = dict(timer)
+
+    async def delete_timer(self, db, user_id: int, message_id: int | None = None) -> dict | None:
+        timer = self.timers.get(user_id)
+        if timer is None or (message_id is not None and timer["message_id"] != message_id):
+            return None
+        return self.timers.pop(user_id)
+
+    async def load_timers(self) -> list[dict]:
+        return list(self.timers.values())
+
+_TIMER_FIELDS = ("user_id", "chat_id", "message_id", "exercise", "rest_label", "deadline")
+
+class DatabaseStateStore(StateStore):
+    # Le scritture fanno commit della sessione dell'update: lo stato è visibile agli
+    # altri worker prima che l'handler risponda all'utente
+
+    async def awaiting_user(self, db, user_id: int) -> User | None:
+        # Un solo SELECT: l'utente e il suo stato insieme
+        return (await db.scalars(
+            select(User).join(SessionState, SessionState.user_id == User.id)
+            .where(User.id == user_id, SessionState.awaiting_set.is_(True))
+        )).first()
+
+    async def _set_flag(self, db, user_id: int, flag: str, value: bool):
+        stmt = dialect_insert(SessionState).values(user_id=user_id, updated_at=datetime.utcnow(), **{flag: value})
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SessionState.user_id],
+            set_={flag: stmt.excluded[flag], "updated_at": stmt.excluded.updated_at},
+        )
+        await db.execute(stmt)
+        await db.commit()
+
+    async def set_awaiting(self, db, user_id: int, value: bool):
+        await self._set_flag(db, user_id, "awaiting_set", value)
+
+    async def is_awaiting_history(self, db, user_id: int) -> bool:
+        state = await db.get(SessionState, user_id)
+        return bool(state and state.awaiting_history)
+
+    async def set_awaiting_history(self, db, user_id: int, value: bool):
+        await self._set_flag(db, user_id, "awaiting_history", value)
+
+    async def count_awaiting(self) -> int:
+        async with get_async_db() as db:
+            return (await db.execute(
+                select(func.count()).select_from(SessionState).where(SessionState.awaiting_set.is_(True))
+            )).scalar()
+
+    async def save_timer(self, db, timer: dict):
+        await db.merge(RestTimer(**timer))
+        await db.commit()
+
+    async def delete_timer(self, db, user_id: int, message_id: int | None = None) -> dict | None:
+        stmt = delete(RestTimer).where(RestTimer.user_id == user_id)
+        if message_id is not None:
+            stmt = stmt.where(RestTimer.message_id == message_id)
+        row = (await db.execute(stmt.returning(*(getattr(RestTimer, f) for f in _TIMER_FIELDS)))).first()
+        await db.commit()
+        return dict(row._mapping) if row else None
+
+    async def load_timers(self) -> list[dict]:
+        async with get_async_db() as db:
+            rows = (await db.execute(select(*(getattr(RestTimer, f) for f in _TIMER_FIELDS)))).all()
+        return [dict(row._mapping) for row in rows]
+
+def create_state_store(backend: str) -> StateStore:
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "db":
+        return DatabaseStateStore()
+    raise RuntimeError(f"STATE_BACKEND non valido: {backend!r} (usa 'db' o 'memory')")
+
+state_store = create_state_store(os.getenv("STATE_BACKEND", "db"))
@@ -0,0 +1,247 @@
+"""Central rest-timer scheduler.
+
+Un solo task possiede tutti i timer di recupero: un heap ordinato per prossimo
+aggiornamento decide quando modificare il messaggio di ciascun utente. La cadenza è
+adattiva (ogni UPDATE_EVERY secondi, poi ogni secondo negli ultimi FINAL_COUNTDOWN),
+così centinaia di utenti a riposo non generano centinaia di `edit_text` al secondo.
+Un errore di rete o di Telegram su un aggiornamento lascia il timer com'è: lo
+riprova il giro successivo (il messaggio di fine fino a FINISH_RETRIES volte). Il
+timer viene scartato solo se il messaggio non si può più modificare (cancellato,
+troppo vecchio, bot bloccato).
+Le scadenze sono salvate nello state store (vedi app/state.py), nella sessione
+dell'update che avvia o annulla il timer, e ripristinate all'avvio con `restore()`.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from app.db import get_async_db
+from app.state import StateStore, state_store
+from app.outbound import LOW, NORMAL, send_priority
+from app.metrics import timer_errors
+
+_EPOCH = datetime(1970, 1, 1)
+
+UPDATE_EVERY = 15
+FINAL_COUNTDOWN = 5
+BATCH_SIZE = 500  # timer processati prima di cedere il controllo all'event loop
+FINISH_RETRIES = 3
+
+def _format_remaining(remaining: int) -> str:
+    if remaining >= 60:
+        return f"{remaining // 60}m {remaining % 60}s"
+    return f"{remaining}s"
+
+def _running_text(exercise: str, rest_label: str, remaining: int) -> str:
+    # Add beep sound indicator for last 3 seconds
+    beep_indicator = "\n🔊 <b>BEEP!</b>" if remaining <= 3 else ""
+    return (
+        f"⏱️ <b>Timer di Recupero</b>\n\n"
+        f"💪 <b>{exercise}</b>\n"
+        f"⏰ <b>Recupero impostato:</b> {rest_label}\n"
+        f"🕒 <b>Tempo rimanente:</b> {_format_remaining(remaining)}{beep_indicator}\n\n"
+        f"💡 <i>Il timer si aggiornerà automaticamente</i>"
+    )
+
+def _completed_text(exercise: str, rest_label: str) -> str:
+    return (
+        f"🔔 <b>Timer di Recupero Completato!</b>\n\n"
+        f"💪 <b>{exercise}</b>\n"
+        f"⏰ <b>Recupero impostato:</b> {rest_label}\n"
+        f"✅ <b>Pronto per la prossima serie!</b>\n\n"
+        f"🔄 Il tempo di recupero è terminato."
+    )
+
+def _interrupted_text(exercise: str, rest_label: str) -> str:
+    return (
+        f"⏹️ <b>Timer di Recupero Interrotto</b>\n\n"
+        f"💪 <b>{exercise}</b>\n"
+        f"⏰ <b>Recupero impostato:</b> {rest_label}\n"
+        f"🔜 <b>Passando alla serie successiva...</b>"
+    )
+
+def next_update_delay(remaining: float) -> float:
+    """Seconds until the next display refresh for a timer with `remaining` seconds left"""
+    if remaining <= FINAL_COUNTDOWN:
+        return min(1.0, remaining)
+    return min(UPDATE_EVERY, remaining - FINAL_COUNTDOWN)
+
+class _Timer:
+    __slots__ = ("user_id", "chat_id", "message_id", "exercise", "rest_label", "deadline", "generation")
+
+    def __init__(self, user_id, chat_id, message_id, exercise, rest_label, deadline, generation):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.exercise = exercise
+        self.rest_label = rest_label
+        self.deadline = deadline  # time.time()
+        self.generation = generation
+
+class RestTimerScheduler:
+    def __init__(self, store: StateStore | None = None):
+        self.store = store or state_store
+        self.bot: Bot | None = None
+        self._timers: dict[int, _Timer] = {}
+        self._heap: list = []  # (due, seq, user_id, generation)
+        self._seq = itertools.count()
+        self._generations = itertools.count(1)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._pending: set[asyncio.Task] = set()
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._timers
+
+    async def start(self, db, message: types.Message, user_id: int, total_seconds: int, exercise: str, rest_label: str):
+        """Send the timer message and start tracking it (replaces the user's previous timer)"""
+        self.bot = message.bot
+        self._drop(user_id)
+        timer_msg = await message.answer(
+            f"⏱️ <b>Timer di Recupero Avviato</b>\n\n"
+            f"💪 <b>{exercise}</b>\n"
+            f"⏰ <b>Recupero impostato:</b> {rest_label}\n"
+            f"🕒 <b>Tempo rimanente:</b> {total_seconds}s\n\n"
+            f"💡 <i>Il timer si aggiornerà automaticamente</i>"
+        )
+        timer = self._add(user_id, timer_msg.chat.id, timer_msg.message_id, exercise, rest_label,
+                          time.time() + total_seconds)
+        await self.store.save_timer(db, {
+            "user_id": user_id,
+            "chat_id": timer.chat_id,
+            "message_id": timer.message_id,
+            "exercise": exercise,
+            "rest_label": rest_label,
+            "deadline": _EPOCH + timedelta(seconds=timer.deadline),
+        })
+
+    async def cancel(self, db, user_id: int, interrupted: bool = False):
+        """Stop the user's timer; with `interrupted` the message is marked as stopped.
+
+        Works for timers started by another worker too: the record comes from the store.
+        """
+        self._drop(user_id)
+        record = await self.store.delete_timer(db, user_id)
+        if record is None:
+            return
+        if interrupted:
+            timer = _Timer(user_id, record["chat_id"], record["message_id"], record["exercise"], record["rest_label"], 0, 0)
+            self._spawn(self._edit(timer, _interrupted_text(timer.exercise, timer.rest_label), NORMAL))
+
+    async def restore(self, bot: Bot):
+        """Reload the persisted timers after a restart"""
+        self.bot = bot
+        records = await self.store.load_timers()
+        for r in records:
+            deadline = (r["deadline"] - _EPOCH).total_seconds()
+            self._add(r["user_id"], r["chat_id"], r["message_id"], r["exercise"], r["rest_label"], deadline)
+        return len(records)
+
+    async def shutdown(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    # --- internals -----------------------------------------------------------
+
+    def _add(self, user_id, chat_id, message_id, exercise, rest_label, deadline) -> _Timer:
+        timer = _Timer(user_id, chat_id, message_id, exercise, rest_label, deadline, next(self._generations))
+        self._timers[user_id] = timer
+        remaining = deadline - time.time()
+        self._push(timer, time.time() + next_update_delay(remaining) if remaining > 0 else time.time())
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return timer
+
+    def _drop(self, user_id: int) -> _Timer | None:
+        # Le voci nell'heap restano: vengono scartate quando la generazione non coincide
+        return self._timers.pop(user_id, None)
+
+    def _push(self, timer: _Timer, due: float):
+        first = not self._heap or due < self._heap[0][0]
+        heapq.heappush(self._heap, (due, next(self._seq), timer.user_id, timer.generation))
+        if first:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.time()
+            processed = 0
+            while self._heap and self._heap[0][0] <= now:
+                processed += 1
+                if processed % BATCH_SIZE == 0:
+                    await asyncio.sleep(0)  # lascia spazio agli altri update tra un blocco e l'altro
+                    if not self._heap or self._heap[0][0] > now:
+                        break
+                _, _, user_id, generation = heapq.heappop(self._heap)
+                timer = self._timers.get(user_id)
+                if timer is None or timer.generation != generation:
+                    continue
+                remaining = round(timer.deadline - now)
+                if remaining <= 0:
+                    self._timers.pop(user_id, None)
+                    self._spawn(self._finish(timer))
+                else:
+                    self._spawn(self._edit(timer, _running_text(timer.exercise, timer.rest_label, remaining)))
+                    self._push(timer, now + next_update_delay(timer.deadline - now))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _edit(self, timer: _Timer, text: str, priority: int = LOW) -> bool:
+        """Edit the timer message; False on a transient error (network, Telegram 5xx), to retry later"""
+        try:
+            # I refresh intermedi possono essere fusi o scartati dalla coda d'invio
+            with send_priority(priority, merge_key=(timer.chat_id, timer.message_id)):
+                await self.bot.edit_message_text(text=text, chat_id=timer.chat_id, message_id=timer.message_id)
+        except (TelegramBadRequest, TelegramForbiddenError) as e:
+            if "message is not modified" in str(e):
+                return True
+            # Message deleted or too old to edit (or bot blocked): stop tracking it
+            print(f"Timer error: {e}")
+            timer_errors.inc()
+            if self._timers.get(timer.user_id) is timer:
+                self._drop(timer.user_id)
+                async with get_async_db() as db:
+                    await self.store.delete_timer(db, timer.user_id, timer.message_id)
+        except Exception as e:
+            # Il timer resta: il prossimo aggiornamento (già in coda nell'heap) riprova
+            print(f"Timer error (retry): {e}")
+            timer_errors.inc()
+            return False
+        return True
+
+    async def _finish(self, timer: _Timer):
+        # Se il record non c'è più il timer è stato annullato (anche da un altro worker)
+        async with get_async_db() as db:
+            record = await self.store.delete_timer(db, timer.user_id, timer.message_id)
+        if record is None:
+            return
+        for attempt in range(FINISH_RETRIES):
+            if attempt:
+                await asyncio.sleep(1)
+            if await self._edit(timer, _completed_text(timer.exercise, timer.rest_label), NORMAL):
+                return
+
+rest_timers = RestTimerScheduler()
@@ -0,0 +1,70 @@
+import re
+
+_MINUTES_RE = re.compile(r"(\d+)\s*m")
+_SECONDS_RE = re.compile(r"(\d+)\s*(?:s|''|\")")
+
+def parse_rest_time(rest_str: str) -> int:
+    """Parse rest time string (e.g., '60s', '1m', '1m 30s', '120''') to total seconds"""
+    if not rest_str:
+        return 60  # Default to 60 seconds
+
+    rest_str = rest_str.lower().strip()
+    total_seconds = 0
+
+    minute_match = _MINUTES_RE.search(rest_str)
+    second_match = _SECONDS_RE.search(rest_str)
+
+    if minute_match:
+        total_seconds += int(minute_match.group(1)) * 60
+
+    if second_match:
+        total_seconds += int(second_match.group(1))
+
+    # If no matches found, try to parse as plain number (assume seconds)
+    plain = rest_str.replace('"', '').replace("'", '')
+    if total_seconds == 0 and plain.isdigit():
+        total_seconds = int(plain)
+
+    return total_seconds if total_seconds > 0 else 60  # Default to 60 seconds if invalid
+
+class CompiledExercise:
+    """One exercise of a plan with the rest time already converted to seconds"""
+    __slots__ = ("name", "sets", "reps", "rest", "rest_seconds")
+
+    def __init__(self, name: str, sets: int, reps: str, rest: str):
+        self.name = name
+        self.sets = int(sets)
+        self.reps = reps
+        self.rest = rest
+        self.rest_seconds = parse_rest_time(rest)
+
+class CompiledPlan:
+    """Read-only view of a training plan: day name -> tuple of CompiledExercise (plan order)"""
+    __slots__ = ("days",)
+
+    def __init__(self, days: dict):
+        self.days = days
+
+    def get(self, day, default=()):
+        return self.days.get(day, default)
+
+    def keys(self):
+        return self.days.keys()
+
+    def items(self):
+        return self.days.items()
+
+    def __getitem__(self, day):
+        return self.days[day]
+
+    def __contains__(self, day):
+        return day in self.days
+
+    def __len__(self):
+        return len(self.days)
+
+def compile_plan(plan: dict) -> CompiledPlan:
+    return CompiledPlan({
+        day: tuple(CompiledExercise(ex["name"], ex["sets"], ex["reps"], ex["rest"]) for ex in exercises)
+        for day, exercises in plan.items()
+    })
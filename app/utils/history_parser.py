@@ -0,0 +1,210 @@
+"""Streaming parser of workout history files (.csv / .xlsx), e.g. the output of /export.
+
+Colonne obbligatorie: Data, Esercizio, Peso, Ripetizioni; facoltative: Allenamento,
+Serie, Scheda. "Data (UTC)" (l'intestazione di /export) vale come Data; le altre
+colonne (es. "Peso (kg)") vengono ignorate. Le righe vengono lette e validate una
+alla volta (openpyxl read_only / csv) e restituite a blocchi; quelle non valide
+vengono contate e le prime MAX_REPORTED_ERRORS descritte col loro numero di riga.
+
+Il file caricato dall'utente viene letto solo nel pool di processi degli import
+(`parse_history_file`, vedi app/imports.py): il worker scrive le righe valide in un
+file temporaneo che il bot rilegge a blocchi con `ParsedHistory`.
+"""
+import csv
+import io
+import pickle
+from datetime import date, datetime, time, timedelta
+from typing import NamedTuple
+from app.utils.plan_parser import MAX_REPORTED_ERRORS, _cell_str
+from app.utils.sets import weight_to_kg
+
+REQUIRED = {"Data", "Esercizio", "Peso", "Ripetizioni"}
+OPTIONAL = {"Allenamento", "Serie", "Scheda"}
+_ALIASES = {"Data (UTC)": "Data"}
+_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S",
+                 "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y")
+_FLOAT_NOISE = timedelta(microseconds=10)
+
+class HistoryRow(NamedTuple):
+    ts: datetime          # al secondo, UTC
+    plan: str             # nome della scheda ("" se assente)
+    day: str              # allenamento ("" se assente)
+    exercise: str
+    set_number: int
+    weight: str           # come lo mostra il bot (virgola decimale normalizzata)
+    weight_kg: object     # Decimal
+    reps: int
+
+def _parse_ts(value) -> datetime | None:
+    if isinstance(value, datetime):
+        # Troncata al secondo come la chiave delle serie del bot; le date di Excel sono
+        # float, e un orario al secondo può tornare come xx.999999
+        return (value + _FLOAT_NOISE).replace(microsecond=0, tzinfo=None)
+    if isinstance(value, date):
+        return datetime.combine(value, time.min)
+    text = _cell_str(value)
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _parse_int(value) -> int | None:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value) if float(value).is_integer() else None
+    text = _cell_str(value)
+    return int(text) if text.isdigit() else None
+
+class HistoryReader:
+    """Validated rows of a history file, in batches; invalid rows are counted in `invalid`"""
+
+    def __init__(self, rows, header, close=None):
+        self._rows = rows
+        self._close = close
+        names = [_ALIASES.get(_cell_str(h), _cell_str(h)) for h in header]
+        self._idx = {name: names.index(name) for name in REQUIRED | OPTIONAL if name in names}
+        self._width = max(self._idx.values()) + 1
+        self._next_set: dict[tuple, int] = {}  # (data, esercizio) -> prossimo numero di serie
+        self.rows = 0
+        self.invalid = 0
+        self.errors: list[str] = []
+
+    def _get(self, row, name):
+        i = self._idx.get(name)
+        return row[i] if i is not None else None
+
+    def _parse(self, row_number: int, row) -> HistoryRow | None:
+        ts = _parse_ts(self._get(row, "Data"))
+        exercise = _cell_str(self._get(row, "Esercizio"))
+        weight = _cell_str(self._get(row, "Peso")).replace(",", ".")
+        weight_kg = weight_to_kg(weight) if weight else None
+        reps = _parse_int(self._get(row, "Ripetizioni"))
+        raw_set = self._get(row, "Serie")
+        set_number = _parse_int(raw_set) if _cell_str(raw_set) else None
+
+        problems = []
+        if ts is None:
+            problems.append(f"data non valida ({_cell_str(self._get(row, 'Data')) or 'vuota'})")
+        if not exercise:
+            problems.append("esercizio mancante")
+        if weight_kg is None:
+            problems.append(f"peso non valido ({weight or 'vuoto'})")
+        if reps is None:
+            problems.append(f"ripetizioni non valide ({_cell_str(self._get(row, 'Ripetizioni')) or 'vuote'})")
+        if _cell_str(raw_set) and not set_number:
+            problems.append(f"serie non valida ({_cell_str(raw_set)})")
+        if problems:
+            self.invalid += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append(f"Riga {row_number}: {', '.join(problems)}")
+            return None
+
+        if set_number is None:
+            # Senza colonna Serie: numerate nell'ordine del file, per data ed esercizio
+            key = (ts.date(), exercise)
+            set_number = self._next_set.get(key, 1)
+        self._next_set[(ts.date(), exercise)] = set_number + 1
+        return HistoryRow(ts, _cell_str(self._get(row, "Scheda")), _cell_str(self._get(row, "Allenamento")),
+                          exercise, set_number, weight, weight_kg, reps)
+
+    def batches(self, size: int):
+        """Yield lists of at most `size` valid HistoryRow, reading the file as it goes"""
+        batch = []
+        for row_number, row in enumerate(self._rows, start=2):
+            if len(row) < self._width:
+                row = tuple(row) + (None,) * (self._width - len(row))
+            if all(v is None or _cell_str(v) == "" for v in row):
+                continue  # righe vuote (spesso in fondo al foglio)
+            self.rows += 1
+            parsed = self._parse(row_number, row)
+            if parsed is None:
+                continue
+            batch.append(parsed)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def close(self):
+        if self._close:
+            self._close()
+
+def _header_names(header) -> set:
+    return {_ALIASES.get(_cell_str(h), _cell_str(h)) for h in header}
+
+def open_history(source, kind: str = "xlsx") -> HistoryReader | None:
+    """HistoryReader over `source` (bytes or path), None if the file is not a history file"""
+    if kind == "csv":
+        if isinstance(source, (bytes, bytearray)):
+            f = io.StringIO(bytes(source).decode("utf-8-sig"))
+        else:
+            f = open(source, newline="", encoding="utf-8-sig")
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        rows = ([v if v != "" else None for v in row] for row in csv.reader(f, dialect))
+        close = f.close
+    else:
+        from openpyxl import load_workbook
+
+        wb = load_workbook(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source,
+                           read_only=True, data_only=True)
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        close = wb.close
+
+    header = next(rows, None)
+    if header is None or not REQUIRED.issubset(_header_names(header)):
+        close()
+        return None
+    return HistoryReader(rows, header, close)
+
+SPOOL_BATCH_ROWS = 5000
+
+def parse_history_file(source, kind: str, out_path: str) -> dict | None:
+    """Validate a history file, writing its valid rows to `out_path` (runs in the import pool).
+
+    Restituisce rows / invalid / errors per `ParsedHistory`, None se il file non ha le
+    colonne di uno storico.
+    """
+    reader = open_history(source, kind)
+    if reader is None:
+        return None
+    try:
+        with open(out_path, "wb") as out:
+            for batch in reader.batches(SPOOL_BATCH_ROWS):
+                pickle.dump(batch, out, protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        reader.close()
+    return {"rows": reader.rows, "invalid": reader.invalid, "errors": reader.errors}
+
+class ParsedHistory:
+    """Rows validated by `parse_history_file`, read back in batches (same interface as HistoryReader)"""
+
+    def __init__(self, path: str, rows: int, invalid: int, errors: list):
+        self._path = path
+        self.rows = rows
+        self.invalid = invalid
+        self.errors = errors
+
+    def batches(self, size: int):
+        batch = []
+        # Il file l'ha scritto il worker del bot, non l'utente: pickle è sicuro
+        with open(self._path, "rb") as f:
+            while True:
+                try:
+                    batch.extend(pickle.load(f))
+                except EOFError:
+                    break
+                while len(batch) >= size:
+                    yield batch[:size]
+                    batch = batch[size:]
+        if batch:
+            yield batch
+
+    def close(self):
+        pass  # il file temporaneo lo rimuove chi l'ha creato (PlanImporter.parse_history)
@@ -0,0 +1,19 @@
+"""Body of the import worker processes (see app/imports.py).
+
+Ogni worker è un processo `spawn` con una sua pipe ed esegue un job alla volta: il
+processo del bot sa sempre quale processo sta leggendo quale file, e in caso di
+timeout termina solo quello. Il modulo resta leggero: è il primo che il worker importa.
+"""
+
+def worker_loop(conn):
+    """Run the `(fn, args)` jobs received on `conn`, answering `(True, result)` or `(False, exception)`"""
+    while True:
+        try:
+            fn, args = conn.recv()
+        except (EOFError, OSError):
+            return  # il bot ha chiuso la pipe
+        try:
+            reply = (True, fn(*args))
+        except Exception as e:
+            reply = (False, e)
+        conn.send(reply)
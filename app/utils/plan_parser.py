@@ -1,7 +1,24 @@
-import pandas as pd
+import csv
+import io
 import re
 
 REQUIRED = {"Allenamento", "Esercizio", "Serie", "Ripetizioni", "Recupero"}
+DAY_COLUMNS = REQUIRED - {"Allenamento"}  # fogli "un giorno per foglio": il giorno è il nome del foglio
+MAX_REPORTED_ERRORS = 10
+
+class PlanParseError(ValueError):
+    """Invalid plan file; `errors` lists the problems, with row numbers"""
+
+    def __init__(self, errors: list[str]):
+        super().__init__(errors)
+        self.errors = errors
+
+    def __str__(self):
+        shown = self.errors[:MAX_REPORTED_ERRORS]
+        extra = len(self.errors) - len(shown)
+        if extra > 0:
+            shown = shown + [f"... e altri {extra} errori"]
+        return "\n".join(shown)
 
 def _to_int_safe(x):
     try:
@@ -10,7 +27,7 @@ def _to_int_safe(x):
         m = re.search(r"\d+", str(x))
         return int(m.group(0)) if m else 1
 
-def parse_plan_from_df(df: pd.DataFrame) -> dict:
+def parse_plan_from_df(df) -> dict:
     cols = set(df.columns.astype(str))
     if not REQUIRED.issubset(cols):
         missing = ", ".join(REQUIRED - cols)
@@ -32,3 +49,125 @@ def parse_plan_from_df(df: pd.DataFrame) -> dict:
             "rest": row["Recupero"],
         })
     return plan
+
+# --- streaming parser (openpyxl read_only / csv, senza pandas) -----------------
+
+def _cell_str(value) -> str:
+    """Cell value as text, the way `astype(str)` renders it for a complete column"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def _parse_sets(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    m = re.search(r"\d+", _cell_str(value))
+    return int(m.group(0)) if m else None
+
+def _error(where: str, text: str) -> str:
+    text = where + text
+    return text[:1].upper() + text[1:]
+
+def _column_index(header, required: set, where: str) -> dict:
+    names = [_cell_str(h) for h in header]
+    missing = required - set(names)
+    if missing:
+        raise PlanParseError([_error(where, f"mancano colonne richieste: {', '.join(sorted(missing))}")])
+    return {name: names.index(name) for name in required}
+
+def _parse_rows(rows, plan: dict, errors: list, day: str | None = None, where: str = ""):
+    """Add the data rows of one table to `plan`.
+
+    `rows` yields tuples, header first. Without `day` the table must have the
+    Allenamento column; otherwise every row belongs to `day`.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise PlanParseError([_error(where, "il file è vuoto")])
+    idx = _column_index(header, DAY_COLUMNS if day else REQUIRED, where)
+    width = max(idx.values()) + 1
+
+    for row_number, row in enumerate(rows, start=2):
+        if len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        if all(v is None or _cell_str(v) == "" for v in row):
+            continue  # righe vuote (spesso in fondo al foglio)
+
+        row_day = day or _cell_str(row[idx["Allenamento"]])
+        name = _cell_str(row[idx["Esercizio"]])
+        sets = _parse_sets(row[idx["Serie"]])
+        problems = []
+        if not row_day:
+            problems.append("allenamento mancante")
+        if not name:
+            problems.append("esercizio mancante")
+        if sets is None:
+            problems.append(f"serie non valide ({_cell_str(row[idx['Serie']]) or 'vuoto'})")
+        if problems:
+            errors.append(_error(where, f"riga {row_number}: {', '.join(problems)}"))
+            continue
+
+        plan.setdefault(row_day, []).append({
+            "name": name,
+            "sets": sets,
+            "reps": _cell_str(row[idx["Ripetizioni"]]),
+            "rest": _cell_str(row[idx["Recupero"]]),
+        })
+
+def parse_plan_xlsx(source) -> dict:
+    """Stream an .xlsx (path or file object) into a plan dict.
+
+    Un foglio con la colonna Allenamento contiene tutta la scheda (come il template);
+    altrimenti ogni foglio è un giorno, col nome del foglio come nome del giorno.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        plan: dict[str, list] = {}
+        errors: list[str] = []
+        sheets = wb.worksheets
+        first = next(sheets[0].iter_rows(max_row=1, values_only=True), ())
+        if len(sheets) == 1 or "Allenamento" in {_cell_str(v) for v in first}:
+            _parse_rows(sheets[0].iter_rows(values_only=True), plan, errors)
+        else:
+            for ws in sheets:
+                _parse_rows(ws.iter_rows(values_only=True), plan, errors,
+                            day=ws.title.strip(), where=f"foglio '{ws.title}', ")
+    finally:
+        wb.close()
+    if errors:
+        raise PlanParseError(errors)
+    return plan
+
+def parse_plan_csv(source) -> dict:
+    """Parse a CSV plan (path, bytes or text stream); `,` and `;` separators are both accepted"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.StringIO(bytes(source).decode("utf-8-sig"))
+    elif isinstance(source, str):
+        source = open(source, newline="", encoding="utf-8-sig")
+    with source:
+        sample = source.read(4096)
+        source.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        plan: dict[str, list] = {}
+        errors: list[str] = []
+        rows = ([v if v != "" else None for v in row] for row in csv.reader(source, dialect))
+        _parse_rows(rows, plan, errors)
+    if errors:
+        raise PlanParseError(errors)
+    return plan
+
+def parse_plan_file(source, kind: str = "xlsx") -> dict:
+    """Parse an uploaded plan (bytes or file path); runs inside the import worker processes"""
+    if kind == "csv":
+        return parse_plan_csv(source)
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return parse_plan_xlsx(source)
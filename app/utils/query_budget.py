@@ -0,0 +1,79 @@
+"""Query budgets: count the SQL statements of a block and fail when it issues too many.
+
+    with query_budget(6, label="capture_set"):
+        await dp.feed_update(bot, update)
+
+Il conteggio usa l'evento `before_cursor_execute` di SQLAlchemy su tutti gli engine ed
+è limitato al contesto corrente (contextvar): le query di altri task in corso (timer,
+flush write-behind) non vengono contate. Oltre al totale viene segnalato il pattern
+N+1: la stessa SELECT ripetuta più di `repeat_limit` volte nello stesso blocco.
+
+Nei test si usa la fixture `query_budget` di tests/conftest.py.
+"""
+import contextvars
+import re
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REPEAT_LIMIT = 2
+
+_counters: contextvars.ContextVar = contextvars.ContextVar("query_counters", default=())
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+def _normalize(statement: str) -> str:
+    return re.sub(r"\s+", " ", statement).strip()
+
+class QueryCounter:
+    """Statements executed inside a `count_queries()` block"""
+
+    def __init__(self):
+        self.statements: list[str] = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def repeated(self, repeat_limit: int = REPEAT_LIMIT) -> dict[str, int]:
+        """SELECTs executed more than `repeat_limit` times (likely N+1 loops)"""
+        counts = Counter(s for s in self.statements if s.upper().startswith("SELECT"))
+        return {s: n for s, n in counts.items() if n > repeat_limit}
+
+    def report(self) -> str:
+        return "\n".join(f"  {n}× {s[:160]}" for s, n in Counter(self.statements).most_common())
+
+    def check(self, max_queries: int, repeat_limit: int | None = REPEAT_LIMIT, label: str = ""):
+        where = f" in {label}" if label else ""
+        if len(self) > max_queries:
+            raise QueryBudgetExceeded(
+                f"{len(self)} queries{where}, budget {max_queries}:\n{self.report()}")
+        repeated = self.repeated(repeat_limit) if repeat_limit is not None else {}
+        if repeated:
+            lines = "\n".join(f"  {n}× {s[:160]}" for s, n in repeated.items())
+            raise QueryBudgetExceeded(f"repeated SELECT{where} (N+1?):\n{lines}")
+
+def _record(conn, cursor, statement, parameters, context, executemany):
+    for counter in _counters.get():
+        counter.statements.append(_normalize(statement))
+
+@contextmanager
+def count_queries():
+    """Collect the statements executed in this context while the block runs"""
+    if not event.contains(Engine, "before_cursor_execute", _record):
+        event.listen(Engine, "before_cursor_execute", _record)
+    counter = QueryCounter()
+    token = _counters.set(_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _counters.reset(token)
+
+@contextmanager
+def query_budget(max_queries: int, repeat_limit: int | None = REPEAT_LIMIT, label: str = ""):
+    """Fail with QueryBudgetExceeded if the block runs more than `max_queries` statements
+    or repeats a SELECT more than `repeat_limit` times (None disables the N+1 check)"""
+    with count_queries() as counter:
+        yield counter
+    counter.check(max_queries, repeat_limit, label)
@@ -0,0 +1,55 @@
+import hashlib
+import re
+from decimal import Decimal, InvalidOperation
+
+def weight_to_kg(weight: str) -> Decimal | None:
+    """Numeric value of a weight typed by the user ('52,5', '50'), None if not a number"""
+    try:
+        value = Decimal(str(weight).strip().replace(",", "."))
+    except (InvalidOperation, ValueError):
+        return None
+    if not value.is_finite() or abs(value) >= 100000:
+        return None
+    return value.quantize(Decimal("0.01"))
+
+def import_key(ts, exercise: str, set_number: int) -> str:
+    """Natural key of a logged set (second, exercise, set number), unique per user.
+
+    La stessa serie registrata nel bot o importata da file (es. un /export) ha la
+    stessa chiave, così l'import non la duplica.
+    """
+    data = f"{ts:%Y-%m-%dT%H:%M:%S}|{exercise}|{set_number}"
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+MAX_SETS_PER_MESSAGE = 20
+_PAIR_RE = re.compile(r"\s*[x×*]\s*", re.I)
+
+def parse_sets(text: str) -> list[tuple[str, int]]:
+    """Parse one or more sets typed in a single message.
+
+    Accepted: `50 10` (one `peso reps` pair per line) or `50x10 50x10 52,5x8`
+    (any number of `pesoxreps` per line). Returns [(weight, reps)] with the
+    decimal comma normalised; raises ValueError if the text is not valid.
+    """
+    sets = []
+    for line in text.strip().splitlines():
+        line = _PAIR_RE.sub("x", line.strip())
+        if not line:
+            continue
+        tokens = line.split()
+        if all("x" in t.lower() for t in tokens):
+            pairs = [t.lower().split("x") for t in tokens]
+        elif len(tokens) == 2:
+            pairs = [tokens]
+        else:
+            raise ValueError(line)
+        for pair in pairs:
+            if len(pair) != 2 or not pair[0]:
+                raise ValueError(line)
+            reps = int(pair[1])
+            if reps < 0:
+                raise ValueError(line)
+            sets.append((pair[0].replace(",", "."), reps))
+    if not sets or len(sets) > MAX_SETS_PER_MESSAGE:
+        raise ValueError(text)
+    return sets
@@ -0,0 +1,162 @@
+"""Webhook serving mode (BOT_MODE=webhook).
+
+Server aiohttp che riceve gli update da Telegram:
+- POST WEBHOOK_PATH: verifica l'header `X-Telegram-Bot-Api-Secret-Token`, risponde
+  subito 200 e processa l'update in background, con al massimo WEBHOOK_CONCURRENCY
+  update in parallelo (oltre WEBHOOK_MAX_PENDING in attesa risponde 503 e Telegram
+  ritenta più tardi). Gli update dello stesso utente restano in ordine;
+- GET /healthz: il processo è vivo;
+- GET /readyz: avvio completato e database raggiungibile.
+
+Per provarlo in locale basta POSTare un update registrato:
+    python scripts/post_update.py scripts/updates/start.json
+"""
+import asyncio
+import hmac
+import os
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from sqlalchemy import text
+from app.db import get_async_db
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # URL pubblico, es. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "64"))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class UpdateProcessor:
+    """Feeds updates to the dispatcher in background tasks, bounded by a semaphore"""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, concurrency: int = WEBHOOK_CONCURRENCY,
+                 max_pending: int = WEBHOOK_MAX_PENDING):
+        self.dp = dp
+        self.bot = bot
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+        self._users: dict[int, list] = {}  # user_id -> [lock, update in coda/in corso]
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, update: Update) -> bool:
+        if len(self._tasks) >= self.max_pending:
+            return False
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    @staticmethod
+    def _user_id(update: Update):
+        event = update.event if update.event_type != "update" else None
+        user = getattr(event, "from_user", None)
+        return user.id if user else None
+
+    async def _process(self, update: Update):
+        user_id = self._user_id(update)
+        if user_id is None:
+            await self._feed(update)
+            return
+        # Un utente alla volta: gli update della stessa chat vanno processati in ordine
+        entry = self._users.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._feed(update)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[user_id]
+
+    async def _feed(self, update: Update):
+        async with self._slots:
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                print(f"❌ Errore nell'update {update.update_id}: {e}")
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+def build_app(dp: Dispatcher, bot: Bot, secret: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH,
+              concurrency: int = WEBHOOK_CONCURRENCY, max_pending: int = WEBHOOK_MAX_PENDING) -> web.Application:
+    processor = UpdateProcessor(dp, bot, concurrency, max_pending)
+    app = web.Application()
+    state = {"ready": False}  # impostato da run_webhook a avvio completato
+    app["processor"] = processor
+    app["state"] = state
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401, text="invalid secret token")
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception:
+            return web.Response(status=400, text="invalid update")
+        if not processor.submit(update):
+            return web.Response(status=503, text="too many pending updates")
+        return web.Response(text="ok")
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def readyz(request: web.Request) -> web.Response:
+        if not state["ready"]:
+            return web.Response(status=503, text="starting")
+        try:
+            async with get_async_db() as db:
+                await db.execute(text("SELECT 1"))
+        except Exception as e:
+            return web.Response(status=503, text=f"database unavailable: {e}")
+        return web.Response(text="ready")
+
+    async def on_shutdown(app: web.Application):
+        await processor.drain()
+
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+def check_webhook_config():
+    """Refuse a public webhook without a secret token"""
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        # Senza segreto chiunque conosca l'URL pubblico potrebbe inviare update falsi
+        raise RuntimeError("WEBHOOK_SECRET è obbligatorio quando WEBHOOK_URL è impostato")
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    check_webhook_config()
+    app = build_app(dp, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    print(f"🌐 Webhook in ascolto su {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(100, WEBHOOK_CONCURRENCY),
+            )
+            print("✅ Webhook registrato su Telegram")
+        else:
+            print("⚠️ WEBHOOK_URL non impostato: webhook non registrato (modalità test locale)")
+        await dp.emit_startup(bot=bot)
+        app["state"]["ready"] = True
+        await asyncio.Event().wait()
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await runner.cleanup()
@@ -0,0 +1,186 @@
+"""Group-commit write-behind buffer for logged sets (WRITE_BEHIND=1).
+
+Con il buffer attivo `capture_set` non fa più un commit per serie: le righe di
+`workout_logs`, gli aggiornamenti dei recap e il cursore dell'utente
+(`current_day`/`exercise_idx`/`set_idx`) vengono accodati e scritti da un unico task
+con un commit di gruppo ogni WRITE_BEHIND_INTERVAL_MS millisecondi (o appena ci sono
+WRITE_BEHIND_MAX_ROWS righe). Un crash perde al massimo le serie dell'ultimo intervallo.
+
+Coerenza delle letture:
+- `overlay(user)` applica il cursore in attesa all'utente appena caricato (la serie
+  successiva dello stesso utente non aspetta il flush);
+- gli altri percorsi chiamano `flush_user()` prima di leggere o modificare log e
+  cursore, e i commit diretti del cursore passano da `commit_user()`, che tiene
+  allineata la copia in attesa.
+
+Il flush usa una connessione dedicata (`get_flush_db`), non il pool degli handler.
+"""
+import asyncio
+import os
+from collections import Counter
+from sqlalchemy import insert, update
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
+from app.db import dialect_insert, get_flush_db
+from app.models import ExerciseRecap, User, WorkoutLog
+from app import recaps
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0").lower() in ("1", "true", "yes", "on")
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "20"))
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "500"))
+
+CURSOR_FIELDS = ("current_day", "exercise_idx", "set_idx")
+
+def insert_logs():
+    """INSERT of workout_logs rows that skips a set already stored (same user and import_key).
+
+    Solo per l'import dello storico: le serie registrate nel bot passano da `insert_sets`.
+    """
+    return dialect_insert(WorkoutLog).on_conflict_do_nothing(
+        index_elements=[WorkoutLog.user_id, WorkoutLog.import_key])
+
+async def insert_sets(db, rows: list[dict]) -> int:
+    """INSERT sets logged in the bot; none is ever skipped. Returns how many were stored without import_key.
+
+    Una serie con la chiave già presente (stesso secondo, esercizio e numero di serie,
+    es. due messaggi dello stesso utente elaborati insieme) viene salvata lo stesso,
+    senza chiave: l'utente l'ha vista registrata.
+    """
+    result = await db.execute(insert_logs().returning(WorkoutLog.user_id, WorkoutLog.import_key), rows)
+    stored = Counter(tuple(row) for row in result)
+    skipped = []
+    for row in rows:
+        key = (row["user_id"], row.get("import_key"))
+        if stored[key]:
+            stored[key] -= 1
+        else:
+            skipped.append(dict(row, import_key=None))
+    if skipped:
+        await db.execute(insert(WorkoutLog), skipped)
+    return len(skipped)
+
+def _cursor(user: User) -> dict:
+    return {name: getattr(user, name) for name in CURSOR_FIELDS}
+
+class WriteBehindBuffer:
+    def __init__(self, enabled: bool = WRITE_BEHIND, interval_ms: int = WRITE_BEHIND_INTERVAL_MS,
+                 max_rows: int = WRITE_BEHIND_MAX_ROWS, session_factory=get_flush_db):
+        self.enabled = enabled
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self._session_factory = session_factory
+        self._rows: list[dict] = []
+        self._cursors: dict[int, dict] = {}
+        self._recaps: dict[tuple, list] = {}   # (user_id, exercise) -> [(ts, [(weight, reps)])]
+        self._inflight: dict[int, dict] = {}  # cursori del flush in corso, non ancora committati
+        self._lock = asyncio.Lock()
+        self._timer: asyncio.TimerHandle | None = None
+        self._task: asyncio.Task | None = None
+        self.stats = {"flushes": 0, "rows": 0, "errors": 0}
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def has_pending(self, user_id: int, exercise: str | None = None) -> bool:
+        if exercise is not None:
+            return (user_id, exercise) in self._recaps
+        return user_id in self._cursors
+
+    def add(self, user: User, rows: list[dict], exercise: str, ts, sets: list):
+        """Queue the logs of one capture_set call together with the user's new cursor"""
+        self._rows.extend(rows)
+        self._cursors[user.id] = cursor = _cursor(user)
+        # Il cursore ora lo scrive il buffer: nella sessione l'utente non risulta modificato
+        for name, value in cursor.items():
+            set_committed_value(user, name, value)
+        self._recaps.setdefault((user.id, exercise), []).append((ts, sets))
+        self._schedule()
+
+    def _schedule(self):
+        if len(self._rows) >= self.max_rows:
+            self._kick()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._kick)
+
+    def overlay(self, user: User):
+        """Apply the cursor still waiting in the buffer to a freshly loaded user"""
+        cursor = self._cursors.get(user.id) or self._inflight.get(user.id)
+        if cursor:
+            for name, value in cursor.items():
+                setattr(user, name, value)
+
+    async def commit_user(self, db, user: User):
+        """Commit `db`; a buffered (or in-flight) cursor of the user is replaced by the committed one.
+
+        Non aspetta il flush in corso: se il flush scrive dopo questo commit il cursore
+        vecchio, quello nuovo è già in coda e il flush successivo lo riscrive.
+        """
+        if not self.enabled:
+            return await db.commit()
+        pending = user.id in self._cursors or user.id in self._inflight
+        # Il cursore va scritto per intero: un campo tornato al valore letto dal DB non
+        # finirebbe nell'UPDATE, mentre il flush in corso può scriverne uno vecchio
+        for name in CURSOR_FIELDS:
+            flag_modified(user, name)
+        await db.commit()
+        if pending or user.id in self._cursors or user.id in self._inflight:
+            self._cursors[user.id] = _cursor(user)
+            self._schedule()
+
+    async def flush_user(self, user_id: int):
+        """Make the user's pending writes visible in the database (flushes the whole batch)"""
+        if user_id in self._cursors or self._lock.locked():
+            await self.flush()
+
+    def _kick(self):
+        self._timer = None
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._rows and not self._cursors:
+                return
+            rows, cursors, recap_sets = self._rows, self._cursors, self._recaps
+            self._rows, self._cursors, self._recaps = [], {}, {}
+            self._inflight = cursors
+            try:
+                async with self._session_factory() as db:
+                    if rows:
+                        await insert_sets(db, rows)
+                    if cursors:
+                        await db.execute(update(User), [{"id": uid, **c} for uid, c in cursors.items()])
+                    for (user_id, exercise), batches in recap_sets.items():
+                        if await db.get(ExerciseRecap, (user_id, exercise)) is None:
+                            await recaps.rebuild_recap(db, user_id, exercise)  # include già tutte le righe
+                            continue
+                        for ts, sets in batches:
+                            await recaps.add_sets(db, user_id, exercise, ts, sets)
+                    await db.commit()
+            except Exception as e:
+                self._inflight = {}
+                # Si rimette tutto in coda (davanti alle scritture più recenti) e si riprova
+                self.stats["errors"] += 1
+                print(f"❌ Errore nel flush write-behind ({len(rows)} serie): {e}")
+                self._rows[:0] = rows
+                for uid, c in cursors.items():
+                    self._cursors.setdefault(uid, c)
+                for key, batches in recap_sets.items():
+                    self._recaps[key] = batches + self._recaps.get(key, [])
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(max(self.interval, 1.0), self._kick)
+                return
+            self._inflight = {}
+            self.stats["flushes"] += 1
+            self.stats["rows"] += len(rows)
+
+    async def close(self):
+        """Flush what is left (called on shutdown)"""
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+
+write_behind = WriteBehindBuffer()
@@ -0,0 +1,88 @@
+"""Event-loop latency under concurrent set logging: sync session vs async layer.
+
+Simula N utenti che registrano serie in parallelo e misura, con un task "heartbeat",
+quanto l'event loop resta bloccato. Con il layer sincrono ogni commit ferma tutti;
+con `get_async_db()` la latenza deve restare piatta.
+
+Uso:
+    python benchmarks/event_loop_latency.py --users 50 --sets 20
+    DATABASE_URL=postgresql://... python benchmarks/event_loop_latency.py
+"""
+import argparse, asyncio, os, statistics, sys, tempfile, time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+from app.db import Base, engine, get_db, get_async_db
+from app.models import User, WorkoutLog
+
+HEARTBEAT = 0.005  # 5 ms
+
+async def _heartbeat(samples: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t0 = loop.time()
+        await asyncio.sleep(HEARTBEAT)
+        samples.append((loop.time() - t0 - HEARTBEAT) * 1000)
+
+async def _log_sets_sync(user_id: int, sets: int):
+    for i in range(sets):
+        db = get_db()
+        user = db.get(User, user_id)
+        db.add(WorkoutLog(user_id=user_id, day="Giorno 1", exercise="Panca", set_number=i + 1, weight="50", reps=10))
+        user.set_idx += 1
+        db.commit()
+        db.close()
+        await asyncio.sleep(0)
+
+async def _log_sets_async(user_id: int, sets: int):
+    for i in range(sets):
+        async with get_async_db() as db:
+            user = await db.get(User, user_id)
+            db.add(WorkoutLog(user_id=user_id, day="Giorno 1", exercise="Panca", set_number=i + 1, weight="50", reps=10))
+            user.set_idx += 1
+            await db.commit()
+
+async def _run(mode: str, users: int, sets: int) -> dict:
+    worker = _log_sets_sync if mode == "sync" else _log_sets_async
+    samples, stop = [], asyncio.Event()
+    hb = asyncio.create_task(_heartbeat(samples, stop))
+    await asyncio.sleep(0.05)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(uid, sets) for uid in range(1, users + 1)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await hb
+    samples.sort()
+    return {
+        "mode": mode,
+        "sets/s": users * sets / elapsed,
+        "lag_p50_ms": statistics.median(samples),
+        "lag_p99_ms": samples[int(len(samples) * 0.99) - 1],
+        "lag_max_ms": samples[-1],
+    }
+
+def _reset(users: int):
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    db = get_db()
+    db.add_all(User(id=uid, username=f"u{uid}", exercise_idx=0, set_idx=0) for uid in range(1, users + 1))
+    db.commit()
+    db.close()
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--sets", type=int, default=20)
+    args = ap.parse_args()
+
+    for mode in ("sync", "async"):
+        _reset(args.users)
+        r = await _run(mode, args.users, args.sets)
+        print(f"{r['mode']:>5}: {r['sets/s']:8.1f} sets/s | loop lag p50 {r['lag_p50_ms']:6.2f} ms"
+              f" p99 {r['lag_p99_ms']:7.2f} ms max {r['lag_max_ms']:7.2f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""Memory and time of the streaming /export for users with a long history.
+
+Per ogni dimensione (`--rows`) crea un utente con N serie, poi esporta lo storico in
+CSV e in XLSX con `app/exports.py` (cursore lato server + file spooled), ogni export
+in un processo nuovo per misurarne il picco di memoria (RSS). Per confronto, con
+`--naive` esporta anche il CSV caricando tutte le righe con `.all()` e scrivendo in
+un `BytesIO`. Esce con errore se il picco dell'export in streaming cresce più di
+`--max-growth-mb` tra la dimensione più piccola e la più grande.
+Il database è un file SQLite temporaneo (o DATABASE_URL se impostata).
+
+Uso:
+    python benchmarks/export.py --rows 10000 100000 1000000 --naive
+"""
+import argparse, asyncio, io, json, os, resource, subprocess, sys, tempfile, time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/export.db")
+
+from sqlalchemy import delete, insert
+from app.db import get_async_db, upgrade_schema
+from app.exports import HistoryExporter, history_query, _CsvWriter
+from app.models import User, WorkoutLog
+from app.utils.sets import weight_to_kg
+
+USER_ID = 1
+SEED_BATCH = 20000
+EXERCISES = ["Panca", "Squat", "Stacco", "Military Press", "Trazioni", "Rematore"]
+
+def _rss_mb() -> float:
+    # ru_maxrss: KB su Linux, byte su macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+async def _seed(rows: int):
+    start = datetime.utcnow() - timedelta(minutes=rows)
+    async with get_async_db() as db:
+        await db.execute(delete(WorkoutLog))
+        await db.execute(delete(User))
+        db.add(User(id=USER_ID, username="heavy"))
+        await db.commit()
+        for offset in range(0, rows, SEED_BATCH):
+            batch = []
+            for i in range(offset, min(offset + SEED_BATCH, rows)):
+                weight = f"{40 + (i % 40) * 2.5:g}"
+                batch.append(dict(user_id=USER_ID, plan_id=None, day=f"Giorno {i // 18 % 4 + 1}",
+                                  exercise=EXERCISES[i // 3 % len(EXERCISES)], set_number=i % 3 + 1,
+                                  weight=weight, weight_kg=weight_to_kg(weight), reps=6 + i % 6,
+                                  ts=start + timedelta(minutes=i)))
+            await db.execute(insert(WorkoutLog), batch)
+            await db.commit()
+
+async def _child(mode: str) -> dict:
+    """One export in this (fresh) process: rows, output size, seconds, peak RSS of the process"""
+    t0 = time.perf_counter()
+    async with get_async_db() as db:
+        if mode == "naive-csv":
+            rows = (await db.execute(history_query(USER_ID))).all()
+            out = io.BytesIO()
+            writer = _CsvWriter(out)
+            writer.write(rows)
+            writer.close()
+            count, size = len(rows), out.tell()
+        else:
+            exporter = HistoryExporter(max_bytes=float("inf"))
+            async with exporter.export(db, USER_ID, mode) as export:
+                count, size = export.rows, export.size
+    return dict(rows=count, size=size, seconds=time.perf_counter() - t0, peak_mb=_rss_mb())
+
+def _run_child(mode: str) -> dict:
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode],
+                         env=os.environ, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    ap.add_argument("--naive", action="store_true", help="anche il CSV caricato tutto in memoria")
+    ap.add_argument("--max-growth-mb", type=float, default=30)
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        print(json.dumps(asyncio.run(_child(args.child))))
+        return
+
+    upgrade_schema()
+    modes = ["csv", "xlsx"] + (["naive-csv"] if args.naive else [])
+    print(f"{'rows':>9} {'mode':<10} {'seconds':>8} {'rows/s':>9} {'file MB':>8} {'peak RSS':>9}")
+    peaks: dict[str, list[float]] = {}
+    for rows in sorted(args.rows):
+        asyncio.run(_seed(rows))
+        for mode in modes:
+            r = _run_child(mode)
+            assert r["rows"] == rows, r
+            peaks.setdefault(mode, []).append(r["peak_mb"])
+            print(f"{rows:>9} {mode:<10} {r['seconds']:8.2f} {rows / r['seconds']:9.0f} "
+                  f"{r['size'] / 1024 / 1024:8.1f} {r['peak_mb']:9.1f}")
+
+    growth = {mode: peaks[mode][-1] - peaks[mode][0] for mode in ("csv", "xlsx")}
+    print("peak growth (streaming): " + ", ".join(f"{m} {g:+.1f} MB" for m, g in growth.items()))
+    if max(growth.values()) > args.max_growth_mb:
+        print(f"❌ streaming export memory grows with the history (> {args.max_growth_mb:g} MB)")
+        sys.exit(1)
+    print("✅ streaming export memory independent of the history size")
+
+if __name__ == "__main__":
+    main()
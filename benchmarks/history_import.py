@@ -0,0 +1,105 @@
+"""Throughput of the bulk history import (app/history_import.py).
+
+Genera uno storico di N serie in CSV e in XLSX e lo importa per un utente nuovo come
+/import_history (validazione nel pool di processi degli import, poi INSERT multi-riga
+a blocchi con `import_history`), poi lo reimporta
+per verificare che non venga duplicato nulla. Riporta righe/s e tempo per formato;
+esce con errore se il primo import non inserisce tutte le serie o il secondo ne
+inserisce qualcuna.
+Il database è un file SQLite temporaneo (o DATABASE_URL se impostata).
+
+Uso:
+    python benchmarks/history_import.py --rows 100000 --batch 5000
+"""
+import argparse, asyncio, csv, os, sys, tempfile, time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/history_import.db")
+
+from sqlalchemy import delete
+from app.db import get_async_db, upgrade_schema
+from app.history_import import HISTORY_TIMEOUT, import_history
+from app.imports import plan_importer
+from app.models import ExerciseRecap, TrainingPlan, User, WorkoutLog
+from app.plans import store_plan
+
+EXERCISES = ["Panca", "Squat", "Stacco", "Military Press", "Trazioni", "Rematore"]
+PLAN = {f"Giorno {d}": [{"name": ex, "sets": 3, "reps": "8", "rest": "90s"} for ex in EXERCISES[d - 1::3]]
+        for d in (1, 2, 3)}
+HEADER = ["Data", "Allenamento", "Esercizio", "Serie", "Peso", "Ripetizioni"]
+
+def _rows(n: int):
+    start = datetime(2020, 1, 1, 18)
+    for i in range(n):
+        session, k = divmod(i, 18)  # 18 serie per sessione: 6 esercizi × 3
+        yield [start + timedelta(days=session, minutes=k * 3), "", EXERCISES[k // 3], k % 3 + 1,
+               f"{40 + (i % 40) * 2.5:g}".replace(".", ","), 6 + i % 6]
+
+def _csv(path: str, n: int):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(HEADER)
+        writer.writerows([r[0].strftime("%Y-%m-%d %H:%M"), *r[1:]] for r in _rows(n))
+
+def _xlsx(path: str, n: int):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Storico")
+    ws.append(HEADER)
+    for r in _rows(n):
+        ws.append(r)
+    wb.save(path)
+
+async def _reset() -> User:
+    async with get_async_db() as db:
+        for model in (WorkoutLog, ExerciseRecap, TrainingPlan, User):
+            await db.execute(delete(model))
+        user = User(id=1, username="bench")
+        db.add(user)
+        await db.flush()
+        user.active_plan_id = (await store_plan(db, user.id, "Scheda", PLAN)).id
+        await db.commit()
+        return user
+
+async def _import(path: str, kind: str, user: User, batch: int):
+    # Come /import_history: lettura e validazione nel pool di processi, poi l'import
+    t0 = time.perf_counter()
+    async with plan_importer.parse_history(path, kind, HISTORY_TIMEOUT) as parsed:
+        async with get_async_db() as db:
+            result = await import_history(db, user, parsed, batch)
+    return result._replace(seconds=time.perf_counter() - t0)
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--batch", type=int, default=5000)
+    args = ap.parse_args()
+
+    ok = True
+    tmp = tempfile.mkdtemp()
+    # Avvio dei processi del pool fuori dalle misure: nel bot succede una volta sola
+    warm_up = os.path.join(tmp, "warm_up.csv")
+    _csv(warm_up, 1)
+    async with plan_importer.parse_history(warm_up, "csv", HISTORY_TIMEOUT):
+        pass
+    for kind, build in (("csv", _csv), ("xlsx", _xlsx)):
+        path = os.path.join(tmp, f"history.{kind}")
+        build(path, args.rows)
+        user = await _reset()
+        for run in ("import", "reimport"):
+            r = await _import(path, kind, user, args.batch)
+            print(f"{kind:<5} {run:<9} {r.seconds:7.2f} s  {r.rows_per_second:9.0f} rows/s  "
+                  f"inserted {r.inserted:>7}  duplicates {r.duplicates:>7}  invalid {r.invalid}")
+            expected = args.rows if run == "import" else 0
+            ok = ok and r.inserted == expected and r.invalid == 0
+    print("✅ every set imported once, re-import is a no-op" if ok else "❌ unexpected inserted/invalid counts")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    upgrade_schema()
+    try:
+        asyncio.run(main())
+    finally:
+        plan_importer.shutdown()
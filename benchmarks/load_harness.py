@@ -0,0 +1,294 @@
+"""In-process load test: N simulated users doing full workouts through the real routers.
+
+Gli update (`Message` / `CallbackQuery`) sintetici passano da un `Dispatcher` vero con
+i router di `get_routers()`; il bot usa una sessione finta che registra le chiamate
+in uscita senza rete. Ogni utente: /start, import della scheda, /workout, scelta del
+giorno, poi serie fino a fine allenamento con qualche "salta" / "indietro" e la
+vista dei progressi ogni tanto, infine progressi e scheda.
+
+Per ogni handler riporta latenza p50/p95/p99, query SQL, sessioni del database e
+chiamate in uscita per update; in totale le chiamate in uscita per serie registrata (compresi i timer di
+recupero). Con `--out` i risultati sono salvati in JSON, con `--compare` confrontati
+con un run precedente.
+
+Uso:
+    python benchmarks/load_harness.py --users 50 --out results/base.json
+    WRITE_BEHIND=1 python benchmarks/load_harness.py --users 50 --compare results/base.json
+"""
+import argparse, asyncio, contextvars, io, itertools, json, os, platform, random, sys, tempfile, time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/load_harness.db")
+os.environ.setdefault("STATE_BACKEND", "memory")
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, GetFile, SendDocument, SendMessage
+from aiogram.types import CallbackQuery, Chat, Document, File, Message, Update, User as TgUser
+from sqlalchemy import event, func, select
+
+from app import db as app_db
+from app.db import async_engine, get_async_db, upgrade_schema
+from app.handlers import get_routers
+from app.imports import plan_importer
+from app.middlewares import setup_db_session
+from app.models import WorkoutLog
+from app.timers import rest_timers
+from app.writebehind import write_behind
+
+PLAN = [
+    ("Giorno 1", "Panca piana", 4, 8, "90s"),
+    ("Giorno 1", "Squat", 4, 10, "120s"),
+    ("Giorno 1", "Rematore", 3, 10, "60s"),
+    ("Giorno 1", "Military Press", 3, 8, "90s"),
+    ("Giorno 2", "Stacco", 3, 5, "180s"),
+    ("Giorno 2", "Trazioni", 3, "MAX", "90s"),
+]
+MAX_UPDATES_PER_WORKOUT = 200
+
+_update = contextvars.ContextVar("load_update", default=None)
+_ids = itertools.count(1)
+
+def _plan_xlsx() -> bytes:
+    import openpyxl
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Allenamento", "Esercizio", "Serie", "Ripetizioni", "Recupero"])
+    for row in PLAN:
+        ws.append(list(row))
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+class RecordingSession(BaseSession):
+    """Fake Bot API: records every outbound call, per update and per chat"""
+
+    def __init__(self, plan_bytes: bytes):
+        super().__init__()
+        self.plan_bytes = plan_bytes
+        self.calls = 0
+        self.background_calls = 0
+        self.last_text: dict[int, str] = {}
+        self.last_markup: dict[int, object] = {}
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield self.plan_bytes
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        stats = _update.get()
+        if stats is None:
+            self.background_calls += 1  # timer di recupero e altri task
+        else:
+            stats["outbound"] += 1
+        chat_id = getattr(method, "chat_id", None)
+        text = getattr(method, "text", None)
+        if chat_id is not None and text:
+            self.last_text[chat_id] = text
+            self.last_markup[chat_id] = getattr(method, "reply_markup", None)
+        if isinstance(method, (SendMessage, SendDocument)):
+            return Message(message_id=next(_ids), date=datetime.now(), chat=Chat(id=method.chat_id, type="private"),
+                           text=text).as_(bot)
+        if isinstance(method, EditMessageText):
+            return True
+        if isinstance(method, GetFile):
+            return File(file_id=method.file_id, file_unique_id="plan", file_path="documents/plan.xlsx")
+        return True
+
+def _counting_sessions(factory):
+    """Wrap the session factory behind get_async_db() to count sessions per update"""
+    def sessions(**kwargs):
+        stats = _update.get()
+        if stats is not None:
+            stats["sessions"] += 1
+        return factory(**kwargs)
+    sessions.counting = True
+    return sessions
+
+def _tg_user(uid):
+    return TgUser(id=uid, is_bot=False, first_name=f"load{uid}")
+
+def message_update(uid, text=None, document=None):
+    return Update(update_id=next(_ids), message=Message(
+        message_id=next(_ids), date=datetime.now(), chat=Chat(id=uid, type="private"),
+        from_user=_tg_user(uid), text=text, document=document))
+
+def callback_update(uid, data):
+    message = Message(message_id=next(_ids), date=datetime.now(), chat=Chat(id=uid, type="private"), text="…")
+    return Update(update_id=next(_ids), callback_query=CallbackQuery(
+        id=str(next(_ids)), from_user=_tg_user(uid), chat_instance="load", data=data, message=message))
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.session = RecordingSession(_plan_xlsx())
+        self.bot = Bot("0:benchmark", session=self.session)
+        self.dp = Dispatcher()
+        for r in get_routers():
+            self.dp.include_router(r)
+        setup_db_session(self.dp)
+        self.dp.message.middleware(self._name_handler)
+        self.dp.callback_query.middleware(self._name_handler)
+        self.samples: dict[str, list] = {}
+        self.rng = random.Random(args.seed)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", self._count_query)
+        if not getattr(app_db.AsyncSessionLocal, "counting", False):
+            app_db.AsyncSessionLocal = _counting_sessions(app_db.AsyncSessionLocal)
+
+    @staticmethod
+    async def _name_handler(handler, event, data):
+        stats = _update.get()
+        if stats is not None:
+            stats["handler"] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+    @staticmethod
+    def _count_query(*args):
+        stats = _update.get()
+        if stats is not None:
+            stats["queries"] += 1
+
+    async def feed(self, update: Update) -> dict:
+        stats = {"handler": "unhandled", "queries": 0, "sessions": 0, "outbound": 0, "error": False}
+        token = _update.set(stats)
+        t0 = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            stats["error"] = True
+            print(f"❌ {stats['handler']}: {type(e).__name__}: {e}", file=sys.stderr)
+        finally:
+            stats["latency"] = time.perf_counter() - t0
+            _update.reset(token)
+        self.samples.setdefault(stats["handler"], []).append(stats)
+        return stats
+
+    async def think(self):
+        if self.args.think_ms:
+            await asyncio.sleep(self.rng.uniform(0, self.args.think_ms) / 1000)
+
+    async def user(self, uid: int, setup: asyncio.Semaphore):
+        rng = self.rng
+        await self.feed(message_update(uid, "/start"))
+        async with setup:  # l'import passa dal pool di processi, che ha una coda limitata
+            await self.feed(message_update(uid, document=Document(
+                file_id=f"plan{uid}", file_unique_id=f"plan{uid}", file_name="scheda.xlsx", file_size=8000)))
+        for _ in range(self.args.workouts):
+            await self.feed(message_update(uid, "/workout"))
+            await self.feed(callback_update(uid, "day:Giorno 1"))
+            for _ in range(MAX_UPDATES_PER_WORKOUT):
+                await self.think()
+                roll = rng.random()
+                if roll < self.args.p_skip:
+                    await self.feed(callback_update(uid, "skip:set"))
+                elif roll < self.args.p_skip + self.args.p_back:
+                    await self.feed(callback_update(uid, "back:set"))
+                elif roll < self.args.p_skip + self.args.p_back + self.args.p_progress:
+                    await self.feed(callback_update(uid, "view_progress"))
+                else:
+                    await self.feed(message_update(uid, f"{rng.choice((50, 60, 70, 72.5))} {rng.randint(5, 12)}"))
+                if "completato!" in self.session.last_text.get(uid, "") and "Allenamento" in self.session.last_text[uid]:
+                    break
+        await self.feed(callback_update(uid, "view_progress"))
+        await self.feed(message_update(uid, "/view_plan"))
+
+    async def run(self):
+        setup = asyncio.Semaphore(4)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(self.user(uid, setup) for uid in range(1, self.args.users + 1)))
+        elapsed = time.perf_counter() - t0
+        await write_behind.close()
+        async with get_async_db() as db:
+            logged = (await db.execute(select(func.count()).select_from(WorkoutLog))).scalar()
+        return elapsed, logged
+
+def _pct(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def summarize(samples: dict, elapsed: float, logged: int, session: RecordingSession, args) -> dict:
+    handlers = {}
+    for name, rows in sorted(samples.items()):
+        lat = sorted(r["latency"] * 1000 for r in rows)
+        handlers[name] = {
+            "count": len(rows),
+            "p50_ms": _pct(lat, 0.50),
+            "p95_ms": _pct(lat, 0.95),
+            "p99_ms": _pct(lat, 0.99),
+            "queries_per_update": sum(r["queries"] for r in rows) / len(rows),
+            "sessions_per_update": sum(r["sessions"] for r in rows) / len(rows),
+            "outbound_per_update": sum(r["outbound"] for r in rows) / len(rows),
+            "errors": sum(r["error"] for r in rows),
+        }
+    updates = sum(h["count"] for h in handlers.values())
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")}
+                  | {"db_profile": os.getenv("DB_PROFILE", ""), "write_behind": write_behind.enabled,
+                     "python": platform.python_version()},
+        "elapsed_s": elapsed,
+        "updates": updates,
+        "updates_per_s": updates / elapsed,
+        "sets_logged": logged,
+        "outbound_calls": session.calls,
+        "outbound_background": session.background_calls,
+        "outbound_per_set": session.calls / logged if logged else None,
+        "handlers": handlers,
+    }
+
+def print_report(result: dict, baseline: dict | None = None):
+    print(f"{result['updates']} updates in {result['elapsed_s']:.1f}s ({result['updates_per_s']:.0f}/s), "
+          f"{result['sets_logged']} sets logged, {result['outbound_calls']} outbound calls "
+          f"({result['outbound_background']} from timers) = {result['outbound_per_set'] or 0:.2f} per set")
+    base = (baseline or {}).get("handlers", {})
+    header = (f"{'handler':<34}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'sess':>6}"
+              f"{'out':>6}{'err':>5}")
+    print(header + ("  p95 vs baseline" if base else ""))
+    for name, h in result["handlers"].items():
+        line = (f"{name:<34}{h['count']:>7}{h['p50_ms']:9.1f}{h['p95_ms']:9.1f}{h['p99_ms']:9.1f}"
+                f"{h['queries_per_update']:9.1f}{h['sessions_per_update']:6.1f}{h['outbound_per_update']:6.1f}"
+                f"{h['errors']:5d}")
+        if name in base:
+            delta = (h["p95_ms"] - base[name]["p95_ms"]) / base[name]["p95_ms"] * 100 if base[name]["p95_ms"] else 0
+            line += f"  {delta:+6.0f}%  (queries {base[name]['queries_per_update']:.1f})"
+        print(line)
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--workouts", type=int, default=1, help="allenamenti completi per utente")
+    ap.add_argument("--think-ms", type=float, default=20, help="pausa casuale massima tra due update di un utente")
+    ap.add_argument("--p-skip", type=float, default=0.05)
+    ap.add_argument("--p-back", type=float, default=0.03)
+    ap.add_argument("--p-progress", type=float, default=0.05)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", help="salva i risultati in questo file JSON")
+    ap.add_argument("--compare", help="JSON di un run precedente da confrontare")
+    args = ap.parse_args()
+
+    upgrade_schema()
+    harness = Harness(args)
+    try:
+        elapsed, logged = await harness.run()
+    finally:
+        await rest_timers.shutdown()
+        plan_importer.shutdown()
+    result = summarize(harness.samples, elapsed, logged, harness.session, args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"saved to {args.out}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
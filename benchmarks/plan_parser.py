@@ -0,0 +1,84 @@
+"""Streaming plan parser vs pandas.
+
+Genera workbook con N righe e confronta `pd.read_excel` + `parse_plan_from_df` con
+`parse_plan_xlsx` (openpyxl read_only): tempo, picco di memoria (con --memory, via
+tracemalloc in un secondo passaggio) e verifica che il piano prodotto sia identico.
+Misura anche il CSV e il formato "un foglio per giorno".
+
+Uso:
+    python benchmarks/plan_parser.py --rows 10000 50000 [--memory]
+"""
+import argparse, io, os, sys, time, tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from openpyxl import Workbook
+from app.utils.plan_parser import parse_plan_from_df, parse_plan_xlsx, parse_plan_csv
+
+HEADER = ["Allenamento", "Esercizio", "Serie", "Ripetizioni", "Recupero"]
+
+def _rows(n: int):
+    for i in range(n):
+        yield [f"Giorno {i % 7 + 1}", f"Esercizio {i}", i % 5 + 1, "MAX" if i % 9 == 0 else 8 + i % 4, f"{60 + i % 4 * 30}s"]
+
+def make_xlsx(n: int) -> bytes:
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Scheda")
+    ws.append(HEADER)
+    for row in _rows(n):
+        ws.append(row)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def make_xlsx_per_day(n: int) -> bytes:
+    wb = Workbook(write_only=True)
+    sheets = {}
+    for row in _rows(n):
+        ws = sheets.get(row[0])
+        if ws is None:
+            ws = sheets[row[0]] = wb.create_sheet(row[0])
+            ws.append(HEADER[1:])
+        ws.append(row[1:])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def make_csv(n: int) -> bytes:
+    lines = [";".join(HEADER)] + [";".join(map(str, row)) for row in _rows(n)]
+    return "\n".join(lines).encode()
+
+def measure(fn, memory: bool):
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    peak = ""
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak = f"{tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f}"
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--memory", action="store_true", help="also measure peak memory (slow)")
+    args = parser.parse_args()
+
+    print(f"{'rows':>7}  {'parser':<22} {'time s':>8} {'peak MB':>8}  same plan")
+    for n in args.rows:
+        xlsx, per_day, csv_data = make_xlsx(n), make_xlsx_per_day(n), make_csv(n)
+        expected, t, mem = measure(lambda: parse_plan_from_df(pd.read_excel(io.BytesIO(xlsx))), args.memory)
+        print(f"{n:>7}  {'pandas read_excel':<22} {t:>8.2f} {mem:>8}")
+        for name, fn in (
+            ("openpyxl streaming", lambda: parse_plan_xlsx(io.BytesIO(xlsx))),
+            ("sheet per day", lambda: parse_plan_xlsx(io.BytesIO(per_day))),
+            ("csv", lambda: parse_plan_csv(csv_data)),
+        ):
+            plan, t, mem = measure(fn, args.memory)
+            print(f"{n:>7}  {name:<22} {t:>8.2f} {mem:>8}  {plan == expected}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Central rest-timer scheduler with many concurrent simulated timers.
+
+Avvia N timer con durate casuali su un bot finto che conta le `edit_message_text`,
+e confronta il numero di modifiche con il vecchio modello (un task per utente,
+una modifica al secondo). Riporta anche il ritardo di completamento e il lag
+dell'event loop.
+
+Uso:
+    python benchmarks/rest_timers.py --timers 10000 --min-rest 20 --max-rest 40
+"""
+import argparse, asyncio, os, random, statistics, sys, time
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from app.state import MemoryStateStore
+from app.timers import RestTimerScheduler
+
+class FakeBot:
+    def __init__(self):
+        self.edits = 0
+        self.completed: dict[int, float] = {}
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.edits += 1
+        if "Completato" in text:
+            self.completed[chat_id] = time.time()
+
+class FakeMessage:
+    def __init__(self, bot, chat_id):
+        self.bot = bot
+        self.chat = SimpleNamespace(id=chat_id)
+
+    async def answer(self, text):
+        return SimpleNamespace(chat=self.chat, message_id=1)
+
+async def _heartbeat(samples, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t0 = loop.time()
+        await asyncio.sleep(0.01)
+        samples.append((loop.time() - t0 - 0.01) * 1000)
+
+def _pct(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--timers", type=int, default=10000)
+    ap.add_argument("--min-rest", type=int, default=20)
+    ap.add_argument("--max-rest", type=int, default=40)
+    args = ap.parse_args()
+
+    bot = FakeBot()
+    scheduler = RestTimerScheduler(store=MemoryStateStore())
+    samples, stop = [], asyncio.Event()
+    hb = asyncio.create_task(_heartbeat(samples, stop))
+
+    rng = random.Random(42)
+    deadlines = {}
+    t0 = time.time()
+    for uid in range(1, args.timers + 1):
+        rest = rng.randint(args.min_rest, args.max_rest)
+        deadlines[uid] = time.time() + rest
+        await scheduler.start(None, FakeMessage(bot, uid), uid, rest, "Panca", f"{rest}s")  # MemoryStateStore: nessuna sessione
+    naive_edits = sum(round(d - t0) for d in deadlines.values())
+
+    while len(bot.completed) < args.timers:
+        await asyncio.sleep(0.5)
+    stop.set()
+    await hb
+    await scheduler.shutdown()
+
+    late = sorted((bot.completed[uid] - deadlines[uid]) * 1000 for uid in deadlines)
+    samples.sort()
+    print(f"timers: {args.timers}  rest: {args.min_rest}-{args.max_rest}s  wall: {time.time() - t0:.1f}s")
+    print(f"edits: {bot.edits}  (one-task-per-user model: ~{naive_edits}, {naive_edits / bot.edits:.1f}x more)")
+    print(f"completion lateness ms: p50 {statistics.median(late):.1f}  p99 {_pct(late, 0.99):.1f}  max {late[-1]:.1f}")
+    print(f"event loop lag ms:      p50 {statistics.median(samples):.2f}  p99 {_pct(samples, 0.99):.2f}  max {samples[-1]:.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
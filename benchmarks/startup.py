@@ -0,0 +1,117 @@
+"""Startup time: imports, schema check and time to the first handled update.
+
+Ogni misura gira in un processo Python nuovo (come un riavvio su Railway): importa i
+moduli di `main.py`, applica/controlla le migrazioni, registra i router e processa un
+`/start` con una sessione finta (nessuna chiamata di rete). Il primo run parte da un
+database vuoto, i successivi da uno già migrato (il caso di un normale riavvio).
+
+I risultati (mediana dei run) sono confrontati con `startup_budget.json`: se una
+misura supera il budget o un modulo pesante (pandas, openpyxl, ...) viene importato
+all'avvio, lo script esce con codice 1.
+
+Uso:
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --budget benchmarks/startup_budget.json
+"""
+import argparse, json, os, statistics, subprocess, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_budget.json")
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl", "alembic")
+
+def child():
+    t0 = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import asyncio, datetime
+    from app.config import dp
+    from app.handlers import get_routers
+    from app.db import upgrade_schema
+    from app.middlewares import setup_db_session
+    from app.timers import rest_timers  # noqa: F401
+    t_import = time.perf_counter()
+    heavy = [m for m in HEAVY_MODULES if m in sys.modules]
+
+    upgrade_schema()
+    t_schema = time.perf_counter()
+
+    from aiogram import Bot
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message, Update, User
+
+    class FakeSession(BaseSession):
+        async def close(self):
+            pass
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def make_request(self, bot, method, timeout=None):
+            return Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=1, type="private"))
+
+    async def first_update():
+        bot = Bot("0:startup", session=FakeSession())
+        for r in get_routers():
+            dp.include_router(r)
+        setup_db_session(dp)
+        user = User(id=1, is_bot=False, first_name="bench")
+        update = Update(update_id=1, message=Message(
+            message_id=1, date=datetime.datetime.now(), chat=Chat(id=1, type="private"), from_user=user, text="/start"))
+        await dp.feed_update(bot, update)
+
+    asyncio.run(first_update())
+    t_first = time.perf_counter()
+    print(json.dumps({
+        "import_s": t_import - t0,
+        "schema_s": t_schema - t_import,
+        "first_update_s": t_first - t_schema,
+        "heavy_modules": heavy,
+    }))
+
+def run_once(db_path: str) -> dict:
+    env = dict(os.environ, BOT_TOKEN="0:startup", DATABASE_URL=f"sqlite:///{db_path}", STATE_BACKEND="memory")
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"], env=env,
+                         capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["total_s"] = time.perf_counter() - t0  # include l'avvio dell'interprete
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", default=DEFAULT_BUDGET)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "startup.db")
+        fresh = run_once(db_path)
+        warm = [run_once(db_path) for _ in range(args.runs)]
+
+    metrics = ("import_s", "schema_s", "first_update_s", "total_s")
+    results = {m: statistics.median(r[m] for r in warm) for m in metrics}
+    results["fresh_schema_s"] = fresh["schema_s"]
+    heavy = sorted({m for r in [fresh, *warm] for m in r["heavy_modules"]})
+
+    print(f"runs: {args.runs} (+1 on an empty database)")
+    for name, value in results.items():
+        print(f"  {name:<16} {value * 1000:8.0f} ms")
+    print(f"  heavy modules at startup: {', '.join(heavy) or 'none'}")
+
+    if not os.path.exists(args.budget):
+        return
+    with open(args.budget) as f:
+        budget = json.load(f)
+    failures = [f"{m}: {results[m] * 1000:.0f} ms > {limit * 1000:.0f} ms"
+                for m, limit in budget.items() if m in results and results[m] > limit]
+    if heavy:
+        failures.append(f"heavy modules imported at startup: {', '.join(heavy)}")
+    if failures:
+        print("❌ startup budget exceeded:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("✅ within startup budget")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Per-set commits vs the group-commit write-behind buffer.
+
+N utenti simulati registrano K serie ciascuno in parallelo (una sessione per
+messaggio, come `capture_set`): nel primo run ogni serie fa il proprio commit, nel
+secondo le righe passano da `WriteBehindBuffer` e vengono scritte con un commit di
+gruppo ogni `--interval-ms`. Riporta serie/s, latenza per serie e numero di commit.
+Il database è un file SQLite temporaneo (o DATABASE_URL se impostata).
+
+Uso:
+    python benchmarks/write_behind.py --users 200 --sets 10 --interval-ms 20
+"""
+import argparse, asyncio, os, statistics, sys, tempfile, time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/write_behind.db")
+
+from sqlalchemy import delete, func, insert, select
+from app.db import get_async_db, upgrade_schema
+from app.models import ExerciseRecap, User, WorkoutLog
+from app.utils.sets import import_key, weight_to_kg
+from app.writebehind import WriteBehindBuffer
+from app import recaps
+
+def _rows(user, n):
+    now = datetime.utcnow()
+    return now, [dict(user_id=user.id, plan_id=None, day="Giorno 1", exercise="Panca",
+                      set_number=user.set_idx + 1, weight="60", weight_kg=weight_to_kg("60"),
+                      reps=n, ts=now, import_key=import_key(now, "Panca", user.set_idx + 1))]
+
+async def _log_direct(user_id, n):
+    async with get_async_db() as db:
+        user = await db.get(User, user_id)
+        now, rows = _rows(user, n)
+        user.set_idx += 1
+        await db.execute(insert(WorkoutLog), rows)
+        await recaps.add_sets(db, user.id, "Panca", now, [("60", n)])
+        await db.commit()
+
+async def _log_buffered(buffer, user_id, n):
+    async with get_async_db() as db:
+        user = await db.get(User, user_id)
+        buffer.overlay(user)
+        now, rows = _rows(user, n)
+        user.set_idx += 1
+        buffer.add(user, rows, "Panca", now, [("60", n)])
+
+async def _run(users, sets, log):
+    latencies = []
+
+    async def one_user(user_id):
+        for n in range(sets):
+            t0 = time.perf_counter()
+            await log(user_id, n)
+            latencies.append(time.perf_counter() - t0)
+            await asyncio.sleep(0)  # gli altri utenti scrivono tra una serie e l'altra
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one_user(uid) for uid in users))
+    return time.perf_counter() - t0, sorted(latencies)
+
+async def _reset(users):
+    async with get_async_db() as db:
+        await db.execute(delete(WorkoutLog))
+        await db.execute(delete(ExerciseRecap))
+        await db.execute(delete(User))
+        await db.execute(insert(User), [dict(id=uid, username=f"u{uid}", current_day="Giorno 1",
+                                             exercise_idx=0, set_idx=0) for uid in users])
+        await db.commit()
+
+async def _check(users, sets):
+    async with get_async_db() as db:
+        logs = (await db.execute(select(func.count()).select_from(WorkoutLog))).scalar()
+        cursors = (await db.execute(select(func.count()).where(User.set_idx == sets))).scalar()
+    return logs == len(users) * sets and cursors == len(users)
+
+def _report(name, elapsed, latencies, total, commits):
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(f"{name:<14} {total / elapsed:9.0f} sets/s  p50 {p(0.5):7.2f} ms  p99 {p(0.99):7.2f} ms  "
+          f"mean {statistics.mean(latencies) * 1000:7.2f} ms  commits {commits}")
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--sets", type=int, default=10)
+    ap.add_argument("--interval-ms", type=int, default=20)
+    ap.add_argument("--max-rows", type=int, default=500)
+    args = ap.parse_args()
+    users = list(range(1, args.users + 1))
+    total = args.users * args.sets
+
+    await _reset(users)
+    elapsed, latencies = await _run(users, args.sets, _log_direct)
+    ok = await _check(users, args.sets)
+    _report("per-set", elapsed, latencies, total, total)
+
+    await _reset(users)
+    buffer = WriteBehindBuffer(enabled=True, interval_ms=args.interval_ms, max_rows=args.max_rows)
+    elapsed, latencies = await _run(users, args.sets, lambda uid, n: _log_buffered(buffer, uid, n))
+    t0 = time.perf_counter()
+    await buffer.close()
+    drain = time.perf_counter() - t0
+    ok = ok and await _check(users, args.sets)
+    _report("write-behind", elapsed + drain, latencies, total, buffer.stats["flushes"])
+    print(f"final drain {drain * 1000:.1f} ms · rows {buffer.stats['rows']} · errors {buffer.stats['errors']}")
+    print("✅ all sets and cursors written" if ok else "❌ missing rows or wrong cursors")
+
+if __name__ == "__main__":
+    upgrade_schema()
+    asyncio.run(main())
@@ -2,31 +2,70 @@ import sys, os, asyncio
 # garantisce che 'app' sia importabile anche se lanci da fuori cartella
 sys.path.append(os.path.dirname(__file__))
 
-from app.config import bot, dp, DATABASE_URL
+from app.config import bot, dp, DATABASE_URL, BOT_MODE
 from app.handlers import get_routers
-from app.db import engine, Base
+from app.db import upgrade_schema
+from app.timers import rest_timers
+from app.writebehind import write_behind
+from app.middlewares import setup_db_session
+from app.metrics import METRICS_PORT, setup_metrics, start_metrics_server
 from app.models import User, WorkoutLog, TrainingPlan
 
 async def main():
     # Debug info per deployment
     print(f"🚀 Avvio bot su Railway...")
     print(f"📊 DATABASE_URL: {DATABASE_URL[:50]}...")  # Mostra solo i primi 50 caratteri per sicurezza
+
+    if BOT_MODE == "webhook":
+        from app.webhook import check_webhook_config
+        try:
+            check_webhook_config()
+        except RuntimeError as e:
+            sys.exit(f"❌ {e}")
     
-    # Create database tables if they don't exist
+    # Apply database migrations (creates the tables on a fresh database)
     try:
-        Base.metadata.create_all(bind=engine)
-        print("✅ Database tables checked/created")
+        if upgrade_schema():
+            print("✅ Database migrations applied")
+        else:
+            print("✅ Schema del database già aggiornato")
     except Exception as e:
         print(f"❌ Errore creazione tabelle: {e}")
         return
 
     for r in get_routers():
         dp.include_router(r)
+    # Una sessione del database per update, con l'utente già caricato (app/middlewares.py)
+    setup_db_session(dp)
+    # Alla chiusura scrive le serie ancora nel buffer write-behind
+    dp.shutdown.register(write_behind.close)
+
+    # Metriche Prometheus su una porta locale (solo con METRICS_PORT)
+    if METRICS_PORT:
+        setup_metrics(dp)
+        metrics_runner = await start_metrics_server()
+        dp.shutdown.register(metrics_runner.cleanup)
+
+    # Riprende i timer di recupero rimasti attivi prima del riavvio
+    restored = await rest_timers.restore(bot)
+    if restored:
+        print(f"⏱️ Timer di recupero ripristinati: {restored}")
 
     print("🤖 Bot avviato (struttura modulare).")
+
+    if BOT_MODE == "webhook":
+        from app.webhook import run_webhook
+        try:
+            await run_webhook(dp, bot)
+        except Exception as e:
+            print(f"❌ Errore del server webhook: {e}")
+        return
+
     print("⏳ Inizio polling...")
     
     try:
+        # Un webhook registrato in precedenza impedirebbe il polling
+        await bot.delete_webhook()
         await dp.start_polling(bot)
     except Exception as e:
         print(f"❌ Errore durante il polling: {e}")
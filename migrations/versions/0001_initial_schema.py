@@ -0,0 +1,64 @@
+"""initial schema (tables previously created by Base.metadata.create_all)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.Column('training_plan', sa.Text(), nullable=True),
+        sa.Column('current_day', sa.String(), nullable=True),
+        sa.Column('exercise_idx', sa.Integer(), nullable=True),
+        sa.Column('set_idx', sa.Integer(), nullable=True),
+        sa.Column('last_updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'training_plans',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('plan_name', sa.String(), nullable=False),
+        sa.Column('plan_data', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('is_active', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'workout_logs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('day', sa.String(), nullable=True),
+        sa.Column('exercise', sa.String(), nullable=True),
+        sa.Column('set_number', sa.Integer(), nullable=True),
+        sa.Column('weight', sa.String(), nullable=True),
+        sa.Column('reps', sa.Integer(), nullable=True),
+        sa.Column('ts', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('workout_logs')
+    op.drop_table('training_plans')
+    op.drop_table('users')
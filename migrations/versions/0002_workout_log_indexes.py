@@ -0,0 +1,92 @@
+"""workout_logs: numeric weight_kg column (backfilled) and composite indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:30:00
+
+"""
+from decimal import Decimal, InvalidOperation
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+
+# (nome, colonne): recap per esercizio (_prompt_next_set) e lookup di back:set
+INDEXES = [
+    ('ix_workout_logs_user_exercise_ts', ['user_id', 'exercise', 'ts']),
+    ('ix_workout_logs_user_day_exercise_ts', ['user_id', 'day', 'exercise', 'ts']),
+]
+
+logs = sa.table(
+    'workout_logs',
+    sa.column('id', sa.Integer),
+    sa.column('weight', sa.String),
+    sa.column('weight_kg', sa.Numeric(7, 2)),
+)
+
+
+def _to_kg(weight):
+    try:
+        value = Decimal(str(weight).strip().replace(',', '.'))
+    except (InvalidOperation, ValueError):
+        return None
+    if not value.is_finite() or abs(value) >= 100000:
+        return None
+    return value.quantize(Decimal('0.01'))
+
+
+def _backfill_weight_kg(bind) -> None:
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(logs.c.id, logs.c.weight)
+            .where(logs.c.id > last_id, logs.c.weight.isnot(None), logs.c.weight_kg.is_(None))
+            .order_by(logs.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        params = [{'b_id': r.id, 'b_kg': kg} for r in rows if (kg := _to_kg(r.weight)) is not None]
+        if params:
+            bind.execute(
+                logs.update().where(logs.c.id == sa.bindparam('b_id')).values(weight_kg=sa.bindparam('b_kg')),
+                params,
+            )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('workout_logs', sa.Column('weight_kg', sa.Numeric(7, 2), nullable=True))
+    _backfill_weight_kg(op.get_bind())
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # CREATE INDEX CONCURRENTLY non può girare in una transazione
+        with op.get_context().autocommit_block():
+            for name, columns in INDEXES:
+                op.create_index(name, 'workout_logs', columns, postgresql_concurrently=True, if_not_exists=True)
+    else:
+        for name, columns in INDEXES:
+            op.create_index(name, 'workout_logs', columns)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, _ in INDEXES:
+                op.drop_index(name, table_name='workout_logs', postgresql_concurrently=True, if_exists=True)
+    else:
+        for name, _ in INDEXES:
+            op.drop_index(name, table_name='workout_logs')
+    with op.batch_alter_table('workout_logs') as batch_op:
+        batch_op.drop_column('weight_kg')
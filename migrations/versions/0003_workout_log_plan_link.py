@@ -0,0 +1,61 @@
+"""link workout_logs and users to training_plans (plan_id / active_plan_id)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+users = sa.table('users', sa.column('id', sa.Integer), sa.column('active_plan_id', sa.Integer))
+logs = sa.table('workout_logs', sa.column('user_id', sa.Integer), sa.column('ts', sa.DateTime), sa.column('plan_id', sa.Integer))
+plans = sa.table('training_plans', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer), sa.column('created_at', sa.DateTime))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('workout_logs') as batch_op:
+        batch_op.add_column(sa.Column('plan_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_workout_logs_plan_id', 'training_plans', ['plan_id'], ['id'])
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('active_plan_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_users_active_plan_id', 'training_plans', ['active_plan_id'], ['id'])
+
+    # Scheda attiva = ultima importata
+    op.execute(users.update().values(
+        active_plan_id=sa.select(sa.func.max(plans.c.id)).where(plans.c.user_id == users.c.id).scalar_subquery()
+    ))
+    # Ogni log appartiene all'ultima scheda importata prima della serie (o alla prima, se nessuna)
+    before = sa.select(sa.func.max(plans.c.id)).where(plans.c.user_id == logs.c.user_id, plans.c.created_at <= logs.c.ts)
+    first = sa.select(sa.func.min(plans.c.id)).where(plans.c.user_id == logs.c.user_id)
+    op.execute(logs.update().values(
+        plan_id=sa.func.coalesce(before.scalar_subquery(), first.scalar_subquery())
+    ))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index('ix_workout_logs_user_plan_ts', 'workout_logs', ['user_id', 'plan_id', 'ts'],
+                            postgresql_concurrently=True, if_not_exists=True)
+    else:
+        op.create_index('ix_workout_logs_user_plan_ts', 'workout_logs', ['user_id', 'plan_id', 'ts'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_workout_logs_user_plan_ts', table_name='workout_logs')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_constraint('fk_users_active_plan_id', type_='foreignkey')
+        batch_op.drop_column('active_plan_id')
+    with op.batch_alter_table('workout_logs') as batch_op:
+        batch_op.drop_constraint('fk_workout_logs_plan_id', type_='foreignkey')
+        batch_op.drop_column('plan_id')
@@ -0,0 +1,192 @@
+"""normalized, content-addressed plans (plan_days / plan_exercises) replacing the plan JSON columns
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 12:00:00
+
+"""
+import hashlib
+import json
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+users = sa.table(
+    'users',
+    sa.column('id', sa.Integer),
+    sa.column('training_plan', sa.Text),
+    sa.column('active_plan_id', sa.Integer),
+    sa.column('last_updated', sa.DateTime),
+)
+plans = sa.table(
+    'training_plans',
+    sa.column('id', sa.Integer),
+    sa.column('user_id', sa.Integer),
+    sa.column('plan_name', sa.String),
+    sa.column('plan_data', sa.Text),
+    sa.column('content_hash', sa.String),
+    sa.column('created_at', sa.DateTime),
+    sa.column('is_active', sa.Integer),
+)
+plan_days = sa.table(
+    'plan_days',
+    sa.column('plan_hash', sa.String),
+    sa.column('position', sa.Integer),
+    sa.column('name', sa.String),
+    sa.column('day_hash', sa.String),
+)
+plan_exercises = sa.table(
+    'plan_exercises',
+    sa.column('day_hash', sa.String),
+    sa.column('position', sa.Integer),
+    sa.column('name', sa.String),
+    sa.column('sets', sa.Integer),
+    sa.column('reps', sa.String),
+    sa.column('rest', sa.String),
+)
+
+
+# Stesso formato canonico di app/plans.py (copiato: la migrazione non deve dipendere dal codice dell'app)
+def _digest(value) -> str:
+    data = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+def _exercise_values(ex: dict) -> list:
+    return [str(ex['name']), int(ex['sets']), str(ex['reps']), str(ex['rest'])]
+
+
+def _load_json(data) -> dict:
+    try:
+        plan = json.loads(data) if data else {}
+    except ValueError:
+        return {}
+    return plan if isinstance(plan, dict) else {}
+
+
+def _backfill_content(bind) -> None:
+    # Utenti con la sola colonna JSON (nessun training_plans): la scheda diventa un piano
+    orphans = bind.execute(
+        sa.select(users.c.id, users.c.training_plan, users.c.last_updated)
+        .where(users.c.training_plan.isnot(None), users.c.active_plan_id.is_(None))
+    ).all()
+    for row in orphans:
+        plan_id = bind.execute(plans.insert().values(
+            user_id=row.id, plan_name='Scheda', plan_data=row.training_plan,
+            created_at=row.last_updated or datetime.now(), is_active=1,
+        ).returning(plans.c.id)).scalar()
+        bind.execute(users.update().where(users.c.id == row.id).values(active_plan_id=plan_id))
+    # Dopo un reset la scheda JSON era vuota ma active_plan_id restava: ora è il puntatore a decidere
+    bind.execute(users.update().where(users.c.training_plan.is_(None)).values(active_plan_id=None))
+
+    known_plans, known_days = set(), set()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(plans.c.id, plans.c.plan_data).where(plans.c.id > last_id).order_by(plans.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        day_rows, exercise_rows, hashes = [], [], []
+        for row in rows:
+            plan = _load_json(row.plan_data)
+            days = [(name, _digest([_exercise_values(ex) for ex in exercises])) for name, exercises in plan.items()]
+            content_hash = _digest(days)
+            hashes.append({'b_id': row.id, 'b_hash': content_hash})
+            if content_hash in known_plans:
+                continue
+            known_plans.add(content_hash)
+            day_rows.extend(dict(plan_hash=content_hash, position=i, name=name, day_hash=h)
+                            for i, (name, h) in enumerate(days))
+            for (_, h), exercises in zip(days, plan.values()):
+                if h in known_days:
+                    continue
+                known_days.add(h)
+                exercise_rows.extend(
+                    dict(day_hash=h, position=i, name=name, sets=sets, reps=reps, rest=rest)
+                    for i, (name, sets, reps, rest) in enumerate(map(_exercise_values, exercises))
+                )
+        if exercise_rows:
+            bind.execute(plan_exercises.insert(), exercise_rows)
+        if day_rows:
+            bind.execute(plan_days.insert(), day_rows)
+        bind.execute(
+            plans.update().where(plans.c.id == sa.bindparam('b_id')).values(content_hash=sa.bindparam('b_hash')),
+            hashes,
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'plan_exercises',
+        sa.Column('day_hash', sa.String(), nullable=False),
+        sa.Column('position', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('sets', sa.Integer(), nullable=False),
+        sa.Column('reps', sa.String(), nullable=False),
+        sa.Column('rest', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('day_hash', 'position'),
+    )
+    op.create_table(
+        'plan_days',
+        sa.Column('plan_hash', sa.String(), nullable=False),
+        sa.Column('position', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('day_hash', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('plan_hash', 'position'),
+    )
+    op.add_column('training_plans', sa.Column('content_hash', sa.String(), nullable=True))
+
+    _backfill_content(op.get_bind())
+
+    with op.batch_alter_table('training_plans') as batch_op:
+        batch_op.alter_column('content_hash', existing_type=sa.String(), nullable=False)
+        batch_op.drop_column('plan_data')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('training_plan')
+    op.create_index('ix_training_plans_user_content', 'training_plans', ['user_id', 'content_hash'])
+    op.create_index('ix_users_active_plan_id', 'users', ['active_plan_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_active_plan_id', table_name='users')
+    op.drop_index('ix_training_plans_user_content', table_name='training_plans')
+    op.add_column('users', sa.Column('training_plan', sa.Text(), nullable=True))
+    op.add_column('training_plans', sa.Column('plan_data', sa.Text(), nullable=True))
+
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.select(plan_days.c.plan_hash, plan_days.c.name.label('day'), plan_exercises.c.name,
+                  plan_exercises.c.sets, plan_exercises.c.reps, plan_exercises.c.rest)
+        .join(plan_exercises, plan_exercises.c.day_hash == plan_days.c.day_hash)
+        .order_by(plan_days.c.plan_hash, plan_days.c.position, plan_exercises.c.position)
+    ).all()
+    contents: dict[str, dict] = {}
+    for row in rows:
+        contents.setdefault(row.plan_hash, {}).setdefault(row.day, []).append(
+            {'name': row.name, 'sets': row.sets, 'reps': row.reps, 'rest': row.rest})
+    for content_hash, plan in contents.items():
+        bind.execute(plans.update().where(plans.c.content_hash == content_hash)
+                     .values(plan_data=json.dumps(plan, ensure_ascii=False)))
+    bind.execute(users.update().values(training_plan=(
+        sa.select(plans.c.plan_data).where(plans.c.id == users.c.active_plan_id).scalar_subquery()
+    )))
+
+    with op.batch_alter_table('training_plans') as batch_op:
+        batch_op.drop_column('content_hash')
+    op.drop_table('plan_days')
+    op.drop_table('plan_exercises')
@@ -0,0 +1,72 @@
+"""workout_rollups and workout_log_archive for the compaction of old workout logs
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 13:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, Sequence[str], None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Su Postgres l'archivio è partizionato per mese: le partizioni le crea scripts/compact_logs.py
+    op.create_table(
+        'workout_log_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('ts', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('plan_id', sa.Integer(), nullable=True),
+        sa.Column('day', sa.String(), nullable=True),
+        sa.Column('exercise', sa.String(), nullable=True),
+        sa.Column('set_number', sa.Integer(), nullable=True),
+        sa.Column('weight', sa.String(), nullable=True),
+        sa.Column('weight_kg', sa.Numeric(7, 2, asdecimal=False), nullable=True),
+        sa.Column('reps', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id', 'ts'),
+        postgresql_partition_by='RANGE (ts)',
+    )
+    op.create_index('ix_workout_log_archive_user_exercise_ts', 'workout_log_archive', ['user_id', 'exercise', 'ts'])
+    op.create_table(
+        'workout_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('plan_id', sa.Integer(), nullable=True),
+        sa.Column('day', sa.String(), nullable=True),
+        sa.Column('exercise', sa.String(), nullable=True),
+        sa.Column('session', sa.Date(), nullable=False),
+        sa.Column('first_ts', sa.DateTime(), nullable=False),
+        sa.Column('first_log_id', sa.Integer(), nullable=False),
+        sa.Column('sets', sa.Integer(), nullable=False),
+        sa.Column('volume', sa.Numeric(12, 2, asdecimal=False), nullable=True),
+        sa.Column('weight', sa.String(), nullable=True),
+        sa.Column('weight_kg', sa.Numeric(7, 2, asdecimal=False), nullable=True),
+        sa.Column('reps', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['plan_id'], ['training_plans.id'], name='fk_workout_rollups_plan_id'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_workout_rollups_user_plan_ts', 'workout_rollups', ['user_id', 'plan_id', 'first_ts'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # I log archiviati tornano in workout_logs; i rollup sono solo riassunti e si buttano
+    op.execute(
+        "INSERT INTO workout_logs (id, user_id, plan_id, day, exercise, set_number, weight, weight_kg, reps, ts) "
+        "SELECT id, user_id, plan_id, day, exercise, set_number, weight, weight_kg, reps, ts FROM workout_log_archive"
+    )
+    op.drop_index('ix_workout_rollups_user_plan_ts', table_name='workout_rollups')
+    op.drop_table('workout_rollups')
+    op.drop_index('ix_workout_log_archive_user_exercise_ts', table_name='workout_log_archive')
+    op.drop_table('workout_log_archive')
@@ -0,0 +1,114 @@
+"""import_key on workout_logs / workout_log_archive for idempotent history imports
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 14:00:00
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, Sequence[str], None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+
+
+def _table(name):
+    return sa.table(
+        name,
+        sa.column('id', sa.Integer),
+        sa.column('ts', sa.DateTime),
+        sa.column('user_id', sa.BigInteger),
+        sa.column('exercise', sa.String),
+        sa.column('set_number', sa.Integer),
+        sa.column('import_key', sa.String),
+    )
+
+
+logs = _table('workout_logs')
+archive = _table('workout_log_archive')
+
+
+def _import_key(ts, exercise, set_number):
+    # Stessa chiave di app/utils/sets.py:import_key (copiata: la migrazione non deve cambiare con l'app)
+    data = f"{ts:%Y-%m-%dT%H:%M:%S}|{exercise}|{set_number}"
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+def _backfill(bind, t) -> None:
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(t.c.id, t.c.ts, t.c.exercise, t.c.set_number)
+            .where(t.c.id > last_id)
+            .order_by(t.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        params = [
+            {'b_id': r.id, 'b_ts': r.ts, 'b_key': _import_key(r.ts, r.exercise, r.set_number)}
+            for r in rows
+            if r.ts is not None and r.exercise is not None and r.set_number is not None
+        ]
+        if params:
+            where = [t.c.id == sa.bindparam('b_id')]
+            if bind.dialect.name == 'postgresql':
+                # Sull'archivio partizionato per ts l'UPDATE tocca una sola partizione
+                where.append(t.c.ts == sa.bindparam('b_ts'))
+            bind.execute(t.update().where(*where).values(import_key=sa.bindparam('b_key')), params)
+
+
+def _drop_duplicate_keys(bind) -> None:
+    # Due serie dello stesso utente con stessi secondo, esercizio e numero di serie (solo
+    # dati vecchi): la chiave resta alla prima, così l'indice unico si può creare
+    first = (
+        sa.select(sa.func.min(logs.c.id))
+        .where(logs.c.import_key.isnot(None))
+        .group_by(logs.c.user_id, logs.c.import_key)
+    )
+    bind.execute(
+        logs.update()
+        .where(logs.c.import_key.isnot(None), logs.c.id.notin_(first.scalar_subquery()))
+        .values(import_key=None)
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # La chiave naturale di ogni serie, sia registrata nel bot sia importata da file:
+    # anche le serie già salvate la ricevono, così reimportare un /export non le duplica
+    op.add_column('workout_logs', sa.Column('import_key', sa.String(), nullable=True))
+    op.add_column('workout_log_archive', sa.Column('import_key', sa.String(), nullable=True))
+    bind = op.get_bind()
+    _backfill(bind, logs)
+    _backfill(bind, archive)
+    _drop_duplicate_keys(bind)
+    op.create_index('ix_workout_log_archive_user_import_key', 'workout_log_archive', ['user_id', 'import_key'])
+
+    if bind.dialect.name == 'postgresql':
+        # CREATE INDEX CONCURRENTLY non può girare in una transazione
+        with op.get_context().autocommit_block():
+            op.create_index('ux_workout_logs_user_import_key', 'workout_logs', ['user_id', 'import_key'],
+                            unique=True, postgresql_concurrently=True, if_not_exists=True)
+    else:
+        op.create_index('ux_workout_logs_user_import_key', 'workout_logs', ['user_id', 'import_key'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_workout_logs_user_import_key', table_name='workout_logs')
+    op.drop_index('ix_workout_log_archive_user_import_key', table_name='workout_log_archive')
+    with op.batch_alter_table('workout_log_archive') as batch_op:
+        batch_op.drop_column('import_key')
+    with op.batch_alter_table('workout_logs') as batch_op:
+        batch_op.drop_column('import_key')
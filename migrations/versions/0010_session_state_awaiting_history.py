@@ -0,0 +1,30 @@
+"""session_state.awaiting_history: the next upload is a history file (/import_history)
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 16:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, Sequence[str], None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('session_state', sa.Column('awaiting_history', sa.Boolean(), nullable=False,
+                                             server_default=sa.false()))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('session_state') as batch_op:
+        batch_op.drop_column('awaiting_history')
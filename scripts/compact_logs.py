@@ -0,0 +1,24 @@
+"""Compact old workout logs into per-session rollups and move them to the archive.
+
+Da lanciare periodicamente (es. ogni notte con cron); può girare con il bot attivo:
+    python scripts/compact_logs.py [--days 90] [--batch 5000]
+"""
+import argparse, asyncio, os, sys
+from datetime import timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.compaction import COMPACT_AFTER_DAYS, COMPACT_BATCH_SIZE, compact_logs
+from app.db import get_async_db
+
+async def main(days: int, batch: int):
+    async with get_async_db() as db:
+        stats = await compact_logs(db, timedelta(days=days), batch)
+    print(f"✅ Log compattati: {stats['logs']} serie in {stats['rollups']} rollup (più vecchie di {days} giorni)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=COMPACT_AFTER_DAYS, help="età minima dei log da compattare")
+    parser.add_argument("--batch", type=int, default=COMPACT_BATCH_SIZE, help="log per transazione")
+    args = parser.parse_args()
+    asyncio.run(main(args.days, args.batch))
@@ -0,0 +1,33 @@
+"""POST recorded Telegram updates to a locally running webhook server.
+
+Ogni file può contenere un singolo update JSON oppure un update per riga (JSON lines).
+    BOT_MODE=webhook WEBHOOK_SECRET=s3cret python main.py
+    python scripts/post_update.py scripts/updates/start.json --secret s3cret
+"""
+import argparse, asyncio, json, os, sys
+from aiohttp import ClientSession
+
+def _load(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        content = f.read().strip()
+    try:
+        return [json.loads(content)]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('PORT', '8080')}{os.getenv('WEBHOOK_PATH', '/webhook')}")
+    ap.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    args = ap.parse_args()
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    async with ClientSession() as session:
+        for path in args.files:
+            for update in _load(path):
+                async with session.post(args.url, json=update, headers=headers) as resp:
+                    print(f"{path} update {update.get('update_id')}: {resp.status} {await resp.text()}")
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
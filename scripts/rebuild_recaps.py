@@ -0,0 +1,20 @@
+"""Rebuild the exercise_recaps summary table from workout_logs.
+
+Da lanciare una volta dopo la migrazione 0004 (o se il recap risulta incoerente):
+    python scripts/rebuild_recaps.py
+"""
+import asyncio, os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import get_async_db
+from app.recaps import rebuild_all_recaps
+
+async def main():
+    async with get_async_db() as db:
+        count = await rebuild_all_recaps(db)
+        await db.commit()
+    print(f"✅ Recap ricostruiti: {count}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
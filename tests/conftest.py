@@ -0,0 +1,55 @@
+"""Shared test setup: a throwaway database, one event loop for the whole run, query budgets.
+
+I test non toccano mai DATABASE_URL dell'ambiente: usano un SQLite temporaneo (o
+TEST_DATABASE_URL se impostata, es. per provare PostgreSQL). Non serve pytest-asyncio:
+la fixture `run` esegue una coroutine sull'unico event loop della sessione, quello a
+cui restano legati engine async e dispatcher.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]  # app/ e il bot finto di load_harness.py
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/tests.db")
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ["STATE_BACKEND"] = "db"  # il default in produzione
+os.environ["WRITE_BEHIND"] = "0"
+
+from app.utils.query_budget import query_budget as _query_budget  # noqa: E402
+
+@pytest.fixture(scope="session")
+def run():
+    """`run(coro)`: run a coroutine on the session event loop, with the schema migrated"""
+    from app.db import upgrade_schema
+    from app.imports import plan_importer
+    from app.timers import rest_timers
+
+    upgrade_schema()
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.run_until_complete(rest_timers.shutdown())
+    plan_importer.shutdown()
+    # Come asyncio.run: i task rimasti (scheduler dei timer, coda in uscita) vanno chiusi
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    if pending:
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    loop.close()
+
+@pytest.fixture(scope="session")
+def harness(run):
+    """Real routers and middlewares with a fake bot (benchmarks/load_harness.py)"""
+    from load_harness import Harness
+
+    return Harness(argparse.Namespace(seed=0, think_ms=0))
+
+@pytest.fixture(name="query_budget")
+def query_budget_fixture():
+    """`with query_budget(n, label=...):` fails the test if the block runs more than n queries"""
+    return _query_budget
@@ -0,0 +1,132 @@
+"""Round trip: sets logged in the bot, exported with /export and imported back.
+
+Le serie registrate con `capture_set` hanno la stessa chiave naturale (`import_key`)
+delle righe del loro export: reimportare il file, anche più volte e anche dopo la
+compattazione dei log, non deve aggiungere nessuna serie. Un file viene letto come
+storico solo dopo /import_history, e quelli troppo grandi non vengono scaricati.
+"""
+import io
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+from aiogram.types import Document
+from sqlalchemy import func, select
+
+from load_harness import callback_update, message_update
+from app.compaction import compact_logs
+from app.db import get_async_db
+from app.exports import write_history
+from app.history_import import HISTORY_MAX_BYTES, import_history
+from app.writebehind import insert_sets
+from app.models import User, WorkoutLog, WorkoutLogArchive
+from app.utils.sets import import_key
+from app.utils.history_parser import open_history
+
+_uids = itertools.count(2000)
+
+async def _log_sets(harness) -> int:
+    """A user who logs three sets through the bot: one message with one set, one with two"""
+    uid = next(_uids)
+    for update in (
+        message_update(uid, "/start"),
+        message_update(uid, document=Document(
+            file_id=f"plan{uid}", file_unique_id=f"plan{uid}", file_name="scheda.xlsx", file_size=8000)),
+        message_update(uid, "/workout"),
+        callback_update(uid, "day:Giorno 1"),
+        message_update(uid, "60 8"),
+        message_update(uid, "60x8 62,5x8"),
+    ):
+        assert not (await harness.feed(update))["error"]
+    return uid
+
+async def _export(uid: int, fmt: str) -> bytes:
+    out = io.BytesIO()
+    async with get_async_db() as db:
+        assert await write_history(db, uid, fmt, out) == 3
+    return out.getvalue()
+
+async def _import(uid: int, data: bytes, fmt: str):
+    reader = open_history(data, fmt)
+    assert reader is not None
+    async with get_async_db() as db:
+        return await import_history(db, await db.get(User, uid), reader)
+
+async def _count(uid: int) -> int:
+    async with get_async_db() as db:
+        hot = await db.scalar(select(func.count()).select_from(WorkoutLog).where(WorkoutLog.user_id == uid))
+        archived = await db.scalar(
+            select(func.count()).select_from(WorkoutLogArchive).where(WorkoutLogArchive.user_id == uid))
+    return hot + archived
+
+@pytest.mark.parametrize("fmt", ["csv", "xlsx"])
+def test_reimporting_an_export_adds_nothing(fmt, run, harness):
+    uid = run(_log_sets(harness))
+    data = run(_export(uid, fmt))
+
+    for _ in range(2):
+        result = run(_import(uid, data, fmt))
+        assert (result.rows, result.inserted, result.duplicates, result.invalid) == (3, 0, 3, 0)
+        assert run(_count(uid)) == 3
+
+    # Dopo la compattazione le serie sono nell'archivio: l'import le salta lo stesso
+    async def compact():
+        async with get_async_db() as db:
+            return await compact_logs(db, older_than=timedelta(0), now=datetime.utcnow() + timedelta(days=1))
+    assert run(compact())["logs"] > 0
+    result = run(_import(uid, data, fmt))
+    assert (result.inserted, result.duplicates) == (0, 3)
+    assert run(_count(uid)) == 3
+
+def _history_document(uid: int, fmt: str, size: int) -> Document:
+    return Document(file_id=f"history{uid}", file_unique_id=f"history{uid}",
+                    file_name=f"storico.{fmt}", file_size=size)
+
+def test_history_file_is_imported_only_after_import_history(run, harness, monkeypatch):
+    uid = run(_log_sets(harness))
+    data = run(_export(uid, "csv"))
+    monkeypatch.setattr(harness.session, "plan_bytes", data)
+
+    stats = run(harness.feed(message_update(uid, "/import_history")))
+    assert stats["handler"] == "import_history_cmd"
+    stats = run(harness.feed(message_update(uid, document=_history_document(uid, "csv", len(data)))))
+    assert (stats["handler"], stats["error"], stats["sessions"]) == ("handle_excel", False, 1)
+    assert "Storico importato" in harness.session.last_text[uid]
+    assert "Già presenti: <b>3</b>" in harness.session.last_text[uid]
+
+    # Senza /import_history lo stesso file è una scheda, come prima
+    run(harness.feed(message_update(uid, document=_history_document(uid, "csv", len(data)))))
+    assert "Storico importato" not in harness.session.last_text[uid]
+    assert run(_count(uid)) == 3
+
+def test_oversized_history_file_is_not_downloaded(run, harness, monkeypatch):
+    uid = run(_log_sets(harness))
+    downloads = []
+    async def stream_content(*args, **kwargs):
+        downloads.append(args)
+        yield b""
+    monkeypatch.setattr(harness.session, "stream_content", stream_content)
+
+    run(harness.feed(message_update(uid, "/import_history")))
+    stats = run(harness.feed(message_update(uid, document=_history_document(uid, "xlsx", HISTORY_MAX_BYTES + 1))))
+    assert stats["handler"] == "handle_excel"
+    assert "Importazione annullata" in harness.session.last_text[uid]
+    assert downloads == []
+
+def test_bot_logged_sets_are_never_dropped_on_a_key_collision(run, harness):
+    # Stesso secondo, esercizio e numero di serie (es. due messaggi elaborati insieme):
+    # la serie è stata confermata all'utente, quindi va salvata anche senza chiave
+    uid = next(_uids)
+    run(harness.feed(message_update(uid, "/start")))
+    ts = datetime(2025, 3, 1, 18, 0, 0)
+    row = dict(user_id=uid, exercise="Panca", set_number=1, weight="60", reps=8, ts=ts,
+               import_key=import_key(ts, "Panca", 1))
+
+    async def log(rows):
+        async with get_async_db() as db:
+            unkeyed = await insert_sets(db, rows)
+            await db.commit()
+            return unkeyed
+    assert run(log([row])) == 0
+    assert run(log([row, dict(row, reps=7)])) == 2
+    assert run(_count(uid)) == 3
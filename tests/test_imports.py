@@ -0,0 +1,38 @@
+"""Import worker pool (app/imports.py): a job that times out only stops its own worker."""
+import asyncio
+import time
+
+import pytest
+
+from app.imports import ImportRejected, PlanImporter
+
+def test_timeout_kills_only_the_slow_job(run):
+    importer = PlanImporter(workers=2, max_queued=4)
+
+    async def scenario():
+        slow = asyncio.create_task(importer._run(1, time.sleep, 30))
+        other = asyncio.create_task(importer._run(30, sum, [1, 2, 3]))
+        await asyncio.sleep(0)
+        # L'altro job gira ancora quando il primo va in timeout
+        late = asyncio.create_task(importer._run(30, _slow_sum, [4, 5]))
+        with pytest.raises(ImportRejected, match="più di 1s"):
+            await slow
+        return await other, await late, await importer._run(30, sum, [6])
+
+    try:
+        assert run(scenario()) == (6, 9, 6)
+    finally:
+        importer.shutdown()
+
+def test_job_errors_reach_the_caller(run):
+    importer = PlanImporter(workers=1)
+    try:
+        with pytest.raises(ValueError):
+            run(importer._run(30, int, "x"))
+        assert run(importer._run(30, int, "7")) == 7  # il worker resta utilizzabile
+    finally:
+        importer.shutdown()
+
+def _slow_sum(values):
+    time.sleep(2)
+    return sum(values)
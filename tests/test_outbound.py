@@ -0,0 +1,36 @@
+"""Send queue (app/outbound.py): only LOW calls are merged or dropped, and they return None."""
+import asyncio
+from types import SimpleNamespace
+
+from app.outbound import HIGH, LOW, NORMAL, SendQueue, send_priority
+
+async def _send_all(queue, *calls):
+    """Queue `(priority, merge_key, text)` calls together; returns (results, texts actually sent)"""
+    sent = []
+
+    async def make_request(bot, method):
+        sent.append(method.text)
+        return method.text
+
+    async def call(priority, merge_key, text):
+        with send_priority(priority, merge_key=merge_key):
+            return await queue(make_request, None, SimpleNamespace(chat_id=1, text=text))
+
+    try:
+        results = await asyncio.gather(*(call(*c) for c in calls))
+    finally:
+        queue._task.cancel()
+    return results, sent
+
+def test_only_low_calls_are_superseded(run):
+    key = (1, 10)
+    results, sent = run(_send_all(SendQueue(), (LOW, key, "refresh"), (NORMAL, key, "fine"), (LOW, key, "dopo")))
+    assert results == [None, "fine", "dopo"]
+    assert sent == ["fine", "dopo"]
+
+def test_dropped_low_calls_return_none(run):
+    queue = SendQueue(low_queue_limit=1)
+    results, sent = run(_send_all(queue, (LOW, None, "vecchio"), (HIGH, None, "prompt"), (LOW, None, "nuovo")))
+    assert results == [None, "prompt", "nuovo"]
+    assert sent == ["prompt", "nuovo"]
+    assert queue.counters["dropped"] == 1
@@ -0,0 +1,118 @@
+"""Query budgets of the hot handlers of `app/handlers/workout.py`.
+
+Ogni test crea un utente nuovo (scheda importata, tre mesi di storico), ripete senza
+misurarli i passi che portano l'allenamento allo stato giusto e poi manda l'update
+del suo handler dentro `query_budget()`: fallisce se supera il budget di
+`tests/query_budgets.json` o ripete la stessa SELECT (pattern N+1), e se l'update
+apre più di una sessione del database. Le cache delle pagine vengono svuotate prima
+del passo misurato (percorso a freddo).
+"""
+import itertools
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from aiogram.types import Document
+from sqlalchemy import insert
+
+from load_harness import callback_update, message_update
+from app.db import get_async_db
+from app.models import User, WorkoutLog
+from app.recaps import rebuild_recap
+from app.rendering import page_cache
+from app.utils.sets import weight_to_kg
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_budgets.json")
+with open(BUDGETS_PATH) as f:
+    BUDGETS = json.load(f)
+
+HISTORY_DAYS = 90
+EXERCISES = ("Panca piana", "Squat", "Rematore", "Military Press")
+_uids = itertools.count(1000)  # tests/test_history_import.py usa 2000+
+
+def _button(harness, uid, prefix: str) -> str:
+    markup = harness.session.last_markup.get(uid)
+    for row in getattr(markup, "inline_keyboard", None) or []:
+        for button in row:
+            if button.callback_data and button.callback_data.startswith(prefix):
+                return button.callback_data
+    raise AssertionError(f"nessun pulsante {prefix!r} nell'ultimo messaggio: {harness.session.last_text.get(uid)!r}")
+
+# (nome del passo, update): in ordine, ognuno parte dallo stato lasciato dai precedenti
+STEPS = [
+    ("workout_cmd", lambda h, uid, plan_id: message_update(uid, "/workout")),
+    ("choose_day", lambda h, uid, plan_id: callback_update(uid, "day:Giorno 1")),
+    ("capture_set", lambda h, uid, plan_id: message_update(uid, "60 8")),
+    ("capture_set:multi", lambda h, uid, plan_id: message_update(uid, "60x8 62,5x8")),
+    ("capture_set:exercise_done", lambda h, uid, plan_id: message_update(uid, "65 6")),
+    ("skip_set_callback", lambda h, uid, plan_id: callback_update(uid, "skip:set")),
+    ("back_set_callback", lambda h, uid, plan_id: callback_update(uid, "back:set")),
+    ("view_plan_current_callback", lambda h, uid, plan_id: callback_update(uid, "view_plan_current")),
+    ("view_plan_cmd", lambda h, uid, plan_id: message_update(uid, "/view_plan")),
+    ("progress_callback", lambda h, uid, plan_id: callback_update(uid, "view_progress")),
+    ("select_progress_plan", lambda h, uid, plan_id: callback_update(uid, f"progress_plan:{plan_id}")),
+    ("progress_page_callback", lambda h, uid, plan_id: callback_update(uid, _button(h, uid, "pp:"))),
+    ("cancel_workout_confirm_callback", lambda h, uid, plan_id: callback_update(uid, "cancel_workout_confirm")),
+]
+
+async def _seed_history(uid: int) -> int:
+    """Three months of Giorno 1 sessions, so progress has several pages"""
+    async with get_async_db() as db:
+        user = await db.get(User, uid)
+        start = datetime.utcnow() - timedelta(days=HISTORY_DAYS)
+        await db.execute(insert(WorkoutLog), [
+            dict(user_id=uid, plan_id=user.active_plan_id, day="Giorno 1", exercise=exercise, set_number=n,
+                 weight="60", weight_kg=weight_to_kg("60"), reps=8, ts=start + timedelta(days=d, minutes=i * 3 + n))
+            for d in range(0, HISTORY_DAYS, 2)
+            for i, exercise in enumerate(EXERCISES)
+            for n in range(1, 4)
+        ])
+        for exercise in EXERCISES:
+            await rebuild_recap(db, uid, exercise)
+        await db.commit()
+        return user.active_plan_id
+
+async def _new_user(harness) -> tuple[int, int]:
+    uid = next(_uids)
+    await harness.feed(message_update(uid, "/start"))
+    await harness.feed(message_update(uid, document=Document(
+        file_id=f"plan{uid}", file_unique_id=f"plan{uid}", file_name="scheda.xlsx", file_size=8000)))
+    return uid, await _seed_history(uid)
+
+def test_budgets_cover_every_step():
+    assert [name for name, _ in STEPS] == list(BUDGETS)
+
+@pytest.mark.parametrize("step", range(len(STEPS)), ids=[name for name, _ in STEPS])
+def test_query_budget(step, run, harness, query_budget):
+    name, make_update = STEPS[step]
+    uid, plan_id = run(_new_user(harness))
+    for _, previous in STEPS[:step]:
+        assert not run(harness.feed(previous(harness, uid, plan_id)))["error"]
+
+    page_cache.invalidate(uid)
+    update = make_update(harness, uid, plan_id)
+    with query_budget(BUDGETS[name], label=name):
+        stats = run(harness.feed(update))
+    assert not stats["error"]
+    assert stats["handler"] == name.split(":")[0]
+    assert stats["sessions"] == 1  # anche lo stato e i timer usano la sessione dell'update
+
+def test_chat_outside_a_workout_skips_the_user_upsert(run, harness, query_budget):
+    # capture_set riceve ogni messaggio non gestito: fuori da un allenamento basta il
+    # SELECT dell'utente con awaiting_set, senza INSERT ... ON CONFLICT dell'utente
+    uid = next(_uids)
+    with query_budget(1, label="capture_set:not_awaiting") as counter:
+        stats = run(harness.feed(message_update(uid, "ciao")))
+    assert not stats["error"]
+    assert stats["handler"] == "unhandled"
+    assert stats["sessions"] == 1
+    assert not [s for s in counter.statements if not s.upper().startswith("SELECT")]
+
+def test_known_user_is_read_without_the_upsert(run, harness, query_budget):
+    # Cache d'identità: dopo il primo update l'utente viene solo letto, cursore compreso
+    uid, _ = run(_new_user(harness))
+    with query_budget(BUDGETS["view_plan_cmd"], label="view_plan_cmd:cached") as counter:
+        stats = run(harness.feed(message_update(uid, "/view_plan")))
+    assert (stats["handler"], stats["error"]) == ("view_plan_cmd", False)
+    assert not [s for s in counter.statements if not s.upper().startswith("SELECT")]
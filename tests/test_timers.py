@@ -0,0 +1,58 @@
+"""Rest timers (app/timers.py): transient Telegram errors are retried, not fatal."""
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramServerError
+
+from app.state import MemoryStateStore
+from app.timers import RestTimerScheduler
+
+class FlakyBot:
+    """edit_message_text fails with the queued errors (None = success), then succeeds"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.texts = []
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        self.texts.append(text)
+
+class FakeMessage:
+    def __init__(self, bot):
+        self.bot = bot
+        self.chat = SimpleNamespace(id=1)
+
+    async def answer(self, text):
+        return SimpleNamespace(chat=self.chat, message_id=1)
+
+async def _rest(bot, seconds: int, wait: float):
+    """Run a `seconds` timer for user 1 and return (scheduler, store) after `wait` seconds"""
+    store = MemoryStateStore()
+    scheduler = RestTimerScheduler(store=store)
+    await scheduler.start(None, FakeMessage(bot), 1, seconds, "Panca", f"{seconds}s")
+    await asyncio.sleep(wait)
+    await scheduler.shutdown()
+    return scheduler, store
+
+def _completed(bot) -> bool:
+    return any("Completato" in text for text in bot.texts)
+
+def test_network_error_on_a_refresh_keeps_the_timer(run):
+    bot = FlakyBot(TelegramNetworkError(method=None, message="timeout"))
+    scheduler, store = run(_rest(bot, 2, 2.5))
+    assert _completed(bot)
+    assert 1 not in scheduler and not store.timers
+
+def test_server_error_on_the_final_edit_is_retried(run):
+    bot = FlakyBot(None, TelegramServerError(method=None, message="Bad Gateway"))
+    scheduler, store = run(_rest(bot, 2, 3.5))
+    assert _completed(bot)
+
+def test_deleted_message_drops_the_timer(run):
+    bot = FlakyBot(TelegramBadRequest(method=None, message="Bad Request: message to edit not found"))
+    scheduler, store = run(_rest(bot, 2, 2.5))
+    assert not _completed(bot)
+    assert 1 not in scheduler and not store.timers